@@ -0,0 +1,252 @@
+import asyncio
+import ssl
+from collections import namedtuple
+from urllib.parse import urlparse, urljoin
+
+from parser import *
+from charset import ByteStreamDecoder
+from compression import ContentDecoder, ACCEPT_ENCODING
+
+'''
+    asyncio batch fetching: many URLs are downloaded concurrently and every body is fed
+    to push-mode HTMLDomParser while it arrives, so network waits of different pages overlap.
+    Only stdlib is used: plain HTTP/1.1 over asyncio streams, with keep-alive connections reused between requests.
+    Compressed bodies are asked for and decompressed chunk by chunk, see compression.py
+'''
+
+# result of fetching one url: exactly one of document and error is not None
+FetchResult = namedtuple("FetchResult", ["url", "document", "error"])
+
+# responses which never have a body, whatever their headers are(besides all 1xx)
+NO_BODY_CODES = (204, 304)
+
+
+class AsyncFetchError(Exception):
+    pass
+
+
+'''
+    Keep-alive connections for asyncio, keyed by (scheme, host, port).
+    Not thread-safe: must be used from one event loop.
+'''
+class AsyncConnectionPool:
+
+    MAX_PER_HOST = 8
+
+    def __init__(self, maxPerHost=MAX_PER_HOST, sslContext=None):
+        self.__maxPerHost = maxPerHost
+        self.__sslContext = sslContext
+        # key -> list of tuples(reader, writer)
+        self.__idle = {}
+        # key -> semaphore, limiting connections to one host
+        self.__limits = {}
+
+    def limit(self, key):
+        if key not in self.__limits:
+            self.__limits[key] = asyncio.Semaphore(self.__maxPerHost)
+        return self.__limits[key]
+
+    '''
+        Returns tuple(reader, writer, True if connection was reused)
+    '''
+    async def acquire(self, key, fresh=False):
+        idle = self.__idle.get(key)
+        while idle and not fresh:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = key
+        sslContext = None
+        if scheme == "https":
+            sslContext = self.__sslContext or ssl.create_default_context()
+        reader, writer = await asyncio.open_connection(host, port, ssl=sslContext)
+        return reader, writer, False
+
+    def release(self, key, reader, writer):
+        self.__idle.setdefault(key, []).append((reader, writer))
+
+    def close(self):
+        for idle in self.__idle.values():
+            for _, writer in idle:
+                writer.close()
+        self.__idle.clear()
+
+
+'''
+    Fetches 'urls' concurrently and yields FetchResult for every url as soon as its document is parsed.
+    - no more than 'concurrency' requests run at once(and no more than pool's maxPerHost to one host);
+    - 'timeout' is a limit in seconds for one url, including redirects;
+    - errors are not raised, they are returned in FetchResult.error.
+    Usage:
+        async for result in fetchAndParseMany(urls):
+            ...
+'''
+async def fetchAndParseMany(urls, concurrency=16, timeout=30.0, pool=None):
+    ownPool = pool is None
+    if ownPool:
+        pool = AsyncConnectionPool()
+    semaphore = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue()
+
+    async def worker(url):
+        async with semaphore:
+            try:
+                document = await asyncio.wait_for(fetchAndParse(url, pool), timeout)
+                result = FetchResult(url, document, None)
+            except Exception as e:
+                result = FetchResult(url, None, e)
+        await queue.put(result)
+
+    tasks = [asyncio.ensure_future(worker(url)) for url in urls]
+    try:
+        for _ in range(len(tasks)):
+            yield await queue.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+        # cancelled workers close their connections, so pool is closed only after they end
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if ownPool:
+            pool.close()
+
+
+'''
+    Fetches one url following redirects, returns parsed HTMLDocument.
+    Throws AsyncFetchError for 4xx and 5xx statuses and for 3xx responses which are not redirects(e.g. 304
+    or redirect without Location): their body is not parsed, so there is no document.
+'''
+async def fetchAndParse(url, pool):
+    for _ in range(ConnectionPool.MAX_REDIRECTS + 1):
+        urlParts = urlparse(url)
+        scheme = urlParts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise AsyncFetchError("unsupported scheme {0}".format(scheme))
+        port = urlParts.port or (Connection.HTTPS_PORT if scheme == "https" else Connection.HTTP_PORT)
+        key = (scheme, urlParts.hostname, port)
+        async with pool.limit(key):
+            parser = HTMLDomParser(PARSER_MODE["PUSH"])
+            status, headers = await _request(pool, key, url, parser)
+        if status in ConnectionPool.REDIRECT_CODES and "location" in headers:
+            url = urljoin(url, headers["location"])
+            continue
+        if status >= 300:
+            raise AsyncFetchError("HTTP {0} for {1}".format(status, url))
+        return parser.close()
+    raise AsyncFetchError("too many redirects for {0}".format(url))
+
+
+'''
+    Sends request and feeds body to the parser. Returns tuple(status, headers).
+    Reused connection may be already closed by server: then request is repeated once with a new connection.
+'''
+async def _request(pool, key, url, parser):
+    reader, writer, reused = await pool.acquire(key)
+    try:
+        writer.write(_makeRequest(key, url))
+        await writer.drain()
+        status, headers = await _readHead(reader)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        writer.close()
+        if not reused:
+            raise
+        reader, writer, reused = await pool.acquire(key, fresh=True)
+        try:
+            writer.write(_makeRequest(key, url))
+            await writer.drain()
+            status, headers = await _readHead(reader)
+        except BaseException:
+            writer.close()
+            raise
+    except BaseException:
+        writer.close()
+        raise
+    try:
+        keepAlive = await _readBody(reader, status, headers, parser if status < 300 else None)
+    except BaseException:
+        writer.close()
+        raise
+    if keepAlive and headers.get("connection", "").lower() != "close":
+        pool.release(key, reader, writer)
+    else:
+        writer.close()
+    return status, headers
+
+
+def _makeRequest(key, url):
+    scheme, host, port = key
+    defaultPort = Connection.HTTPS_PORT if scheme == "https" else Connection.HTTP_PORT
+    hostHeader = host if port == defaultPort else "{0}:{1}".format(host, port)
+    return ("GET {0} HTTP/1.1\r\nHost: {1}\r\nConnection: keep-alive\r\nAccept: text/html,*/*\r\nAccept-Encoding: {2}\r\n\r\n"
+            .format(Connection._relativeUrl(url), hostHeader, ACCEPT_ENCODING)).encode("latin-1")
+
+
+async def _readHead(reader):
+    while True:
+        statusLine = await reader.readuntil(b"\r\n")
+        parts = statusLine.decode("latin-1").split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise AsyncFetchError("invalid status line {0!r}".format(statusLine))
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        # interim responses(100 Continue, 103 Early Hints) are followed by the final one
+        if not 100 <= status < 200 or status == 101:
+            return status, headers
+
+
+'''
+    Reads body and feeds decompressed and decoded chunks to 'parser'(body is only skipped if parser is None).
+    Returns True if connection may be reused.
+'''
+async def _readBody(reader, status, headers, parser):
+    if status in NO_BODY_CODES or status < 200:
+        return True
+    decoder = ByteStreamDecoder(headers.get("content-type"))
+    content = ContentDecoder(headers.get("content-encoding")) if parser is not None else None
+
+    def feed(chunk):
+        if parser is not None:
+            text = decoder.decode(content.decompress(chunk))
+            if text:
+                parser.feed(text)
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            sizeLine = await reader.readuntil(b"\r\n")
+            size = int(sizeLine.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                # trailers
+                while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                    pass
+                break
+            feed(await reader.readexactly(size))
+            await reader.readexactly(2)
+        keepAlive = True
+    elif "content-length" in headers:
+        left = int(headers["content-length"])
+        while left > 0:
+            chunk = await reader.read(min(left, Connection.CHUNK_SIZE))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", left)
+            left -= len(chunk)
+            feed(chunk)
+        keepAlive = True
+    else:
+        # body lasts until server closes connection
+        while True:
+            chunk = await reader.read(Connection.CHUNK_SIZE)
+            if not chunk:
+                break
+            feed(chunk)
+        keepAlive = False
+    if parser is not None:
+        tail = decoder.decode(content.finish()) + decoder.finish()
+        if tail:
+            parser.feed(tail)
+    return keepAlive
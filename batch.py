@@ -0,0 +1,134 @@
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from parser import *
+from template import ExtractionTemplate
+
+'''
+    Parsing of many documents on all cores.
+    Node graph of HTMLDocument has cycles and lots of small objects, so it is expensive to pickle.
+    Workers return either CompactDocument(flat preorder arrays) or only results of extraction made inside the worker.
+'''
+
+
+'''
+    Flat preorder form of HTMLDocument, cheap to pickle and to send between processes.
+    Node 0 is the document itself, text nodes have empty tag.
+'''
+class CompactDocument:
+
+    __slots__ = ('parents', 'tags', 'attrs', 'texts')
+
+    def __init__(self, parents, tags, attrs, texts):
+        # index of parent node, -1 for document
+        self.parents = parents
+        self.tags = tags
+        # list of attribute tuples or None
+        self.attrs = attrs
+        self.texts = texts
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getstate__(self):
+        return (self.parents, self.tags, self.attrs, self.texts)
+
+    def __setstate__(self, state):
+        self.parents, self.tags, self.attrs, self.texts = state
+
+    @staticmethod
+    def fromDocument(document):
+        assert isinstance(document, HTMLDocument), "CompactDocument::fromDocument() - document must be a HTMLDocument"
+        parents = array('i')
+        tags = []
+        attrs = []
+        texts = []
+        # tuples(node, index of its parent)
+        stack = [(document, -1)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(tags)
+            parents.append(parent)
+            tags.append(node.tagName())
+            nodeAttrs = node._attrs()
+            attrs.append(tuple(nodeAttrs.items()) if nodeAttrs else None)
+            texts.append(node.text())
+            children = node.childNodes()
+            for i in range(len(children) - 1, -1, -1):
+                stack.append((children[i], index))
+        return CompactDocument(parents, tags, attrs, texts)
+
+    '''
+        Builds HTMLDocument back, nodes are created in document order just like parser does
+    '''
+    def toDocument(self, document=None):
+        if document is None:
+            document = HTMLDocument()
+        stack = [document]
+        # indexes of nodes in stack
+        indexes = [0]
+        for i in range(1, len(self.tags)):
+            parent = self.parents[i]
+            while indexes[-1] != parent:
+                stack.pop()._closeSubtree()
+                indexes.pop()
+            tag = self.tags[i]
+            if tag == "":
+                stack[-1]._appendChild(HTMLDomNode(document, stack[-1], text=self.texts[i]))
+                continue
+            attrs = self.attrs[i]
+            elem = HTMLDomElement(document, stack[-1], tag, list(attrs) if attrs else None)
+            stack[-1]._appendChild(elem)
+            stack.append(elem)
+            indexes.append(i)
+        for elem in reversed(stack):
+            elem._closeSubtree()
+        return document
+
+
+'''
+    Runs extraction in worker:
+    - None: CompactDocument is returned;
+    - ExtractionTemplate: dict of lists of texts or attribute values of matched elements, see template.py;
+    - callable: called with HTMLDocument, must return something picklable.
+'''
+def _extract(document, extract):
+    if extract is None:
+        return CompactDocument.fromDocument(document)
+    if isinstance(extract, ExtractionTemplate):
+        return extract.extract(document)
+    return extract(document)
+
+
+def _parseOne(source, extract):
+    # files are decoded by the parser, which detects their charset
+    mode = PARSER_MODE["FILE"] if isinstance(source, os.PathLike) else PARSER_MODE["RAW"]
+    document = HTMLDomParser(mode, source).getDocument()
+    return _extract(document, extract)
+
+
+def _parseChunk(chunk, extract):
+    return [(index, _parseOne(source, extract)) for index, source in chunk]
+
+
+'''
+    Parses 'sources' in a pool of 'processes' worker processes(all cores by default).
+    Sources are raw HTML strings or paths(pathlib.Path) to files, which are read by workers with charset detection.
+    'extract' is run inside the worker, see _extract(); 'extract' callable must be picklable(defined at module level).
+    Dict {field: selector} or {field: (selector, attribute)} is compiled once into ExtractionTemplate.
+    Sources are sent to workers in chunks of 'chunksize' items.
+    Yields tuples(index of source, result), in order of sources if 'ordered' is True, else as soon as chunks are done.
+    Exceptions from workers are raised here.
+'''
+def parseMany(sources, extract=None, processes=None, chunksize=1, ordered=True):
+    assert chunksize > 0, "parseMany() - chunksize must be positive"
+    assert extract is None or callable(extract) or isinstance(extract, (dict, ExtractionTemplate)), "parseMany() - invalid extract"
+    if isinstance(extract, dict):
+        extract = ExtractionTemplate(extract)
+    items = list(enumerate(sources))
+    chunks = [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_parseChunk, chunk, extract) for chunk in chunks]
+        for future in (futures if ordered else as_completed(futures)):
+            yield from future.result()
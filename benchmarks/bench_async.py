@@ -0,0 +1,47 @@
+'''
+    Fetch-and-parse of many pages from a local server with artificial latency:
+    sequential ConnectionPool against asyncio fetchAndParseMany.
+    Run from the repository root: python -m benchmarks.bench_async
+'''
+import asyncio
+import sys
+import time
+
+from parser import *
+from asyncfetch import fetchAndParseMany
+from benchmarks.generators import listingDocument
+from benchmarks.localserver import LocalServer
+
+PAGES = 200
+LATENCY = 0.02
+ITEMS = 20
+
+
+def main():
+    with LocalServer(listingDocument(ITEMS), LATENCY) as server:
+        urls = [server.url("/page/{0}".format(i)) for i in range(PAGES)]
+
+        pool = ConnectionPool()
+        start = time.perf_counter()
+        for url in urls:
+            HTMLDomParser(PARSER_MODE["URL"], url, pool)
+        sequential = time.perf_counter() - start
+        pool.close()
+        print("{0:<24} {1:>8.3f} s".format("sequential pool", sequential))
+
+        for concurrency in (4, 16, 64):
+            async def run():
+                count = 0
+                async for result in fetchAndParseMany(urls, concurrency=concurrency):
+                    assert result.error is None, result.error
+                    count += 1
+                return count
+            start = time.perf_counter()
+            count = asyncio.run(run())
+            elapsed = time.perf_counter() - start
+            print("{0:<24} {1:>8.3f} s".format("asyncio, {0} at once".format(concurrency), elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
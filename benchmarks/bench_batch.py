@@ -0,0 +1,45 @@
+'''
+    parseMany throughput by count of worker processes, and size of results sent back from workers.
+    Run from the repository root: python -m benchmarks.bench_batch
+'''
+import os
+import pickle
+import sys
+import time
+
+from parser import *
+from batch import parseMany, CompactDocument
+from benchmarks.generators import listingDocument
+
+DOCUMENTS = 32
+ITEMS = 200
+EXTRACT = {"titles": "h3.product-title", "links": ("a.product-link", "href"), "prices": "span.price"}
+
+
+def main():
+    html = listingDocument(ITEMS)
+    document = HTMLDomParser(PARSER_MODE["RAW"], html).getDocument()
+    try:
+        full = "{0} bytes".format(len(pickle.dumps(document)))
+    except RecursionError:
+        full = "RecursionError"
+    print("pickled HTMLDocument:    {0}".format(full))
+    print("pickled CompactDocument: {0} bytes".format(len(pickle.dumps(CompactDocument.fromDocument(document)))))
+    print()
+
+    sources = [html] * DOCUMENTS
+    megabytes = len(html) * DOCUMENTS / 1e6
+    counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    print("{0:<10} {1:<10} {2:>8} {3:>8}".format("processes", "result", "docs/s", "MB/s"))
+    for processes in counts:
+        for name, extract in (("compact", None), ("extract", EXTRACT)):
+            start = time.perf_counter()
+            for _ in parseMany(sources, extract=extract, processes=processes, chunksize=4, ordered=False):
+                pass
+            elapsed = time.perf_counter() - start
+            print("{0:<10} {1:<10} {2:>8.1f} {3:>8.2f}".format(processes, name, DOCUMENTS / elapsed, megabytes / elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+'''
+    Memory retained by a parsed document, in bytes per node.
+    Run from the repository root: python -m benchmarks.bench_memory
+'''
+import gc
+import sys
+import tracemalloc
+
+from parser import *
+from flat import FlatDomParser
+from benchmarks.generators import listingDocument
+from benchmarks.suite import countNodes
+
+ITEMS = 5000
+
+
+def retained(parserClass, html):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    document = parserClass(PARSER_MODE["RAW"], html).getDocument()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return document, size
+
+
+def main():
+    html = listingDocument(ITEMS)
+    document, size = retained(HTMLDomParser, html)
+    nodes = countNodes(document)
+    _, flatSize = retained(FlatDomParser, html)
+    print("html size:      {0:>10} bytes".format(len(html)))
+    print("nodes:          {0:>10}".format(nodes))
+    print("retained:       {0:>10} bytes".format(size))
+    print("bytes per node: {0:>10.1f}".format(size / nodes))
+    print("flat retained:  {0:>10} bytes".format(flatSize))
+    print("flat per node:  {0:>10.1f}".format(flatSize / nodes))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,42 @@
+'''
+    Parse time for wide and deep trees.
+    Run from the repository root: python -m benchmarks.bench_parse
+'''
+import sys
+import time
+
+from parser import *
+from benchmarks.generators import wideDocument, deepDocument
+
+REPEATS = 3
+
+
+def timeParse(html):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        HTMLDomParser(PARSER_MODE["RAW"], html)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    cases = [
+        ("wide", 10000, wideDocument(10000)),
+        ("wide", 100000, wideDocument(100000)),
+        ("deep", 1000, deepDocument(1000)),
+        ("deep", 10000, deepDocument(10000)),
+    ]
+    print("{0:<6} {1:>8} {2:>10}".format("shape", "size", "parse, s"))
+    for shape, size, html in cases:
+        try:
+            result = "{0:>10.4f}".format(timeParse(html))
+        except RecursionError:
+            result = "{0:>10}".format("recursion")
+        print("{0:<6} {1:>8} {2}".format(shape, size, result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+'''
+    querySelectorAll latency on a large listing page.
+    Run from the repository root: python -m benchmarks.bench_query
+'''
+import sys
+import time
+
+from parser import *
+from benchmarks.generators import listingDocument
+
+ITEMS = 5000
+SELECTORS = [
+    "div a",
+    "div.products div a img",
+    "main > div > div > a",
+    "h3 + p",
+    "h3 ~ span",
+    "div[data-id] b",
+    ".product-card .price, .nav-link",
+]
+
+
+def main():
+    document = HTMLDomParser(PARSER_MODE["RAW"], listingDocument(ITEMS)).getDocument()
+    print("{0:<36} {1:>8} {2:>10}".format("selector", "matches", "time, s"))
+    for selector in SELECTORS:
+        start = time.perf_counter()
+        try:
+            result = document.querySelectorAll(selector)
+        except (ValueError, KeyError):
+            print("{0:<36} {1:>8}".format(selector, "invalid"))
+            continue
+        elapsed = time.perf_counter() - start
+        print("{0:<36} {1:>8} {2:>10.4f}".format(selector, len(result), elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+'''
+    Extraction of many fields from a listing page: ExtractionTemplate against one querySelectorAll per field.
+    Run from the repository root: python -m benchmarks.bench_template
+'''
+import sys
+import time
+
+from parser import *
+from template import ExtractionTemplate
+from benchmarks.generators import listingDocument
+
+ITEMS = 2000
+REPEATS = 5
+FIELDS = {
+    "title": "title",
+    "navLinks": ("a.nav-link", "href"),
+    "navTexts": "a.nav-link",
+    "itemLinks": ("div.product-card > a", "href"),
+    "itemTitles": ("div.product-card > a", "title"),
+    "ids": ("div.product-card", "data-id"),
+    "images": ("img.product-image", "src"),
+    "alts": ("img.product-image", "alt"),
+    "names": "h3.product-title",
+    "descriptions": "p.product-desc",
+    "prices": "span.price",
+    "priceProps": ("span[itemprop]", "itemprop"),
+    "buttons": ("button.add-to-cart", "type"),
+    "footer": "footer p",
+}
+
+
+def byQueries(document):
+    res = {}
+    for field, spec in FIELDS.items():
+        if isinstance(spec, str):
+            res[field] = [node.textContent() for node in document.querySelectorAll(spec)]
+        else:
+            res[field] = [node.getAttribute(spec[1]) for node in document.querySelectorAll(spec[0])]
+    return res
+
+
+def best(func):
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        result = elapsed if result is None else min(result, elapsed)
+    return result
+
+
+def main():
+    # no query cache, so every repeat really runs the queries
+    document = HTMLDomParser(PARSER_MODE["RAW"], listingDocument(ITEMS), document=HTMLDocument(queryCacheSize=0)).getDocument()
+    template = ExtractionTemplate(FIELDS)
+    assert template.extract(document) == byQueries(document)
+    print("{0:<10} {1:>10}".format("method", "time, s"))
+    print("{0:<10} {1:>10.4f}".format("queries", best(lambda: byQueries(document))))
+    print("{0:<10} {1:>10.4f}".format("template", best(lambda: template.extract(document))))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
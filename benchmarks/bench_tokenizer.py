@@ -0,0 +1,72 @@
+'''
+    Tokenizer throughput alone(builder does nothing) and parse time with every tokenizer.
+    Run from the repository root: python -m benchmarks.bench_tokenizer
+'''
+import sys
+import time
+
+from parser import *
+from tokenizer import TOKENIZER
+from benchmarks.generators import *
+
+REPEATS = 3
+
+
+class NullBuilder:
+
+    def handle_starttag(self, tag, attrs):
+        pass
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_endtag(self, tag):
+        pass
+
+    def handle_data(self, data):
+        pass
+
+    def handle_comment(self, data):
+        pass
+
+    def handle_decl(self, decl):
+        pass
+
+    def handle_pi(self, data):
+        pass
+
+
+def best(func):
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        result = elapsed if result is None else min(result, elapsed)
+    return result
+
+
+def tokenizeOnly(tokenizerClass, html):
+    tokenizer = tokenizerClass(NullBuilder())
+    tokenizer.feed(html)
+    tokenizer.close()
+
+
+def main():
+    cases = [
+        ("listing", listingDocument(2000)),
+        ("attributes", attributeHeavyDocument(5000)),
+        ("text", textHeavyDocument(2000)),
+        ("wide", wideDocument(20000)),
+    ]
+    print("{0:<11} {1:<7} {2:>14} {3:>10}".format("shape", "name", "tokenize, MB/s", "parse, s"))
+    for shape, html in cases:
+        for name, tokenizerClass in sorted(TOKENIZER.items()):
+            tokenize = best(lambda: tokenizeOnly(tokenizerClass, html))
+            parse = best(lambda: HTMLDomParser(PARSER_MODE["RAW"], html, tokenizer=tokenizerClass))
+            print("{0:<11} {1:<7} {2:>14.2f} {3:>10.4f}".format(shape, name, len(html) / tokenize / 1e6, parse))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
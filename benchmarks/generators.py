@@ -0,0 +1,75 @@
+'''
+    Synthetic HTML documents for benchmarks.
+    Every generator returns a string with the whole document.
+'''
+
+
+'''
+    One <ul> with 'width' <li> children
+'''
+def wideDocument(width):
+    items = ''.join('<li class="item">Item {0}</li>'.format(i) for i in range(width))
+    return '<html><body><ul>' + items + '</ul></body></html>'
+
+
+'''
+    'depth' nested <div>s, every one containing a bit of text
+'''
+def deepDocument(depth):
+    return '<html><body>' + '<div>text' * depth + '</div>' * depth + '</body></html>'
+
+
+'''
+    Page shaped like a typical templated listing: header with navigation,
+    'items' product cards with classes, links, images and text, and a footer
+'''
+def listingDocument(items):
+    parts = ['<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"><title>Listing</title>',
+             '<link rel="stylesheet" href="/static/site.css"></head><body>',
+             '<header class="site-header"><nav class="nav main-nav"><ul class="nav-list">']
+    for i in range(20):
+        parts.append('<li class="nav-item"><a class="nav-link" href="/section/{0}">Section {0}</a></li>'.format(i))
+    parts.append('</ul></nav></header><main id="content" class="container"><div class="row products">')
+    for i in range(items):
+        parts.append(
+            '<div class="col product-card" data-id="{0}">'
+            '<a class="product-link" href="/item/{0}" title="Item {0}">'
+            '<img class="product-image lazy" src="/img/{0}.jpg" alt="Item {0}" width="200" height="200"></a>'
+            '<h3 class="product-title">Item number {0}</h3>'
+            '<p class="product-desc">Short description of item {0}, with <b>bold</b> text &amp; an entity.</p>'
+            '<span class="price" itemprop="price">{1}.99</span>'
+            '<button class="btn btn-primary add-to-cart" type="button">Add to cart</button>'
+            '</div>'.format(i, i % 100))
+    parts.append('</div></main><footer class="site-footer"><p>Footer text</p></footer></body></html>')
+    return ''.join(parts)
+
+
+'''
+    'count' elements with many classes each, drawn from a pool of 'pool' class names
+'''
+def classHeavyDocument(count, pool=50, perElement=6):
+    items = []
+    for i in range(count):
+        classes = ' '.join('c{0}'.format((i * 7 + j * 13) % pool) for j in range(perElement))
+        items.append('<div class="{0}"><span class="{1} inner">x</span></div>'.format(classes, 'c{0}'.format(i % pool)))
+    return '<html><body><section id="root">' + ''.join(items) + '</section></body></html>'
+
+
+'''
+    'count' elements with 'perElement' attributes each, ids are unique
+'''
+def attributeHeavyDocument(count, perElement=10):
+    items = []
+    for i in range(count):
+        attrs = ' '.join('data-a{0}="value-{1}-{0}"'.format(j, i % 100) for j in range(perElement))
+        items.append('<input id="field{0}" name="f{0}" type="text" {1}>'.format(i, attrs))
+    return '<html><body><form action="/submit">' + ''.join(items) + '</form></body></html>'
+
+
+'''
+    'paragraphs' paragraphs of prose with inline markup and entities
+'''
+def textHeavyDocument(paragraphs):
+    sentence = 'Lorem ipsum dolor sit amet, consectetur &amp; adipiscing elit, <em>sed do</em> eiusmod tempor. '
+    items = ['<p>' + sentence * 8 + '<a href="/more">more</a></p>' for _ in range(paragraphs)]
+    return '<html><body><article>' + '\n'.join(items) + '</article></body></html>'
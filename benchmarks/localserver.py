@@ -0,0 +1,49 @@
+'''
+    Local http.server stand-in for network benchmarks: serves one page with keep-alive
+    and an artificial per-request latency.
+'''
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class PageHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in one segment, otherwise delayed ACKs add latency to every keep-alive request
+    wbufsize = 1 << 20
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        body = self.server.page
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer:
+
+    def __init__(self, page, latency=0.0):
+        self.page = page.encode("utf-8") if isinstance(page, str) else page
+        self.latency = latency
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+        self.server.daemon_threads = True
+        self.server.page = self.page
+        self.server.latency = self.latency
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return "http://127.0.0.1:{0}{1}".format(self.server.server_address[1], path)
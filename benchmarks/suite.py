@@ -0,0 +1,172 @@
+'''
+    Benchmark and regression suite for parsing and queries.
+    Run from the repository root:
+        python -m benchmarks.suite                           # print results
+        python -m benchmarks.suite --save baseline.json      # store results as a baseline
+        python -m benchmarks.suite --compare baseline.json   # exit with 1 on regressions past --threshold
+    Timings depend on the machine, so baselines must be made on the same machine as the runs compared with them.
+'''
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from parser import *
+from benchmarks.generators import *
+
+THRESHOLD = 0.25
+REPEATS = 5
+MIN_MEASURE = 0.02
+
+'''
+    Document shapes, sizes are for scale 1.0
+'''
+SHAPES = {
+    "wide": lambda scale: wideDocument(int(20000 * scale)),
+    "deep": lambda scale: deepDocument(int(5000 * scale)),
+    "classes": lambda scale: classHeavyDocument(int(5000 * scale)),
+    "attributes": lambda scale: attributeHeavyDocument(int(5000 * scale)),
+    "text": lambda scale: textHeavyDocument(int(2000 * scale)),
+    "listing": lambda scale: listingDocument(int(2000 * scale)),
+}
+
+'''
+    Queries on listing document: (metric name, function of document)
+'''
+QUERIES = [
+    ("getElementsByTagName", lambda doc: doc.getElementsByTagName("a")),
+    ("getElementsByClassName", lambda doc: doc.getElementsByClassName("price")),
+    ("getElementById", lambda doc: doc.getElementById("content")),
+    ("querySelectorAll[descendant]", lambda doc: doc.querySelectorAll("div.products a img")),
+    ("querySelectorAll[child]", lambda doc: doc.querySelectorAll("div.product-card > a")),
+    ("querySelectorAll[adjacent]", lambda doc: doc.querySelectorAll("h3 + p")),
+    ("querySelectorAll[sibling]", lambda doc: doc.querySelectorAll("h3 ~ button")),
+    ("querySelectorAll[group]", lambda doc: doc.querySelectorAll("span.price, a.nav-link")),
+    ("querySelectorAll[attribute]", lambda doc: doc.querySelectorAll("img[src$='.jpg']")),
+]
+
+
+def countNodes(document):
+    count = 0
+    stack = [document]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.childNodes())
+    return count
+
+
+'''
+    Best time of one call out of 'repeats' measurements.
+    Fast calls are looped, so every measurement takes at least MIN_MEASURE seconds and is not just timer noise.
+'''
+def bestTime(func, repeats=REPEATS):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_MEASURE:
+            break
+        number *= 10
+    best = elapsed / number
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def metric(value, unit, better):
+    return {"value": value, "unit": unit, "better": better}
+
+
+def benchParse(results, scale, repeats):
+    for shape, generator in sorted(SHAPES.items()):
+        html = generator(scale)
+        elapsed = bestTime(lambda: HTMLDomParser(PARSER_MODE["RAW"], html), repeats)
+        gc.collect()
+        tracemalloc.start()
+        document = HTMLDomParser(PARSER_MODE["RAW"], html).getDocument()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        nodes = countNodes(document)
+        results["parse.{0}.MBps".format(shape)] = metric(len(html) / elapsed / 1e6, "MB/s", "higher")
+        results["parse.{0}.nodesps".format(shape)] = metric(nodes / elapsed, "nodes/s", "higher")
+        results["memory.{0}.peakBytesPerNode".format(shape)] = metric(peak / nodes, "bytes", "lower")
+
+
+def benchQueries(results, scale, repeats):
+    # no query cache, so every repeat really runs the query
+    document = HTMLDomParser(PARSER_MODE["RAW"], listingDocument(int(2000 * scale)),
+                             document=HTMLDocument(queryCacheSize=0)).getDocument()
+    for name, query in QUERIES:
+        results["query.{0}.us".format(name)] = metric(bestTime(lambda: query(document), repeats) * 1e6, "us", "lower")
+
+
+def runSuite(scale=1.0, repeats=REPEATS):
+    results = {}
+    benchParse(results, scale, repeats)
+    benchQueries(results, scale, repeats)
+    return results
+
+
+'''
+    Returns list of tuples(metric name, baseline value, current value, relative change) for metrics
+    that got worse than 'threshold'(0.25 means 25% slower or bigger)
+'''
+def findRegressions(baseline, results, threshold=THRESHOLD):
+    regressions = []
+    for name, base in sorted(baseline.items()):
+        if name not in results or base["value"] == 0:
+            continue
+        current = results[name]["value"]
+        if base["better"] == "higher":
+            change = (base["value"] - current) / base["value"]
+        else:
+            change = (current - base["value"]) / base["value"]
+        if change > threshold:
+            regressions.append((name, base["value"], current, change))
+    return regressions
+
+
+def printResults(results, baseline=None):
+    for name, result in sorted(results.items()):
+        line = "{0:<44} {1:>14.3f} {2}".format(name, result["value"], result["unit"])
+        if baseline and name in baseline and baseline[name]["value"]:
+            line += "   ({0:+.1%} vs baseline)".format(result["value"] / baseline[name]["value"] - 1)
+        print(line)
+
+
+def main(argv=None):
+    argParser = argparse.ArgumentParser(description="Parse and query benchmarks")
+    argParser.add_argument("--scale", type=float, default=1.0, help="size of generated documents, 1.0 by default")
+    argParser.add_argument("--repeats", type=int, default=REPEATS, help="best of this many runs is taken")
+    argParser.add_argument("--save", metavar="FILE", help="store results as JSON baseline")
+    argParser.add_argument("--compare", metavar="FILE", help="JSON baseline to compare with")
+    argParser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed relative regression")
+    args = argParser.parse_args(argv)
+
+    results = runSuite(args.scale, args.repeats)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    printResults(results, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"scale": args.scale, "python": sys.version.split()[0], "results": results}, f, indent=2, sort_keys=True)
+    if baseline is not None:
+        regressions = findRegressions(baseline, results, args.threshold)
+        for name, base, current, change in regressions:
+            print("REGRESSION {0}: {1:.3f} -> {2:.3f} ({3:+.1%})".format(name, base, current, change))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+
+MAX_QUERY_CACHE = 128
+
+QUERY_CACHE_EVICTION = {
+    # least recently used entry is evicted first
+    "LRU": 0,
+    # oldest entry is evicted first, hits do not change the order
+    "FIFO": 1
+}
+
+
+'''
+    Cache of query results owned by one document.
+    Entries remember the generation they were computed in, every mutation of the document
+    bumps generation, so old entries become stale without walking the cache.
+    Keys may reference nodes: they belong to the same document, so everything is released together with it.
+    Cache of a frozen document may be used from many threads: see freeze().
+'''
+class QueryCache:
+
+    def __init__(self, maxSize=MAX_QUERY_CACHE, eviction=QUERY_CACHE_EVICTION["LRU"]):
+        assert isinstance(maxSize, int) and maxSize >= 0, "QueryCache::__init__() - maxSize must be a non-negative int"
+        assert eviction in QUERY_CACHE_EVICTION.values(), "QueryCache::__init__() - eviction invalid"
+        self.__maxSize = maxSize
+        self.__eviction = eviction
+        # key -> tuple(generation, value)
+        self.__entries = OrderedDict()
+        self.__generation = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        # set by freeze(), serializes writers
+        self.__lock = None
+
+    '''
+        Returns cached value or None if there is no fresh value for 'key'
+    '''
+    def get(self, key):
+        if self.__lock is not None:
+            # nothing is changed on read, so readers need no lock
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.__misses += 1
+                return None
+            self.__hits += 1
+            return entry[1]
+        entry = self.__entries.get(key)
+        if entry is None:
+            self.__misses += 1
+            return None
+        if entry[0] != self.__generation:
+            del self.__entries[key]
+            self.__misses += 1
+            return None
+        if self.__eviction == QUERY_CACHE_EVICTION["LRU"]:
+            self.__entries.move_to_end(key)
+        self.__hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        if self.__maxSize == 0:
+            return
+        if self.__lock is not None:
+            with self.__lock:
+                self.__put(key, value)
+            return
+        self.__put(key, value)
+
+    '''
+        Makes cache safe for concurrent use, for documents which are never changed again.
+        Reads take no lock and do not reorder entries, so eviction becomes FIFO. Writes are serialized with a lock.
+        Hit and miss counters are not synchronized, under concurrent use they are approximate.
+    '''
+    def freeze(self):
+        if self.__lock is not None:
+            return
+        # frozen reads do not check generations, so stale entries are dropped now
+        for key in [key for key, entry in self.__entries.items() if entry[0] != self.__generation]:
+            del self.__entries[key]
+        self.__lock = threading.Lock()
+
+    def isFrozen(self):
+        return self.__lock is not None
+
+    def __put(self, key, value):
+        self.__entries[key] = (self.__generation, value)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.__maxSize:
+            self.__entries.popitem(last=False)
+            self.__evictions += 1
+
+    '''
+        Makes all current entries stale. Called on every mutation of the document.
+    '''
+    def invalidate(self):
+        assert self.__lock is None, "QueryCache::invalidate() - cache is frozen"
+        self.__generation += 1
+
+    def clear(self):
+        if self.__lock is not None:
+            with self.__lock:
+                self.__entries.clear()
+            return
+        self.__entries.clear()
+
+    def generation(self):
+        return self.__generation
+
+    def stats(self):
+        return {
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "evictions": self.__evictions,
+            "size": len(self.__entries),
+            "maxSize": self.__maxSize,
+            "generation": self.__generation
+        }
+
+    def __len__(self):
+        return len(self.__entries)
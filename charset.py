@@ -0,0 +1,104 @@
+import codecs
+import re
+
+'''
+    Charset detection and incremental decoding of HTML byte streams.
+    Charset is taken(in this order of priority) from:
+    - byte order mark;
+    - charset parameter of Content-Type header;
+    - <meta charset="..."> or <meta http-equiv="Content-Type" content="...; charset=..."> in the first PRESCAN_SIZE bytes;
+    - DEFAULT_CHARSET otherwise.
+    Undecodable bytes are replaced, so pages in wrong or unknown charset do not break parsing.
+'''
+
+DEFAULT_CHARSET = "utf-8"
+# as in HTML spec, meta charset is searched only in the beginning of document
+PRESCAN_SIZE = 1024
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+ContentTypeCharsetRe = re.compile(r'charset\s*=\s*["\']?\s*([^\s;"\']+)', re.IGNORECASE)
+MetaCharsetRe = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([a-zA-Z0-9_:.+-]+)', re.IGNORECASE)
+
+
+'''
+    Returns normalized codec name or None if charset is unknown
+'''
+def normalizeCharset(name):
+    if not name:
+        return None
+    try:
+        codec = codecs.lookup(name.strip())
+    except LookupError:
+        return None
+    return codec.name
+
+
+'''
+    Detects charset of document by its first bytes('prefix') and Content-Type header value.
+    Never fails, returns DEFAULT_CHARSET if nothing is found.
+'''
+def detectCharset(prefix, contentType=None):
+    for bom, name in BOMS:
+        if prefix.startswith(bom):
+            return name
+    if contentType:
+        m = ContentTypeCharsetRe.search(contentType)
+        charset = normalizeCharset(m.group(1)) if m else None
+        if charset is not None:
+            return charset
+    m = MetaCharsetRe.search(prefix[:PRESCAN_SIZE])
+    if m:
+        charset = normalizeCharset(m.group(1).decode("ascii"))
+        # document that could be read to find meta is not in UTF-16, meta lies in this case
+        if charset is not None and not charset.startswith("utf-16"):
+            return charset
+    return DEFAULT_CHARSET
+
+
+'''
+    Decodes byte stream chunk by chunk.
+    First PRESCAN_SIZE bytes are held back until charset is detected, then everything is decoded as it comes,
+    multibyte characters split between chunks are handled by incremental decoder.
+'''
+class ByteStreamDecoder:
+
+    def __init__(self, contentType=None, charset=None):
+        self.__contentType = contentType
+        self.__charset = normalizeCharset(charset) if charset else None
+        self.__decoder = None
+        self.__prefix = b""
+        if self.__charset is not None:
+            self.__decoder = codecs.getincrementaldecoder(self.__charset)("replace")
+
+    '''
+        Detected charset, None until enough bytes are seen
+    '''
+    def charset(self):
+        return self.__charset
+
+    def decode(self, chunk):
+        if self.__decoder is not None:
+            return self.__decoder.decode(chunk)
+        self.__prefix += chunk
+        if len(self.__prefix) < PRESCAN_SIZE:
+            return ""
+        return self.__start()
+
+    '''
+        Decodes everything that is left, must be called at the end of stream
+    '''
+    def finish(self):
+        text = self.__start() if self.__decoder is None else ""
+        return text + self.__decoder.decode(b"", True)
+
+    def __start(self):
+        self.__charset = detectCharset(self.__prefix, self.__contentType)
+        self.__decoder = codecs.getincrementaldecoder(self.__charset)("replace")
+        prefix = self.__prefix
+        self.__prefix = b""
+        return self.__decoder.decode(prefix)
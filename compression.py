@@ -0,0 +1,179 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+    Content-Encoding of HTTP responses.
+    Compressed body is decompressed chunk by chunk as it comes off the socket, so it is never kept whole in memory
+    and parser gets text of the first chunks before the rest is downloaded.
+    Brotli is asked for only if brotli module is installed.
+    Size of decompressed body is limited, so a small compressed "bomb" can not take all memory.
+    Compressed data must end with the body: truncated body or garbage after the compressed data is an error.
+'''
+
+CONTENT_ENCODINGS = ("gzip", "deflate", "br") if brotli is not None else ("gzip", "deflate")
+ACCEPT_ENCODING = ", ".join(CONTENT_ENCODINGS)
+# default limit of decompressed body in bytes
+MAX_DECODED_SIZE = 256 << 20
+
+
+'''
+    gzip body may be several gzip members one after another(like "cat a.gz b.gz"), they are decompressed in turn
+'''
+class GzipDecompressor:
+
+    def __init__(self):
+        self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # start of the next member, which is left for the next call when output is already 'maxLength' bytes
+        self.__pending = b""
+        self.__received = False
+
+    def decompress(self, data, maxLength=0):
+        self.__received = self.__received or len(data) != 0
+        data, self.__pending = self.__pending + data, b""
+        out = self.__decompressor.decompress(data, maxLength)
+        while self.__decompressor.eof and self.__decompressor.unused_data:
+            data = self.__decompressor.unused_data
+            if maxLength and len(out) >= maxLength:
+                self.__pending = data
+                break
+            self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            out += self.__decompressor.decompress(data, maxLength - len(out) if maxLength else 0)
+        return out
+
+    def flush(self):
+        return self.__decompressor.flush()
+
+    '''
+        False if the last member is not complete, empty body is complete
+    '''
+    def isFinished(self):
+        return not self.__received or (self.__decompressor.eof and len(self.__pending) == 0)
+
+
+'''
+    "deflate" must be a zlib stream, but some servers send raw deflate data: it is told by zlib header
+'''
+class DeflateDecompressor:
+
+    def __init__(self):
+        self.__decompressor = None
+        # bytes seen before there are enough of them for the header
+        self.__head = b""
+
+    def decompress(self, data, maxLength=0):
+        if self.__decompressor is None:
+            self.__head += data
+            if len(self.__head) < 2:
+                return b""
+            data, self.__head = self.__head, b""
+            # compression method and check bits of the first two bytes
+            wrapped = data[0] & 0x0f == 8 and (data[0] << 8 | data[1]) % 31 == 0
+            self.__decompressor = zlib.decompressobj(zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS)
+        out = self.__decompressor.decompress(data, maxLength)
+        if self.__decompressor.unused_data:
+            raise ValueError("DeflateDecompressor::decompress() - data after the end of deflate stream")
+        return out
+
+    def flush(self):
+        if self.__decompressor is None:
+            return b""
+        return self.__decompressor.flush()
+
+    def isFinished(self):
+        if self.__decompressor is None:
+            return len(self.__head) == 0
+        return self.__decompressor.eof
+
+
+class BrotliDecompressor:
+
+    def __init__(self):
+        self.__decompressor = brotli.Decompressor()
+
+    '''
+        Output of one call can not be limited with every version of brotli module, so it is only checked after the call
+    '''
+    def decompress(self, data, maxLength=0):
+        return self.__decompressor.process(data)
+
+    def flush(self):
+        return b""
+
+    '''
+        Old versions of brotli module can not tell it, then stream is taken as complete
+    '''
+    def isFinished(self):
+        isFinished = getattr(self.__decompressor, "is_finished", None)
+        return isFinished is None or isFinished()
+
+
+'''
+    Decompresses body by value of Content-Encoding header: None or "identity" leave it as it is.
+    Throws ValueError for encodings which are not supported, for broken or truncated compressed data and when output
+    of any decompression step gets larger than 'maxSize' bytes. Every step is asked for at most that many bytes,
+    so they are never made in memory.
+'''
+class ContentDecoder:
+
+    def __init__(self, contentEncoding=None, maxSize=MAX_DECODED_SIZE):
+        assert maxSize > 0, "ContentDecoder::__init__() - maxSize must be positive"
+        self.__maxSize = maxSize
+        self.__decompressors = []
+        codings = [item.strip().lower() for item in (contentEncoding or "").split(",")]
+        # codings are listed in the order they were applied, so they are undone from the last one
+        for coding in reversed(codings):
+            if coding in ("", "identity"):
+                continue
+            if coding in ("gzip", "x-gzip"):
+                self.__decompressors.append(GzipDecompressor())
+            elif coding == "deflate":
+                self.__decompressors.append(DeflateDecompressor())
+            elif coding == "br" and brotli is not None:
+                self.__decompressors.append(BrotliDecompressor())
+            else:
+                raise ValueError("ContentDecoder - unsupported Content-Encoding {0}".format(contentEncoding))
+        # bytes made by every step so far
+        self.__sizes = [0] * len(self.__decompressors)
+
+    def decompress(self, chunk):
+        for i in range(len(self.__decompressors)):
+            chunk = self.__step(i, chunk)
+        return chunk
+
+    '''
+        Returns everything that is left, must be called at the end of body.
+        Throws ValueError if compressed data is not complete: body was cut.
+    '''
+    def finish(self):
+        data = b""
+        for i, decompressor in enumerate(self.__decompressors):
+            data = self.__step(i, data)
+            try:
+                data += self.__count(i, decompressor.flush())
+            except zlib.error as e:
+                raise ValueError("ContentDecoder - broken compressed data: {0}".format(e)) from e
+            if not decompressor.isFinished():
+                raise ValueError("ContentDecoder - compressed body is truncated")
+        return data
+
+    '''
+        Asks for one byte more than is left: output which is cut there means that body is too large,
+        otherwise all input is consumed
+    '''
+    def __step(self, index, data):
+        left = self.__maxSize - self.__sizes[index]
+        try:
+            data = self.__decompressors[index].decompress(data, left + 1)
+        except zlib.error as e:
+            raise ValueError("ContentDecoder - broken compressed data: {0}".format(e)) from e
+        return self.__count(index, data)
+
+    def __count(self, index, data):
+        self.__sizes[index] += len(data)
+        if self.__sizes[index] > self.__maxSize:
+            raise ValueError("ContentDecoder - decompressed body is larger than {0} bytes".format(self.__maxSize))
+        return data
@@ -1,25 +1,283 @@
 import urllib.request as urlreq
-from urllib.parse import urlparse
+import urllib.error
+from urllib.parse import urlparse, urljoin
 import http.client
+import threading
+import time
+
+from charset import ByteStreamDecoder
+from compression import ContentDecoder, ACCEPT_ENCODING
 
 class Connection:
 
     HTTP_PORT = 80
     HTTPS_PORT = 443
+    # size of chunks read from response when streaming
+    CHUNK_SIZE = 64 * 1024
 
     def __init__(self, host):
         self.connection = http.client.HTTPSConnection(host, Connection.HTTPS_PORT)
 
     def getFromConnection(self, url):
-        #making relative url from passed absolute url
-        urlParts = urlparse(url)
-        relUrl = url.replace(urlParts.scheme, "").replace(urlParts.netloc, "")[3:]
-        self.connection.request("GET", relUrl, headers={
-            "Connection" : "Keep-Alive"
+        return ''.join(self.iterFromConnection(url))
+
+    '''
+        Same as getFromConnection, but yields decoded chunks as they come off the socket
+    '''
+    def iterFromConnection(self, url, chunkSize=CHUNK_SIZE):
+        self.connection.request("GET", Connection._relativeUrl(url), headers={
+            "Connection" : "Keep-Alive",
+            "Accept-Encoding" : ACCEPT_ENCODING
         })
         resp = self.connection.getresponse()
-        return resp.read().decode('utf-8')
+        # response must be read up to the end, or connection could not be reused
+        yield from Connection._iterDecoded(resp, chunkSize)
 
     @staticmethod
     def getUrlContentsAsUtf8(url):
-        return urlreq.urlopen(url).read().decode('utf-8')
+        return ''.join(Connection.iterUrlContentsAsUtf8(url))
+
+    @staticmethod
+    def iterUrlContentsAsUtf8(url, chunkSize=CHUNK_SIZE):
+        with urlreq.urlopen(urlreq.Request(url, headers={"Accept-Encoding": ACCEPT_ENCODING})) as resp:
+            yield from Connection._iterDecoded(resp, chunkSize)
+
+    '''
+        Makes from passed absolute url a relative one(path and query), as it is sent in request line
+    '''
+    @staticmethod
+    def _relativeUrl(url):
+        urlParts = urlparse(url)
+        relUrl = urlParts.path or "/"
+        if urlParts.query:
+            relUrl += "?" + urlParts.query
+        return relUrl
+
+    '''
+        Reads response by chunks, decompresses and decodes them incrementally,
+        so multibyte characters split between chunks are handled correctly.
+        Charset is detected from BOM, Content-Type header or <meta charset>, see charset.py
+        Compressed body is decompressed by Content-Encoding header, see compression.py
+    '''
+    @staticmethod
+    def _iterDecoded(resp, chunkSize):
+        decoder = ByteStreamDecoder(resp.getheader("Content-Type"))
+        content = ContentDecoder(resp.getheader("Content-Encoding"))
+        while True:
+            chunk = resp.read(chunkSize)
+            if not chunk:
+                break
+            text = decoder.decode(content.decompress(chunk))
+            if text:
+                yield text
+        tail = decoder.decode(content.finish()) + decoder.finish()
+        if tail:
+            yield tail
+
+
+'''
+    Pool of keep-alive HTTP(S) connections, keyed by (scheme, host, port).
+    Connection is taken from the pool for one request and returned when response is read up to the end,
+    so many pages from the same host share a few TCP/TLS connections.
+    - no more than 'maxPerHost' connections(busy and idle) are opened to one host, other requests wait;
+    - connections idle for more than 'idleTimeout' seconds are closed;
+    - all bookkeeping is done under a lock, so one pool can be shared by many threads.
+'''
+class ConnectionPool:
+
+    MAX_PER_HOST = 4
+    IDLE_TIMEOUT = 30.0
+    MAX_REDIRECTS = 5
+    REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+    __default = None
+    __defaultLock = threading.Lock()
+
+    def __init__(self, maxPerHost=MAX_PER_HOST, idleTimeout=IDLE_TIMEOUT, timeout=None):
+        assert maxPerHost > 0, "ConnectionPool::__init__() - maxPerHost must be positive"
+        self.__maxPerHost = maxPerHost
+        self.__idleTimeout = idleTimeout
+        self.__timeout = timeout
+        self.__cond = threading.Condition()
+        # key -> list of tuples(connection, time it became idle), most recently used last
+        self.__idle = {}
+        # key -> count of opened connections, busy and idle
+        self.__opened = {}
+        self.__created = 0
+        self.__reused = 0
+
+    '''
+        Shared pool, used by HTMLDomParser when no connection is passed
+    '''
+    @staticmethod
+    def default():
+        with ConnectionPool.__defaultLock:
+            if ConnectionPool.__default is None:
+                ConnectionPool.__default = ConnectionPool()
+            return ConnectionPool.__default
+
+    def getUrlContentsAsUtf8(self, url):
+        return ''.join(self.iterUrlContentsAsUtf8(url))
+
+    '''
+        Yields decoded chunks of response body as they come off the socket.
+        Despite the name(kept for symmetry with Connection), charset of the page is detected
+    '''
+    def iterUrlContentsAsUtf8(self, url, chunkSize=Connection.CHUNK_SIZE):
+        key, conn, resp = self._open(url)
+        yield from self._iterBody(key, conn, resp, lambda r: Connection._iterDecoded(r, chunkSize))
+
+    '''
+        Sends GET request following redirects.
+        Returns tuple(key, connection, response), connection must be given back with _release() when response is read.
+        Throws urllib.error.HTTPError for 4xx and 5xx statuses, like urlopen does.
+    '''
+    def _open(self, url, headers=None):
+        for _ in range(ConnectionPool.MAX_REDIRECTS + 1):
+            key, conn, resp = self.__request(url, headers)
+            if resp.status in ConnectionPool.REDIRECT_CODES and resp.getheader("Location"):
+                location = urljoin(url, resp.getheader("Location"))
+                resp.read()
+                self._release(key, conn, resp)
+                url = location
+                continue
+            if resp.status >= 400:
+                resp.read()
+                self._release(key, conn, resp)
+                raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, None)
+            return key, conn, resp
+        raise urllib.error.URLError("ConnectionPool: too many redirects for {0}".format(url))
+
+    '''
+        Reads body with 'reader' and gives connection back to the pool.
+        If reading is interrupted, connection is closed, because the rest of response is still in it.
+    '''
+    def _iterBody(self, key, conn, resp, reader):
+        completed = False
+        try:
+            yield from reader(resp)
+            completed = True
+        finally:
+            if completed:
+                self._release(key, conn, resp)
+            else:
+                self._discard(key, conn)
+
+    def __request(self, url, headers):
+        urlParts = urlparse(url)
+        scheme = urlParts.scheme.lower()
+        assert scheme in ("http", "https"), "ConnectionPool: unsupported scheme {0}".format(scheme)
+        port = urlParts.port or (Connection.HTTPS_PORT if scheme == "https" else Connection.HTTP_PORT)
+        key = (scheme, urlParts.hostname, port)
+        requestHeaders = {"Connection": "Keep-Alive", "Accept-Encoding": ACCEPT_ENCODING}
+        if headers:
+            requestHeaders.update(headers)
+        conn, reused = self._acquire(key)
+        try:
+            conn.request("GET", Connection._relativeUrl(url), headers=requestHeaders)
+            resp = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            self._discard(key, conn)
+            if not reused:
+                raise
+            # server has closed idle keep-alive connection, trying once more with a new one
+            conn, reused = self._acquire(key, fresh=True)
+            try:
+                conn.request("GET", Connection._relativeUrl(url), headers=requestHeaders)
+                resp = conn.getresponse()
+            except BaseException:
+                self._discard(key, conn)
+                raise
+        except BaseException:
+            self._discard(key, conn)
+            raise
+        return key, conn, resp
+
+    '''
+        Takes idle connection for 'key' or opens a new one, waiting while host limit is reached.
+        Returns tuple(connection, True if it was reused)
+    '''
+    def _acquire(self, key, fresh=False):
+        with self.__cond:
+            while True:
+                self.__evictIdle(time.monotonic())
+                idle = self.__idle.get(key)
+                if idle and not fresh:
+                    self.__reused += 1
+                    return idle.pop()[0], True
+                if self.__opened.get(key, 0) < self.__maxPerHost:
+                    self.__opened[key] = self.__opened.get(key, 0) + 1
+                    self.__created += 1
+                    break
+                if idle:
+                    # fresh connection is needed, but host limit is reached: replacing idle one
+                    idle.pop(0)[0].close()
+                    self.__created += 1
+                    break
+                self.__cond.wait()
+        try:
+            return self.__makeConnection(key), False
+        except BaseException:
+            with self.__cond:
+                self.__opened[key] -= 1
+                self.__cond.notify()
+            raise
+
+    '''
+        Gives connection back after its response was read up to the end
+    '''
+    def _release(self, key, conn, resp):
+        if resp.will_close:
+            self._discard(key, conn)
+            return
+        with self.__cond:
+            self.__idle.setdefault(key, []).append((conn, time.monotonic()))
+            self.__cond.notify()
+
+    def _discard(self, key, conn):
+        conn.close()
+        with self.__cond:
+            self.__opened[key] -= 1
+            self.__cond.notify()
+
+    def __makeConnection(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.__timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.__timeout)
+
+    '''
+        Must be called under lock
+    '''
+    def __evictIdle(self, now):
+        for key, idle in self.__idle.items():
+            # idle lists are sorted by time, oldest first
+            while idle and now - idle[0][1] > self.__idleTimeout:
+                idle.pop(0)[0].close()
+                self.__opened[key] -= 1
+                self.__cond.notify()
+
+    def evictIdle(self):
+        with self.__cond:
+            self.__evictIdle(time.monotonic())
+
+    '''
+        Closes all idle connections. Busy ones are closed when they are released.
+    '''
+    def close(self):
+        with self.__cond:
+            for key, idle in self.__idle.items():
+                for conn, _ in idle:
+                    conn.close()
+                self.__opened[key] -= len(idle)
+            self.__idle.clear()
+            self.__cond.notify_all()
+
+    def stats(self):
+        with self.__cond:
+            return {
+                "created": self.__created,
+                "reused": self.__reused,
+                "opened": sum(self.__opened.values()),
+                "idle": sum(len(idle) for idle in self.__idle.values())
+            }
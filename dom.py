@@ -1,29 +1,68 @@
+import bisect
 import itertools
-import re
-import functools
-from collections.abc import MutableMapping, Iterator
+import sys
+from collections.abc import Mapping, MutableMapping, Iterator
 
 from logger import *
+from selector import compileSelector
+from cache import *
 
-MAX_LRU_CACHE = 128
+'''
+    Bits returned by compareDocumentPosition(), as in DOM
+'''
+DOCUMENT_POSITION = {
+    "DISCONNECTED": 1,
+    "PRECEDING": 2,
+    "FOLLOWING": 4,
+    "CONTAINS": 8,
+    "CONTAINED_BY": 16,
+}
 
+'''
+    Document order positions.
+    Element takes one position when it is opened and one when it is closed, text takes one, so subtree is a range.
+    Positions are ORDER_GAP apart, nodes inserted later take positions from the gap between their neighbours,
+    so indexes stay valid without rebuilding.
+    When the gap is used up, the closest ancestor with room for half as many positions again renumbers its descendants
+    ORDER_GAP apart and leaves all free room at the insert point, where next inserts are likely to go.
+    Root without such ancestor gets fresh range with twice as much room.
+'''
+ORDER_GAP = 1 << 32
+
+'''
+    Elements have only a few classes, so they are kept in a tuple:
+    it is several times smaller than a set and lookup is just as fast for such sizes.
+    'owner' is the element, whose classes are changed on add/remove(together with its class attribute and class index).
+    Elements with the same class attribute share one tuple, so changes never modify it, a new tuple is made instead.
+'''
 class ClassList:
 
-    def __init__(self):
-        self.__classes = set()
+    __slots__ = ('__classes', '__owner')
+
+    def __init__(self, classes=(), owner=None):
+        self.__classes = tuple(classes)
+        self.__owner = owner
 
     def add(self, classname):
         assert isinstance(classname, str), "ClassList::add() - classname must be a string"
-        self.__classes.add(classname)
+        classes = self.__get()
+        if classname not in classes:
+            self.__set(classes + (classname,))
         return self
 
     def contains(self, classname):
         assert isinstance(classname, str), "ClassList::contains() - classname must be a string"
-        return classname in self.__classes
+        return classname in self.__get()
 
+    '''
+        WARNING! Throws KeyError if there is no such class
+    '''
     def remove(self, classname):
         assert isinstance(classname, str), "ClassList::remove() - classname must be a string"
-        self.__classes.remove(classname)
+        classes = self.__get()
+        if classname not in classes:
+            raise KeyError(classname)
+        self.__set(tuple(item for item in classes if item != classname))
         return self
 
     '''
@@ -37,32 +76,85 @@ class ClassList:
         else:
             self.add(classname)
 
+    def __get(self):
+        return self.__classes if self.__owner is None else self.__owner._classes()
+
+    def __set(self, classes):
+        if self.__owner is None:
+            self.__classes = classes
+        else:
+            self.__owner.document()._beforeMutation()
+            self.__owner._setClasses(classes)
+
 
 '''
     Just a dict that checks types
     Keys - string
     values - HTMLDomNodes
     Used for quick selection by ID from HTML document
+    Id which is not unique belongs to the first of its elements in document order, like in DOM,
+    others are remembered, so that the next one takes the id when the first is removed or changed.
 '''
 class IdStorage(MutableMapping):
 
     def __init__(self, *args, **kwargs):
         self.store = dict()
+        # key -> all elements with this id in document order, only for ids which are not unique
+        self.duplicates = dict()
         self.update(dict(*args, **kwargs))  # use the free update to set keys
 
     def __getitem__(self, key):
         return self.store[key]
 
+    def add(self, key, value):
+        self[key] = value
+
     def __setitem__(self, key, value):
         assert isinstance(key, str), "IdStorage::set() - key must be a string"
         assert isinstance(value, HTMLDomNode), "IdStorage::set() - value must be a HTMLDomNode"
 
-        if (key in self.store):
-            Logger.warning("IdStorage::set() - malformed HTML, id {0} is not unique".format(key))
-        self.store[key] = value
+        current = self.store.get(key)
+        if current is None:
+            self.store[key] = value
+            return
+        holders = self.duplicates.get(key)
+        if current is value or (holders is not None and any(item is value for item in holders)):
+            return
+        Logger.warning("IdStorage::set() - malformed HTML, id {0} is not unique".format(key))
+        if holders is None:
+            holders = [current]
+            self.duplicates[key] = holders
+        index = bisect.bisect([item._order() for item in holders], value._order())
+        holders.insert(index, value)
+        self.store[key] = holders[0]
 
     def __delitem__(self, key):
         del self.store[key]
+        self.duplicates.pop(key, None)
+
+    '''
+        Removes 'value' from elements with id 'key', the next of them(if any) takes the id
+    '''
+    def discard(self, key, value):
+        holders = self.duplicates.get(key)
+        if holders is None:
+            if self.store.get(key) is value:
+                del self.store[key]
+            return
+        holders[:] = [item for item in holders if item is not value]
+        self.store[key] = holders[0]
+        if len(holders) == 1:
+            del self.duplicates[key]
+
+    '''
+        All elements with id 'key' in document order
+    '''
+    def holders(self, key):
+        holders = self.duplicates.get(key)
+        if holders is not None:
+            return list(holders)
+        value = self.store.get(key)
+        return [] if value is None else [value]
 
     def __iter__(self):
         return iter(self.store)
@@ -71,6 +163,98 @@ class IdStorage(MutableMapping):
         return len(self.store)
 
 
+'''
+    Inverted index: key(tag or class name) -> elements with this key in document order.
+    Every element knows its document order position and position of its last descendant,
+    so elements of a subtree are just a range here, found with binary search.
+    Used for quick selection by tag and class from HTML document.
+'''
+class OrderedIndex(Mapping):
+
+    def __init__(self):
+        # key -> tuple(list of document order positions, list of HTMLDomNodes), both sorted
+        self.store = dict()
+
+    def __getitem__(self, key):
+        return self.store[key][1]
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+    '''
+        Parser creates elements in document order, so they are just appended
+    '''
+    def add(self, key, node):
+        entry = self.store.get(key)
+        if entry is None:
+            entry = ([], [])
+            self.store[key] = entry
+        entry[0].append(node._order())
+        entry[1].append(node)
+
+    '''
+        Adds node keeping document order, for nodes changed after they were created
+    '''
+    def insert(self, key, node):
+        entry = self.store.get(key)
+        if entry is None or len(entry[0]) == 0 or entry[0][-1] < node._order():
+            # not self.add(): it may be wrapped by instrumentation, time must not be counted twice
+            OrderedIndex.add(self, key, node)
+            return
+        index = bisect.bisect_left(entry[0], node._order())
+        if index < len(entry[1]) and entry[1][index] is node:
+            return
+        entry[0].insert(index, node._order())
+        entry[1].insert(index, node)
+
+    def discard(self, key, node):
+        entry = self.store.get(key)
+        if entry is None:
+            return
+        index = bisect.bisect_left(entry[0], node._order())
+        if index < len(entry[1]) and entry[1][index] is node:
+            del entry[0][index]
+            del entry[1][index]
+
+    '''
+        Positions of nodes in [first, last] were changed keeping their order, takes new positions from the nodes
+    '''
+    def reorder(self, key, first, last):
+        entry = self.store.get(key)
+        if entry is None:
+            return
+        orders, nodes = entry
+        begin, end = bisect.bisect_left(orders, first), bisect.bisect_right(orders, last)
+        orders[begin:end] = [node._order() for node in nodes[begin:end]]
+
+    def clear(self):
+        self.store.clear()
+
+    '''
+        Returns nodes by key, which positions are in [first, last]
+    '''
+    def range(self, key, first, last):
+        entry = self.store.get(key)
+        if entry is None:
+            return []
+        orders, nodes = entry
+        return nodes[bisect.bisect_left(orders, first):bisect.bisect_right(orders, last)]
+
+    '''
+        Same as range(), but nodes are yielded one by one without copying
+    '''
+    def iterRange(self, key, first, last):
+        entry = self.store.get(key)
+        if entry is None:
+            return
+        orders, nodes = entry
+        for i in range(bisect.bisect_left(orders, first), bisect.bisect_right(orders, last)):
+            yield nodes[i]
+
+
 '''
     Iterates through passed startElement and its children.
     WARNING: loops only through Elements.
@@ -101,8 +285,8 @@ class HTMLDomIterator(Iterator):
             self.cur = children[self.curIndex]
             self.curIndex = 0
         else:
-            if len(self.stack) != 0:
-                self.cur, self.curIndex = self.__popSearch()
+            # leaf without anything left in stack ends iteration too
+            self.cur, self.curIndex = self.__popSearch()
         if(self.cur == None):
             raise StopIteration
         return self.cur
@@ -132,13 +316,13 @@ class HTMLDomIterator(Iterator):
 '''
 class HTMLDomNode:
 
-    # regular expression for css selectors
-    CssIdentifierRe = r'\-?[_a-zA-Z]+[_a-zA-Z0-9-]*'
-    CssPrefixRe = r'[.#]'
-    QuotedRe = r'(?:"[^"]*?")|(?:\'[^\']*?\')'
-    CssAttrRe = r'\[(?P<attrKey>' + CssIdentifierRe + r')((?P<attrAction>[~|^$*]?=)(?P<attrVal>' + QuotedRe + r'))?\]'
-    # precomiling this re, because only this regexp is used mostly always
-    CssUnitRe = re.compile(r'(?:^|\s+)(?P<asterisk>\*)|(?P<prefix>' + CssPrefixRe + r')?(?P<identifier>' + CssIdentifierRe + r')(?P<attr>' + CssAttrRe + r')?(?:$|\s+)')
+    '''
+        Nodes are the bulk of the heap, so they have no __dict__.
+        Attributes, class list and child lists are allocated only when node really has them(None until then).
+    '''
+    __slots__ = ('__document', '__parent', '__previousElementSibling', '__previousSibling', '__nextElementSibling',
+                 '__nextSibling', '__tag', '__attrs', '__childNodes', '__children', '__classes', '__text',
+                 '__order', '__lastOrder')
 
     def __init__(self, document, parent=None, tag="", attrs=None, text=""):
         if attrs is None:
@@ -155,17 +339,33 @@ class HTMLDomNode:
         self.__previousSibling = None
         self.__nextElementSibling = None
         self.__nextSibling = None
-        self.__tag = tag
-        self.__attrs = {}
-        self.__childNodes = []
-        self.__children = []
-        self.__classList = ClassList()
+        # tag and attribute names are taken from symbol table of the document, so equal names are one object
+        self.__tag = document._symbol(tag)
+        self.__attrs = None
+        self.__childNodes = None
+        self.__children = None
+        # tuple of class names, shared with other elements with the same class attribute
+        self.__classes = None
         self.__text = text
+        # document order positions of the start and of the end of this node(None while subtree is not closed)
+        self.__order = document._nextOrder()
+        # nodes made without parent are not in the tree until they are inserted, so they are not indexed
+        indexed = parent is not None or document is self
+        if tag == "":
+            # text nodes never have descendants
+            self.__lastOrder = self.__order
+        else:
+            self.__lastOrder = None if indexed else document._nextOrder()
 
-        self.__makeAttrs(attrs)
-        self.__processAttrs()
+        if tag != "" and indexed:
+            document.getTagStorage().add(self.__tag, self)
+        if len(attrs) != 0:
+            self.__makeAttrs(attrs)
+            self.__processAttrs(indexed)
 
     def childNodes(self):
+        if self.__childNodes is None:
+            return []
         return self.__childNodes
 
     '''
@@ -173,21 +373,55 @@ class HTMLDomNode:
         WARNING: may be slow(calculating array in function), but we do not want any before-time optimization
     '''
     def children(self):
+        if self.__children is None:
+            return []
         return self.__children
 
+    '''
+        Class list is a small view over classes of this element, changes made through it are applied to the element
+    '''
     def classList(self):
-        return self.__classList
+        return ClassList(owner=self)
+
+    '''
+        Position of 'other' relatively to this node, combination of DOCUMENT_POSITION bits(0 for the node itself).
+        Ancestor of node precedes it, descendants follow it.
+    '''
+    def compareDocumentPosition(self, other):
+        assert isinstance(other, HTMLDomNode), "HTMLDomNode::compareDocumentPosition() - other must be a HTMLDomNode"
+        if other is self:
+            return 0
+        if other.__document is not self.__document:
+            return DOCUMENT_POSITION["DISCONNECTED"]
+        if self.contains(other):
+            return DOCUMENT_POSITION["CONTAINED_BY"] | DOCUMENT_POSITION["FOLLOWING"]
+        if other.contains(self):
+            return DOCUMENT_POSITION["CONTAINS"] | DOCUMENT_POSITION["PRECEDING"]
+        # removed subtrees and nodes not inserted yet are trees of their own
+        if not (self._isConnected() and other._isConnected()) and self.__root() is not other.__root():
+            return DOCUMENT_POSITION["DISCONNECTED"]
+        return DOCUMENT_POSITION["FOLLOWING"] if other.__order > self.__order else DOCUMENT_POSITION["PRECEDING"]
+
+    '''
+        True if 'other' is this node or its descendant.
+        Subtree is a range of document order positions, so it is just two comparisons.
+        Subtrees out of the document have their own positions, which never overlap with positions of the document.
+    '''
+    def contains(self, other):
+        if other is None or other.__document is not self.__document:
+            return False
+        return self.__order <= other.__order <= self._lastOrder()
 
     def document(self):
         return self.__document
 
     def firstChild(self):
-        if len(self.__childNodes) == 0:
+        if not self.__childNodes:
             return None
         return self.__childNodes[0]
 
     def firstElementChild(self):
-        if len(self.__children) == 0:
+        if not self.__children:
             return None
         return self.__children[0]
 
@@ -196,39 +430,84 @@ class HTMLDomNode:
     '''
     def getAttribute(self, name):
         assert isinstance(name, str), "HTMLDomNode::getAttribute() - name must be a string"
-        if not(self.hasAttribute(name)):
+        if self.__attrs is None:
             return None
-        return self.__attrs[name]
+        return self.__attrs.get(name)
 
     '''
         searches ALL elements with class name 'className', starting from THIS node
-        As this operation may be a bit expensive, using lru_cache
+        Subtree is a range of document's class index, so no traversal is needed
+        Results are kept in query cache of the document, returned list must not be changed
     '''
-    @functools.lru_cache(MAX_LRU_CACHE)
     def getElementsByClassName(self, className):
         assert isinstance(className, str), "HTMLDomNode::getElementsByClassName() - name must be a string"
-        return list(filter(lambda x: x.classList().contains(className), HTMLDomIterator(self)))
+        cache = self.__document.getQueryCache()
+        key = (self, "class", className)
+        res = cache.get(key)
+        if res is not None:
+            return res
+        if not self._isConnected():
+            res = list(filter(lambda x: x._hasClass(className), HTMLDomIterator(self)))
+        else:
+            res = self.__document.getClassStorage().range(className, self.__order, self._lastOrder())
+        cache.put(key, res)
+        return res
 
     '''
         searches ALL elements with tag name 'tagName', starting from THIS node
-        As this operation may be a bit expensive, using lru_cache
+        Subtree is a range of document's tag index, so no traversal is needed
+        Results are kept in query cache of the document, returned list must not be changed
     '''
-    @functools.lru_cache(MAX_LRU_CACHE)
     def getElementsByTagName(self, tagName):
         assert isinstance(tagName, str), "HTMLDomNode::getElementsByTagName() - name must be a string"
-        return list(filter(lambda x: x.tagName() == tagName, HTMLDomIterator(self)))
+        cache = self.__document.getQueryCache()
+        key = (self, "tag", tagName)
+        res = cache.get(key)
+        if res is not None:
+            return res
+        if not self._isConnected():
+            res = list(filter(lambda x: x.tagName() == tagName, HTMLDomIterator(self)))
+        else:
+            res = self.__document.getTagStorage().range(tagName, self.__order, self._lastOrder())
+        cache.put(key, res)
+        return res
+
+    '''
+        Lazy variants of getElementsByClassName() and getElementsByTagName(): elements are found while they are consumed,
+        nothing is cached or copied, so stopping early costs only what was already consumed.
+    '''
+    def iterElementsByClassName(self, className):
+        assert isinstance(className, str), "HTMLDomNode::iterElementsByClassName() - name must be a string"
+        if not self._isConnected():
+            return filter(lambda x: x._hasClass(className), HTMLDomIterator(self))
+        return self.__document.getClassStorage().iterRange(className, self.__order, self._lastOrder())
+
+    def iterElementsByTagName(self, tagName):
+        assert isinstance(tagName, str), "HTMLDomNode::iterElementsByTagName() - name must be a string"
+        if not self._isConnected():
+            return filter(lambda x: x.tagName() == tagName, HTMLDomIterator(self))
+        return self.__document.getTagStorage().iterRange(tagName, self.__order, self._lastOrder())
+
+    '''
+        Lazy variant of querySelectorAll(), matches are yielded in document order as they are found
+    '''
+    def iterQuerySelectorAll(self, selectors):
+        instrumentation = self.__document.getInstrumentation()
+        if instrumentation is None:
+            return compileSelector(selectors).iterSelect(self)
+        return instrumentation.timeLazyQuery(selectors, compileSelector(selectors).iterSelect(self))
 
     def hasAttribute(self, name):
         assert isinstance(name, str), "HTMLDomNode::hasAttribute() - name must be a string"
-        return name in self.__attrs
+        return self.__attrs is not None and name in self.__attrs
 
     def lastChild(self):
-        if len(self.__childNodes) == 0:
+        if not self.__childNodes:
             return None
         return self.__childNodes[-1]
 
     def lastElementChild(self):
-        if len(self.__children) == 0:
+        if not self.__children:
             return None
         return self.__children[-1]
 
@@ -253,7 +532,10 @@ class HTMLDomNode:
     def parentElement(self):
         curParent = self.parentNode()
         while curParent and not isinstance(curParent, HTMLDomElement):
-            curParent = self.parentNode()
+            curParent = curParent.parentNode()
+        # document is not an element
+        if isinstance(curParent, HTMLDocument):
+            return None
         return curParent
 
     def previousSibling(self):
@@ -266,35 +548,54 @@ class HTMLDomNode:
     def previousElementSibling(self):
         return self.__previousElementSibling
 
+    '''
+        Returns the first match, matching stops on it
+    '''
     def querySelector(self, selectors):
-        res = self.querySelectorAll(selectors)
-        return res[0] if res and len(res) > 0 else None
+        res = self.__document.getQueryCache().get((self, "selector", selectors))
+        if res is not None:
+            return res[0] if len(res) > 0 else None
+        instrumentation = self.__document.getInstrumentation()
+        if instrumentation is None:
+            return next(compileSelector(selectors).iterSelect(self), None)
+        return instrumentation.timeFirstQuery(selectors, lambda: next(compileSelector(selectors).iterSelect(self), None))
 
-    @functools.lru_cache(MAX_LRU_CACHE)
+    '''
+        Selector string is compiled once(see selector.py) and matched right-to-left against candidates from this subtree
+        Results are kept in query cache of the document, returned list must not be changed
+    '''
     def querySelectorAll(self, selectors):
-        # last match elements
-        lastMatches = None
-        # last match objects
-        lastM = None
-        for m in HTMLDomNode.CssUnitRe.finditer(selectors):
-            newMatches = self.__cssParseSelector(m)
-            newMatches = self.__cssParseArgs(m, newMatches)
-            if lastMatches:
-                # combiner is chars between two selectors
-                combiner = selectors[lastM.end(): m.start()].strip()
-                #normalizing
-                if combiner == '':
-                    combiner = ' '
-                newMatches = self.__cssCombineMatches(combiner, self.__getIdDictFromList(newMatches), self.__getIdDictFromList(lastMatches))
-            lastM = m
-            lastMatches = newMatches
-        return lastMatches
-
-    '''
-        WARNING! Throws if name is not a correct key from 'attrs' dict
+        cache = self.__document.getQueryCache()
+        key = (self, "selector", selectors)
+        res = cache.get(key)
+        if res is not None:
+            return res
+        instrumentation = self.__document.getInstrumentation()
+        if instrumentation is None:
+            res = compileSelector(selectors).selectAll(self)
+        else:
+            res = instrumentation.timeQuery(selectors, lambda: compileSelector(selectors).selectAll(self))
+        cache.put(key, res)
+        return res
+
+    '''
+        Changes of 'class' and 'id' are applied to class list and to indexes of the document
     '''
+    def removeAttribute(self, name):
+        assert isinstance(name, str), "HTMLDomNode::removeAttribute() - name must be a string"
+        if self.__attrs is None or name not in self.__attrs:
+            return
+        self.__document._beforeMutation()
+        self.__changeAttribute(name, None)
+        del self.__attrs[name]
+
     def setAttribute(self, name, value):
         assert isinstance(name, str), "HTMLDomNode::setAttribute() - name must be a string"
+        self.__document._beforeMutation()
+        name = self.__document._symbol(name)
+        self.__changeAttribute(name, value)
+        if self.__attrs is None:
+            self.__attrs = {}
         self.__attrs[name] = value
 
     def tagName(self):
@@ -304,126 +605,57 @@ class HTMLDomNode:
         return self.__text
 
     '''
-        Helper function for query selector
-        Combines two selectors(two groups, new Matches and lastMatches) using combiner
-        *Matches is dict as {id(node): node}
-    '''
-    def __cssCombineMatches(self, combiner, newMatches, lastMatches):
-        assert isinstance(newMatches, dict) and isinstance(lastMatches, dict), "HTMLDomNode::__cssCombineMatches() - invalid newMatches or lastMatches, must be a dict"
-
-        # subfunction for ',' combiner
-        def updateAndGet(d1, d2):
-            d1.update(d2)
-            return d1.values()
-
-        actions = {
-            ',': lambda: updateAndGet(lastMatches, newMatches),
-            ' ': lambda: list(filter(lambda node: True in map(lambda ancestor: id(ancestor) in lastMatches, node.__getAllAncestors()), newMatches.values())),
-            '>': lambda: list(filter(lambda node: id(node.parentNode()) in lastMatches , newMatches.values())),
-            '+': lambda: list(filter(lambda node: id(node.previousSibling()) in lastMatches, newMatches.values())),
-            '~': lambda: list(filter(lambda node: True in map(lambda sibl: id(sibl) in lastMatches, node.__getAllPrevSiblings()), newMatches.values())),
-        }
-        return actions[combiner]()
-
-    '''
-        Helper function for querySelector
-        parser attributes in []
-    '''
-    def __cssParseArgs(self, matchObj, matches):
-        if not matchObj['attrKey']:
-            return matches
-        key = matchObj['attrKey']
-        op  = matchObj['attrAction']
-        val = matchObj['attrVal']
-        # matches [key]
-        if not op and not val:
-            return list(filter(lambda x: x.hasAttribute(key), matches))
-        # unquoting val
-        val = val.strip("'\"")
-        filters = {
-            '='  : lambda x: True if x.getAttribute(key) and x.getAttribute(key) == val else False,
-            # contains WORD
-            '~=' : lambda x: True if x.getAttribute(key) and val in x.getAttribute(key).split(' ') else False,
-            '|=' : lambda x: True if x.getAttribute(key) and x.getAttribute(key).startswith(val) else False,
-            '^=' : lambda x: True if x.getAttribute(key) and x.getAttribute(key).startswith(val) else False,
-            '$=' : lambda x: True if x.getAttribute(key) and x.getAttribute(key).endswith(val) else False,
-            # contains SUBSTRING
-            '*=' : lambda x: True if x.getAttribute(key) and val in x.getAttribute(key) else False
-        }
-        return list(filter(filters[op], matches))
-
-    '''
-        Helper function for querySelector.
-        Selects needed nodes.
-    '''
-    def __cssParseSelector(self, matchObj):
-        if(matchObj.group('asterisk')):
-            return  [self] + self.children()
-        # prefix is . or #
-        prefix = matchObj.group('prefix')
-        identifier = matchObj.group('identifier')
-        if not identifier:
-            raise ValueError("HTMLDomNode::__parseCss() - invalid Css selector")
-        operations = {
-            '.': self.getElementsByClassName,
-            '#': self.document().getElementById
-        }
-        if prefix:
-            res = operations[prefix](identifier)
-            # normalizing result
-            if not isinstance(res, list):
-                res = [res]
-            if len(res) == 1 and res[0] == None:
-                res = []
-            return res
-        return self.getElementsByTagName(identifier)
-
-    def __getAllAncestors(self):
-        ancestors = []
-        curAncestor = self.parentElement()
-        while (curAncestor):
-            ancestors.append(curAncestor)
-            curAncestor = curAncestor.parentElement()
-        return ancestors
-
-    def __getAllPrevSiblings(self):
-        siblings = []
-        curSibling = self.previousElementSibling()
-        while (curSibling):
-            siblings.append(curSibling)
-            curSibling = curSibling.previousElementSibling()
-        return siblings
-
-    def __getIdDictFromList(self, l):
-        assert isinstance(l, list), "HTMLDomNode::__getIdDictFromHtmlDomNodeList() - l must be a list"
-        return dict(map(lambda x: {id(x), x}, l))
+        Text of this node and all its descendants joined in document order, like DOM textContent.
+        Texts are stripped by default, so texts of neighbour elements run together("<li>one</li><li>two</li>" gives "onetwo"):
+        parse with stripWhitespace=False to keep whitespaces between them, or pass 'separator' to put between texts.
+    '''
+    def textContent(self, separator=''):
+        if self.__childNodes is None:
+            return self.__text
+        parts = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            childNodes = node.__childNodes
+            if childNodes is None:
+                if node.__text:
+                    parts.append(node.__text)
+            else:
+                stack.extend(reversed(childNodes))
+        return separator.join(parts)
 
     '''
         Makes from passed list of tuples a dictionary of attributes
     '''
     def __makeAttrs(self, attrs):
-        for attr in attrs:
-            self.__attrs[attr[0]] = attr[1]
+        symbol = self.__document._symbol
+        self.__attrs = {symbol(key): value for key, value in attrs}
 
     '''
         Does some operations with attributes.
         For example, splits string value of 'class' attribute to separate values
     '''
-    def __processAttrs(self):
-        self.__processAttrsClassList()
-        self.__processAttrsId()
+    def __processAttrs(self, indexed):
+        self.__processAttrsClassList(indexed)
+        if indexed:
+            self.__processAttrsId()
 
     '''
         Forming classlist
     '''
-    def __processAttrsClassList(self):
+    def __processAttrsClassList(self, indexed):
         classesStr = self.getAttribute("class")
         if classesStr is None or classesStr == '':
             return
-        # spliting by spaces, removing extra spaces, joining
-        classList = list(itertools.filterfalse(lambda x: x == '', classesStr.split(' ')))
-        for item in classList:
-            self.__classList.add(item)
+        classes = self.__document._classSet(classesStr)
+        if len(classes) == 0:
+            return
+        self.__classes = classes
+        if not indexed:
+            return
+        classStorage = self.document().getClassStorage()
+        for item in classes:
+            classStorage.add(item, self)
 
     '''
         Forming ID storage in HTMLDocument
@@ -432,7 +664,340 @@ class HTMLDomNode:
         id = self.getAttribute("id")
         if(id is None or id == ''):
             return
-        self.document().getIdStorage()[id] = self
+        self.document().getIdStorage().add(id, self)
+
+    '''
+        Applies new value of attribute 'name' to classes and indexes, before attribute itself is changed(None - removed)
+    '''
+    def __changeAttribute(self, name, value):
+        if name == "class":
+            self.__changeClasses(self.__document._classSet(value) if value else ())
+        elif name == "id" and self._isConnected():
+            idStorage = self.__document.getIdStorage()
+            old = self.getAttribute("id")
+            if old:
+                idStorage.discard(old, self)
+            if value:
+                idStorage.add(value, self)
+
+    def __changeClasses(self, classes):
+        old = self._classes()
+        if self._isConnected():
+            classStorage = self.__document.getClassStorage()
+            for item in old:
+                if item not in classes:
+                    classStorage.discard(item, self)
+            for item in classes:
+                if item not in old:
+                    classStorage.insert(item, self)
+        self.__classes = classes if len(classes) != 0 else None
+
+    '''
+        Adds elements of this subtree to indexes of the document, or removes them from there
+    '''
+    def __index(self):
+        document = self.__document
+        tagStorage, classStorage, idStorage = document.getTagStorage(), document.getClassStorage(), document.getIdStorage()
+        for node in HTMLDomIterator(self):
+            if node.__tag == "":
+                continue
+            tagStorage.insert(node.__tag, node)
+            for item in node._classes():
+                classStorage.insert(item, node)
+            id = node.getAttribute("id")
+            if id:
+                idStorage.add(id, node)
+
+    def __unindex(self):
+        document = self.__document
+        tagStorage, classStorage, idStorage = document.getTagStorage(), document.getClassStorage(), document.getIdStorage()
+        for node in HTMLDomIterator(self):
+            if node.__tag == "":
+                continue
+            tagStorage.discard(node.__tag, node)
+            for item in node._classes():
+                classStorage.discard(item, node)
+            id = node.getAttribute("id")
+            if id:
+                idStorage.discard(id, node)
+
+    '''
+        Child lists and sibling links. Element sibling links connect only elements, like child lists of elements.
+    '''
+    def __link(self, child, ref):
+        if self.__childNodes is None:
+            self.__childNodes = []
+        childNodes = self.__childNodes
+        if ref is None:
+            prev = childNodes[-1] if len(childNodes) != 0 else None
+            childNodes.append(child)
+        else:
+            prev = ref.__previousSibling
+            childNodes.insert(childNodes.index(ref), child)
+        child.__parent = self
+        child.__previousSibling, child.__nextSibling = prev, ref
+        if prev is not None:
+            prev.__nextSibling = child
+        if ref is not None:
+            ref.__previousSibling = child
+        if not isinstance(child, HTMLDomElement):
+            return
+        nextElem = ref
+        while nextElem is not None and not isinstance(nextElem, HTMLDomElement):
+            nextElem = nextElem.__nextSibling
+        if self.__children is None:
+            self.__children = []
+        children = self.__children
+        index = len(children) if nextElem is None else children.index(nextElem)
+        prevElem = children[index - 1] if index != 0 else None
+        children.insert(index, child)
+        child.__previousElementSibling, child.__nextElementSibling = prevElem, nextElem
+        if prevElem is not None:
+            prevElem.__nextElementSibling = child
+        if nextElem is not None:
+            nextElem.__previousElementSibling = child
+
+    def __unlink(self, child):
+        prev, next = child.__previousSibling, child.__nextSibling
+        if prev is not None:
+            prev.__nextSibling = next
+        if next is not None:
+            next.__previousSibling = prev
+        self.__childNodes.remove(child)
+        if isinstance(child, HTMLDomElement):
+            prevElem, nextElem = child.__previousElementSibling, child.__nextElementSibling
+            if prevElem is not None:
+                prevElem.__nextElementSibling = nextElem
+            if nextElem is not None:
+                nextElem.__previousElementSibling = prevElem
+            self.__children.remove(child)
+        child.__parent = None
+        child.__previousSibling = child.__nextSibling = None
+        child.__previousElementSibling = child.__nextElementSibling = None
+
+    '''
+        Node may reference its parent before it was appended to it(parser makes nodes this way)
+    '''
+    def __isLinked(self, child):
+        return child.__parent is self and (child.__previousSibling is not None or
+                                           (bool(self.__childNodes) and self.__childNodes[0] is child))
+
+    def __root(self):
+        node = self
+        while node.__parent is not None:
+            node = node.__parent
+        return node
+
+    '''
+        Count of document order positions taken by this subtree
+    '''
+    def __countOrders(self):
+        count = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            count += 1 if node.__tag == "" else 2
+            if node.__childNodes:
+                stack.extend(node.__childNodes)
+        return count
+
+    '''
+        Gives positions from iterator 'orders' to this subtree in document order
+    '''
+    def __renumber(self, orders):
+        stack = [(self, False)]
+        while stack:
+            node, closing = stack.pop()
+            if closing:
+                node.__lastOrder = next(orders)
+            elif node.__tag == "":
+                node.__order = node.__lastOrder = next(orders)
+            else:
+                node.__order = next(orders)
+                stack.append((node, True))
+                if node.__childNodes:
+                    stack.extend((child, False) for child in reversed(node.__childNodes))
+
+    '''
+        No free positions left around new 'child' of this node: see ORDER_GAP
+    '''
+    def __spreadOrders(self, child):
+        node, below = self, child
+        # positions of descendants of node and those of them up to the end of child
+        count = before = child.__countOrders()
+        while True:
+            seen = False
+            for sibling in node.__childNodes:
+                if sibling is below:
+                    seen = True
+                    continue
+                siblingCount = sibling.__countOrders()
+                count += siblingCount
+                if not seen:
+                    before += siblingCount
+            if 2 * (node._lastOrder() - node.__order) >= 3 * (count + 1) * ORDER_GAP or node.__parent is None:
+                break
+            # node opens before child and closes after it
+            count += 2
+            before += 1
+            node, below = node.__parent, node
+        document = self.__document
+        fresh = 2 * (node._lastOrder() - node.__order) < 3 * (count + 1) * ORDER_GAP
+        if fresh:
+            orders = document._reserveOrders(2 * (count + 2))
+            node.__order, node.__lastOrder = orders[0], orders[-1]
+        first, last = node.__order, node._lastOrder()
+        orders = itertools.chain(range(first + ORDER_GAP, first + (before + 1) * ORDER_GAP, ORDER_GAP),
+                                 range(last - (count - before) * ORDER_GAP, last, ORDER_GAP))
+        for item in node.__childNodes:
+            item.__renumber(orders)
+        if fresh:
+            if node is document:
+                document._reindex()
+            return
+        if not node._isConnected():
+            return
+        # the range of node is the same, so only positions inside of it are updated in indexes
+        tagStorage, classStorage = document.getTagStorage(), document.getClassStorage()
+        tags, classes = set(), set()
+        for elem in HTMLDomIterator(node):
+            tags.add(elem.__tag)
+            classes.update(elem._classes())
+        for tag in tags:
+            tagStorage.reorder(tag, first, last)
+        for item in classes:
+            classStorage.reorder(item, first, last)
+
+    '''
+        Mutations. Child lists, sibling links, indexes and positions are updated only around the changed subtree.
+    '''
+    def _insertBefore(self, child, ref):
+        assert isinstance(child, HTMLDomNode), "HTMLDomNode::insertBefore() - child must be a HTMLDomNode"
+        if isinstance(child, HTMLDocument) or child.__document is not self.__document or child.contains(self):
+            raise ValueError("HTMLDomNode::insertBefore() - node can not be inserted here")
+        if ref is not None and not (isinstance(ref, HTMLDomNode) and self.__isLinked(ref)):
+            raise ValueError("HTMLDomNode::insertBefore() - reference node is not a child of this node")
+        self.__document._beforeMutation()
+        if ref is child:
+            ref = child.__nextSibling
+        # old positions of the subtree are removed first, it is in the document or was indexed by constructor
+        child.__unindex()
+        parent = child.__parent
+        if parent is not None and parent.__isLinked(child):
+            parent.__unlink(child)
+        if ref is not None:
+            prev = ref.__previousSibling
+        else:
+            prev = self.__childNodes[-1] if self.__childNodes else None
+        first = self.__order if prev is None else prev._lastOrder()
+        last = self._lastOrder() if ref is None else ref.__order
+        self.__link(child, ref)
+        # usual spacing while there is room, so that room is left after child for the next inserts
+        step = min(ORDER_GAP, (last - first) // (child.__countOrders() + 1))
+        if step != 0:
+            child.__renumber(iter(range(first + step, last, step)))
+        else:
+            self.__spreadOrders(child)
+        if self._isConnected():
+            child.__index()
+        return child
+
+    def _removeChild(self, child):
+        if not (isinstance(child, HTMLDomNode) and self.__isLinked(child)):
+            raise ValueError("HTMLDomNode::removeChild() - node is not a child of this node")
+        self.__document._beforeMutation()
+        if self._isConnected():
+            child.__unindex()
+        self.__unlink(child)
+        # subtree is out of the document range from now on
+        child.__renumber(iter(self.__document._reserveOrders(child.__countOrders())))
+        return child
+
+    '''
+        Appends child to child lists and links it with the previous last child,
+        so no post-pass over the tree is needed
+    '''
+    def _appendChild(self, child):
+        document = self.__document
+        # document is not closed while it is built: cache is not invalidated for every node then, see getQueryCache()
+        if document.__lastOrder is not None:
+            document._beforeMutation()
+        if self.__childNodes is None:
+            self.__childNodes = []
+        childNodes = self.__childNodes
+        if len(childNodes) != 0:
+            childNodes[-1]._setRightSibling(child)
+            child._setLeftSibling(childNodes[-1])
+        childNodes.append(child)
+        if isinstance(child, HTMLDomElement):
+            if self.__children is None:
+                self.__children = []
+            children = self.__children
+            if len(children) != 0:
+                children[-1]._setRightElementSibling(child)
+                child._setLeftElementSibling(children[-1])
+            children.append(child)
+
+    '''
+        Attributes dict without copying, None if node has no attributes
+    '''
+    def _attrs(self):
+        return self.__attrs
+
+    '''
+        Marks end of subtree: all nodes created since this one are its descendants
+    '''
+    def _closeSubtree(self):
+        self.__lastOrder = self.__document._nextOrder()
+        if self.__document is self and not self.isFrozen():
+            # results of queries made while it was built are dropped
+            self.getQueryCache().invalidate()
+
+    '''
+        False while subtree is still being built
+    '''
+    def _isClosed(self):
+        return self.__lastOrder is not None
+
+    def _order(self):
+        return self.__order
+
+    '''
+        Position of the end of subtree. For subtree that is still being parsed it is the last created node.
+    '''
+    def _lastOrder(self):
+        if self.__lastOrder is None:
+            return self.__document._currentOrder()
+        return self.__lastOrder
+
+    '''
+        False for removed subtrees and nodes not inserted yet: they are not in indexes of the document
+    '''
+    def _isConnected(self):
+        document = self.__document
+        return document.__order <= self.__order <= document._lastOrder()
+
+    '''
+        Checks class without creating class list for elements that have none
+    '''
+    def _hasClass(self, classname):
+        return self.__classes is not None and classname in self.__classes
+
+    '''
+        Tuple of class names, must not be changed
+    '''
+    def _classes(self):
+        return () if self.__classes is None else self.__classes
+
+    '''
+        Changes classes together with class attribute and class index
+    '''
+    def _setClasses(self, classes):
+        assert isinstance(classes, tuple), "HTMLDomNode::_setClasses() - classes must be a tuple"
+        self.__changeClasses(classes)
+        if self.__attrs is None:
+            self.__attrs = {}
+        self.__attrs[self.__document._symbol("class")] = ' '.join(classes)
 
     def _setLeftElementSibling(self, sibl):
         assert isinstance(sibl, HTMLDomElement), "HTMLDomNode::_setLeftElementSibling() - sibl is not HTMLDomElement"
@@ -453,30 +1018,183 @@ class HTMLDomNode:
 
 class HTMLDomElement(HTMLDomNode):
 
+    __slots__ = ()
+
     def __init__(self, document, parent=None, tag="", attrs=None):
         HTMLDomNode.__init__(self, document, parent, tag, attrs)
 
+    '''
+        Tree changes, like in DOM.
+        Inserted node is removed from its old place first. New nodes should be made without parent and inserted here.
+        Removed subtree stays usable(and queryable by traversal), but it is not in the document anymore.
+        Throws ValueError for wrong reference nodes and for inserts which would make a cycle.
+        WARNING: document must not be changed while it is being parsed.
+    '''
     def appendChild(self, child):
-        assert isinstance(child, HTMLDomElement) or isinstance(child, HTMLDomNode), "HTMLDomNode: child must be an instance of HTMLDomElement or HTMLDomNode!"
-        self.childNodes().append(child)
-        if isinstance(child, HTMLDomElement):
-            self.children().append(child)
+        return self._insertBefore(child, None)
 
+    def insertBefore(self, newChild, refChild):
+        return self._insertBefore(newChild, refChild)
+
+    def removeChild(self, child):
+        return self._removeChild(child)
+
+    def replaceChild(self, newChild, oldChild):
+        if newChild is not oldChild:
+            self._insertBefore(newChild, oldChild)
+            self._removeChild(oldChild)
+        return oldChild
 
 
 class HTMLDocument(HTMLDomElement):
 
-    def __init__(self):
-        HTMLDomNode.__init__(self, self, None, "document", None)
+    __slots__ = ('__idStorage', '__tagStorage', '__classStorage', '__queryCache', '__orderCounter', '__symbols',
+                 '__classSets', '__instrumentation', '__frozen', '__weakref__')
+
+    '''
+        queryCacheSize and queryCacheEviction configure cache of query results, see cache.py
+    '''
+    def __init__(self, queryCacheSize=MAX_QUERY_CACHE, queryCacheEviction=QUERY_CACHE_EVICTION["LRU"]):
+        # storages must exist before the document registers itself as a node
         self.__idStorage = IdStorage()
+        self.__tagStorage = OrderedIndex()
+        self.__classStorage = OrderedIndex()
+        self.__queryCache = QueryCache(queryCacheSize, queryCacheEviction)
+        self.__orderCounter = 0
+        # name -> the same name, so that every tag or attribute name is stored once
+        self.__symbols = {}
+        # value of class attribute -> tuple of its classes
+        self.__classSets = {}
+        self.__instrumentation = None
+        self.__frozen = False
+        HTMLDomNode.__init__(self, self, None, "document", None)
+
+    '''
+        Returns new list of 'nodes' of this document sorted in document order, e.g. to merge results of several queries
+    '''
+    def sortInDocumentOrder(self, nodes):
+        return sorted(nodes, key=lambda node: node._order())
 
     def getElementById(self, id):
         if not(id in self.__idStorage):
             return None
         return self.__idStorage[id]
 
+    '''
+        All elements with id 'id' in document order: ids should be unique, but malformed HTML may repeat them,
+        and getElementById() returns only the first of such elements
+    '''
+    def getAllElementsById(self, id):
+        return self.__idStorage.holders(id)
+
     def getIdStorage(self):
         return self.__idStorage
 
+    def getClassStorage(self):
+        return self.__classStorage
+
+    def getInstrumentation(self):
+        return self.__instrumentation
+
+    '''
+        Results of queries made while document is still being built(e.g. from callbacks) are not reused:
+        appended nodes do not invalidate the cache, so it is invalidated before every such query instead
+    '''
+    def getQueryCache(self):
+        if not self._isClosed() and not self.__frozen:
+            self.__queryCache.invalidate()
+        return self.__queryCache
+
+    def getTagStorage(self):
+        return self.__tagStorage
+
+    '''
+        Makes document read-only, so that it may be queried from many threads at once without locks.
+        Indexes and nodes are never changed after that, query cache reads take no lock(see QueryCache.freeze()).
+        Any change of a frozen document(attributes, classList() and child lists) throws RuntimeError.
+        Iterators(lazy iter* queries, HTMLDomIterator) keep their own traversal state, every thread must make its own.
+    '''
+    def freeze(self):
+        self.__frozen = True
+        self.__queryCache.freeze()
+
+    def isFrozen(self):
+        return self.__frozen
+
+    '''
+        Starts collecting query timings and index updates time to 'instrumentation'(see instrument.py).
+        Index updates of parsing and of later changes of the tree are both counted.
+    '''
+    def _instrument(self, instrumentation):
+        self.__instrumentation = instrumentation
+        instrumentation.addDocument(self)
+        for storage in (self.__idStorage, self.__tagStorage, self.__classStorage):
+            for name in ("add", "insert", "discard", "reorder"):
+                method = getattr(storage, name, None)
+                if method is not None:
+                    setattr(storage, name, instrumentation.timed("index", method))
+
+    '''
+        Symbol table: returns the one stored copy of 'name'.
+        Names are also interned process-wide, so they are identical to names in compiled selectors
+        and comparisons with them stop at identity check.
+    '''
+    def _symbol(self, name):
+        symbol = self.__symbols.get(name)
+        if symbol is None:
+            symbol = sys.intern(name)
+            self.__symbols[symbol] = symbol
+        return symbol
+
+    '''
+        Returns tuple of classes from value of class attribute: split by spaces, without duplicates.
+        Equal values get the same tuple(flyweight), it is never changed.
+    '''
+    def _classSet(self, classesStr):
+        classes = self.__classSets.get(classesStr)
+        if classes is None:
+            # spliting by spaces, removing extra spaces, duplicates are dropped like in a set
+            classes = tuple(dict.fromkeys(self._symbol(item) for item in classesStr.split(' ') if item != ''))
+            self.__classSets[classesStr] = classes
+        return classes
+
+    '''
+        Called before every change of the tree: throws RuntimeError for frozen document, makes cached results stale
+    '''
+    def _beforeMutation(self):
+        if self.__frozen:
+            raise RuntimeError("HTMLDocument - document is frozen and can not be changed")
+        self.__queryCache.invalidate()
+
+    '''
+        Every node gets next document order position when it is created(and element once more when it is closed)
+    '''
+    def _nextOrder(self):
+        order = self.__orderCounter
+        self.__orderCounter += ORDER_GAP
+        return order
+
+    def _currentOrder(self):
+        return self.__orderCounter - ORDER_GAP
+
+    '''
+        Fresh positions after all given ones, for subtrees numbered again from scratch
+    '''
+    def _reserveOrders(self, count):
+        first = self.__orderCounter
+        self.__orderCounter += count * ORDER_GAP
+        return range(first, self.__orderCounter, ORDER_GAP)
+
+    '''
+        Tag and class indexes are built again after the whole document got new positions
+    '''
+    def _reindex(self):
+        self.__tagStorage.clear()
+        self.__classStorage.clear()
+        for node in HTMLDomIterator(self):
+            self.__tagStorage.add(node.tagName(), node)
+            for item in node._classes():
+                self.__classStorage.add(item, node)
+
 
 
@@ -0,0 +1,492 @@
+import bisect
+from array import array
+
+from parser import *
+
+'''
+    Flat DOM storage for big documents.
+    Tree is kept in parallel arrays of integers indexed by node position in document order(node 0 is the document),
+    attributes and texts are kept in one shared table. FlatNode objects are only lightweight views(document, index),
+    created when user code touches a node, so memory per node is a few dozens of bytes instead of several hundreds.
+    Views have the same read API as HTMLDomNode, so selectors work on them too.
+    WARNING: flat documents are read-only.
+'''
+
+# tag id of text nodes
+TEXT_TAG = 0
+
+
+'''
+    Arrays of the tree, -1 stands for "no node".
+    Attributes of node i are attrKeys/attrValues[attrStarts[i]:attrStarts[i + 1]], text of text node is its only value(key is None).
+'''
+class FlatStorage:
+
+    __slots__ = ('parents', 'firstChildren', 'lastChildren', 'nextSiblings', 'previousSiblings', 'tags', 'attrStarts',
+                 'lastOrders', 'attrKeys', 'attrValues', 'tagNames', 'tagIds', 'keyNames', 'tagIndex', 'classIndex',
+                 'idIndex', 'idDuplicates')
+
+    def __init__(self):
+        self.parents = array('i')
+        self.firstChildren = array('i')
+        self.lastChildren = array('i')
+        self.nextSiblings = array('i')
+        self.previousSiblings = array('i')
+        # tag id of node, see tagNames
+        self.tags = array('i')
+        self.attrStarts = array('i')
+        # position of the last descendant, -1 while subtree is not closed
+        self.lastOrders = array('i')
+        self.attrKeys = []
+        self.attrValues = []
+        # tag id -> tag name and back
+        self.tagNames = [""]
+        self.tagIds = {"": TEXT_TAG}
+        # attribute keys are repeated a lot, so one string is kept for every key
+        self.keyNames = {}
+        # tag id -> positions of elements with this tag
+        self.tagIndex = [array('i')]
+        # class name -> positions of elements with this class
+        self.classIndex = {}
+        # id -> position of the first element with this id
+        self.idIndex = {}
+        # id -> positions of all elements with this id, only for ids which are not unique
+        self.idDuplicates = {}
+
+    def __len__(self):
+        return len(self.tags)
+
+    '''
+        Appends element as the last child of 'parent', returns its position.
+        'classes' are put to class index instead of classes from class attribute, if passed.
+    '''
+    def addElement(self, parent, tag, attrs, classes=None):
+        tagId = self.tagIds.get(tag)
+        if tagId is None:
+            tagId = len(self.tagNames)
+            self.tagNames.append(tag)
+            self.tagIds[tag] = tagId
+            self.tagIndex.append(array('i'))
+        index = self.__addNode(parent, tagId, -1)
+        self.tagIndex[tagId].append(index)
+        for key, value in attrs:
+            name = self.keyNames.setdefault(key, key)
+            self.attrKeys.append(name)
+            self.attrValues.append(value)
+            if name == "class" and value and classes is None:
+                classes = [classname for classname in dict.fromkeys(value.split(' ')) if classname != '']
+            elif name == "id" and value:
+                first = self.idIndex.setdefault(value, index)
+                if first != index:
+                    Logger.warning("FlatStorage::addElement() - malformed HTML, id {0} is not unique".format(value))
+                    self.idDuplicates.setdefault(value, array('i', [first])).append(index)
+        for classname in classes or ():
+            self.classIndex.setdefault(classname, array('i')).append(index)
+        return index
+
+    def addText(self, parent, text):
+        index = self.__addNode(parent, TEXT_TAG, len(self.tags))
+        self.attrKeys.append(None)
+        self.attrValues.append(text)
+        return index
+
+    '''
+        Marks end of subtree: all nodes added since 'index' are its descendants
+    '''
+    def close(self, index):
+        self.lastOrders[index] = len(self.tags) - 1
+
+    def attrEnd(self, index):
+        return self.attrStarts[index + 1] if index + 1 < len(self.attrStarts) else len(self.attrKeys)
+
+    def lastOrder(self, index):
+        last = self.lastOrders[index]
+        return last if last != -1 else len(self.tags) - 1
+
+    def __addNode(self, parent, tagId, lastOrder):
+        index = len(self.tags)
+        self.parents.append(parent)
+        self.firstChildren.append(-1)
+        self.lastChildren.append(-1)
+        self.nextSiblings.append(-1)
+        self.tags.append(tagId)
+        self.attrStarts.append(len(self.attrKeys))
+        self.lastOrders.append(lastOrder)
+        if parent == -1:
+            self.previousSiblings.append(-1)
+            return index
+        previous = self.lastChildren[parent]
+        self.previousSiblings.append(previous)
+        if previous == -1:
+            self.firstChildren[parent] = index
+        else:
+            self.nextSiblings[previous] = index
+        self.lastChildren[parent] = index
+        return index
+
+
+'''
+    View of one node of FlatDocument. Views are equal if they show the same node.
+'''
+class FlatNode:
+
+    __slots__ = ('__document', '__storage', '__index')
+
+    def __init__(self, document, index):
+        self.__document = document
+        self.__storage = document._storage()
+        self.__index = index
+
+    def __eq__(self, other):
+        return isinstance(other, FlatNode) and other.__index == self.__index and other.__document is self.__document
+
+    def __hash__(self):
+        return hash((id(self.__document), self.__index))
+
+    def __repr__(self):
+        return "FlatNode({0}, {1!r})".format(self.__index, self.tagName())
+
+    def childNodes(self):
+        return self.__collect(self.__storage.firstChildren[self.__index], False)
+
+    def children(self):
+        return self.__collect(self.__storage.firstChildren[self.__index], True)
+
+    '''
+        WARNING: class list is a copy, changing it does not change the document
+    '''
+    def classList(self):
+        classes = self.getAttribute("class")
+        return ClassList(dict.fromkeys(item for item in classes.split(' ') if item != '') if classes else ())
+
+    '''
+        Position of 'other' relatively to this node, see HTMLDomNode.compareDocumentPosition()
+    '''
+    def compareDocumentPosition(self, other):
+        assert isinstance(other, FlatNode), "FlatNode::compareDocumentPosition() - other must be a FlatNode"
+        if other.__document is not self.__document:
+            return DOCUMENT_POSITION["DISCONNECTED"]
+        if other.__index == self.__index:
+            return 0
+        if self.contains(other):
+            return DOCUMENT_POSITION["CONTAINED_BY"] | DOCUMENT_POSITION["FOLLOWING"]
+        if other.contains(self):
+            return DOCUMENT_POSITION["CONTAINS"] | DOCUMENT_POSITION["PRECEDING"]
+        return DOCUMENT_POSITION["FOLLOWING"] if other.__index > self.__index else DOCUMENT_POSITION["PRECEDING"]
+
+    def contains(self, other):
+        if other is None or other.__document is not self.__document:
+            return False
+        return self.__index <= other.__index <= self._lastOrder()
+
+    def document(self):
+        return self.__document
+
+    def firstChild(self):
+        return self.__document._node(self.__storage.firstChildren[self.__index])
+
+    def firstElementChild(self):
+        return self.__document._node(self.__elementRight(self.__storage.firstChildren[self.__index]))
+
+    '''
+        WARNING! If 'name' is not a key in attrs, returns None
+    '''
+    def getAttribute(self, name):
+        assert isinstance(name, str), "FlatNode::getAttribute() - name must be a string"
+        storage = self.__storage
+        keys = storage.attrKeys
+        for i in range(storage.attrStarts[self.__index], storage.attrEnd(self.__index)):
+            if keys[i] == name:
+                return storage.attrValues[i]
+        return None
+
+    '''
+        Subtree is a range of the class index, found with binary search
+    '''
+    def getElementsByClassName(self, className):
+        assert isinstance(className, str), "FlatNode::getElementsByClassName() - name must be a string"
+        return self.__cachedRange("class", className, self.__storage.classIndex.get(className))
+
+    def getElementsByTagName(self, tagName):
+        assert isinstance(tagName, str), "FlatNode::getElementsByTagName() - name must be a string"
+        storage = self.__storage
+        tagId = storage.tagIds.get(tagName)
+        return self.__cachedRange("tag", tagName, storage.tagIndex[tagId] if tagId else None)
+
+    '''
+        Lazy variants of getElementsBy*(), see HTMLDomNode
+    '''
+    def iterElementsByClassName(self, className):
+        assert isinstance(className, str), "FlatNode::iterElementsByClassName() - name must be a string"
+        return self.__iterRange(self.__storage.classIndex.get(className))
+
+    def iterElementsByTagName(self, tagName):
+        assert isinstance(tagName, str), "FlatNode::iterElementsByTagName() - name must be a string"
+        storage = self.__storage
+        tagId = storage.tagIds.get(tagName)
+        return self.__iterRange(storage.tagIndex[tagId] if tagId else None)
+
+    def iterQuerySelectorAll(self, selectors):
+        instrumentation = self.__document.getInstrumentation()
+        if instrumentation is None:
+            return compileSelector(selectors).iterSelect(self)
+        return instrumentation.timeLazyQuery(selectors, compileSelector(selectors).iterSelect(self))
+
+    def hasAttribute(self, name):
+        assert isinstance(name, str), "FlatNode::hasAttribute() - name must be a string"
+        storage = self.__storage
+        return name in storage.attrKeys[storage.attrStarts[self.__index]:storage.attrEnd(self.__index)]
+
+    def lastChild(self):
+        return self.__document._node(self.__storage.lastChildren[self.__index])
+
+    def lastElementChild(self):
+        return self.__document._node(self.__elementLeft(self.__storage.lastChildren[self.__index]))
+
+    def nextSibling(self):
+        return self.__document._node(self.__storage.nextSiblings[self.__index])
+
+    def nextElementSibling(self):
+        return self.__document._node(self.__elementRight(self.__storage.nextSiblings[self.__index]))
+
+    def parentNode(self):
+        return self.__document._node(self.__storage.parents[self.__index])
+
+    '''
+        returns parent ELEMENT, not Node; document is not an element
+    '''
+    def parentElement(self):
+        parent = self.__storage.parents[self.__index]
+        return self.__document._node(parent) if parent > 0 else None
+
+    def previousSibling(self):
+        return self.__document._node(self.__storage.previousSiblings[self.__index])
+
+    def previousElementSibling(self):
+        return self.__document._node(self.__elementLeft(self.__storage.previousSiblings[self.__index]))
+
+    def querySelector(self, selectors):
+        res = self.__document.getQueryCache().get((self.__index, "selector", selectors))
+        if res is not None:
+            return res[0] if len(res) > 0 else None
+        instrumentation = self.__document.getInstrumentation()
+        if instrumentation is None:
+            return next(compileSelector(selectors).iterSelect(self), None)
+        return instrumentation.timeFirstQuery(selectors, lambda: next(compileSelector(selectors).iterSelect(self), None))
+
+    '''
+        Results are kept in query cache of the document, returned list must not be changed
+    '''
+    def querySelectorAll(self, selectors):
+        cache = self.__document.getQueryCache()
+        key = (self.__index, "selector", selectors)
+        res = cache.get(key)
+        if res is not None:
+            return res
+        instrumentation = self.__document.getInstrumentation()
+        if instrumentation is None:
+            res = compileSelector(selectors).selectAll(self)
+        else:
+            res = instrumentation.timeQuery(selectors, lambda: compileSelector(selectors).selectAll(self))
+        cache.put(key, res)
+        return res
+
+    def tagName(self):
+        return self.__storage.tagNames[self.__storage.tags[self.__index]]
+
+    def text(self):
+        storage = self.__storage
+        if storage.tags[self.__index] != TEXT_TAG:
+            return ""
+        return storage.attrValues[storage.attrStarts[self.__index]]
+
+    '''
+        Text of this node and all its descendants joined in document order.
+        Subtree is a range of positions, so texts are just picked from it.
+        'separator' is put between texts, see HTMLDomNode.textContent().
+    '''
+    def textContent(self, separator=''):
+        storage = self.__storage
+        tags, starts, values = storage.tags, storage.attrStarts, storage.attrValues
+        texts = (values[starts[i]] for i in range(self.__index, self._lastOrder() + 1) if tags[i] == TEXT_TAG)
+        return separator.join([text for text in texts if text])
+
+    '''
+        Attributes dict(a new one), None if node has no attributes
+    '''
+    def _attrs(self):
+        storage = self.__storage
+        if storage.tags[self.__index] == TEXT_TAG:
+            return None
+        start, end = storage.attrStarts[self.__index], storage.attrEnd(self.__index)
+        if start == end:
+            return None
+        return dict(zip(storage.attrKeys[start:end], storage.attrValues[start:end]))
+
+    def _hasClass(self, classname):
+        classes = self.getAttribute("class")
+        return classes is not None and classname in classes.split(' ')
+
+    def _index(self):
+        return self.__index
+
+    def _order(self):
+        return self.__index
+
+    def _lastOrder(self):
+        return self.__storage.lastOrder(self.__index)
+
+    def __iterRange(self, positions):
+        if positions is None:
+            return
+        node = self.__document._node
+        for i in range(bisect.bisect_left(positions, self.__index), bisect.bisect_right(positions, self._lastOrder())):
+            yield node(positions[i])
+
+    def __cachedRange(self, kind, name, positions):
+        cache = self.__document.getQueryCache()
+        key = (self.__index, kind, name)
+        res = cache.get(key)
+        if res is not None:
+            return res
+        if positions is None:
+            res = []
+        else:
+            first = bisect.bisect_left(positions, self.__index)
+            last = bisect.bisect_right(positions, self._lastOrder(), first)
+            node = self.__document._node
+            res = [node(i) for i in positions[first:last]]
+        cache.put(key, res)
+        return res
+
+    '''
+        Nodes from 'index' to the right through sibling links, only elements if 'elements' is True
+    '''
+    def __collect(self, index, elements):
+        storage = self.__storage
+        nextSiblings, tags = storage.nextSiblings, storage.tags
+        node = self.__document._node
+        res = []
+        while index != -1:
+            if not elements or tags[index] != TEXT_TAG:
+                res.append(node(index))
+            index = nextSiblings[index]
+        return res
+
+    def __elementRight(self, index):
+        tags, nextSiblings = self.__storage.tags, self.__storage.nextSiblings
+        while index != -1 and tags[index] == TEXT_TAG:
+            index = nextSiblings[index]
+        return index
+
+    def __elementLeft(self, index):
+        tags, previousSiblings = self.__storage.tags, self.__storage.previousSiblings
+        while index != -1 and tags[index] == TEXT_TAG:
+            index = previousSiblings[index]
+        return index
+
+
+'''
+    Document stored in FlatStorage, it is the view of node 0 itself
+'''
+class FlatDocument(FlatNode):
+
+    __slots__ = ('__flatStorage', '__queryCache', '__instrumentation', '__weakref__')
+
+    '''
+        'storage' is a ready FlatStorage(e.g. loaded from snapshot), empty document is created without it
+    '''
+    def __init__(self, queryCacheSize=MAX_QUERY_CACHE, queryCacheEviction=QUERY_CACHE_EVICTION["LRU"], storage=None):
+        self.__flatStorage = storage
+        if storage is None:
+            self.__flatStorage = FlatStorage()
+            self.__flatStorage.addElement(-1, "document", [])
+        self.__queryCache = QueryCache(queryCacheSize, queryCacheEviction)
+        self.__instrumentation = None
+        FlatNode.__init__(self, self, 0)
+
+    def __len__(self):
+        return len(self.__flatStorage)
+
+    def getElementById(self, id):
+        index = self.__flatStorage.idIndex.get(id)
+        return None if index is None else self._node(index)
+
+    '''
+        All elements with id 'id' in document order, see HTMLDocument.getAllElementsById()
+    '''
+    def getAllElementsById(self, id):
+        positions = self.__flatStorage.idDuplicates.get(id)
+        if positions is None:
+            node = self.getElementById(id)
+            return [] if node is None else [node]
+        return [self._node(index) for index in positions]
+
+    def getInstrumentation(self):
+        return self.__instrumentation
+
+    def getQueryCache(self):
+        return self.__queryCache
+
+    '''
+        Flat documents are never changed, so only the query cache is switched to lock-free reads(see HTMLDocument.freeze())
+    '''
+    def freeze(self):
+        self.__queryCache.freeze()
+
+    def isFrozen(self):
+        return self.__queryCache.isFrozen()
+
+    def sortInDocumentOrder(self, nodes):
+        return sorted(nodes, key=lambda node: node._index())
+
+    '''
+        View of node at 'index', None for -1
+    '''
+    def _node(self, index):
+        if index <= 0:
+            return self if index == 0 else None
+        return FlatNode(self, index)
+
+    def _storage(self):
+        return self.__flatStorage
+
+    '''
+        Index updates are a part of building here, only queries are timed
+    '''
+    def _instrument(self, instrumentation):
+        self.__instrumentation = instrumentation
+        instrumentation.addDocument(self)
+
+
+'''
+    HTMLDomParser building FlatDocument instead of HTMLDocument.
+    Modes and arguments are the same, stack keeps positions of open elements.
+'''
+class FlatDomParser(HTMLDomParser):
+
+    def getDocument(self):
+        return self.__document
+
+    def _makeDocument(self, document):
+        if document is None:
+            document = FlatDocument()
+        assert isinstance(document, FlatDocument) and len(document) == 1, \
+               "FlatDomParser: document must be an empty FlatDocument"
+        self.__document = document
+        self.__storage = document._storage()
+        return 0
+
+    def _openElement(self, tag, attrs):
+        self.stack.append(self.__storage.addElement(self.stack[-1], tag, attrs))
+
+    def _closeElement(self):
+        self.__storage.close(self.stack.pop())
+
+    def _appendText(self, text):
+        self.__storage.addText(self.stack[-1], text)
+
+    def _closeAll(self):
+        for index in self.stack:
+            self.__storage.close(index)
+        del self.stack[1:]
@@ -0,0 +1,148 @@
+import time
+import weakref
+
+from selector import compileSelector
+
+'''
+    Opt-in instrumentation of parsing and queries.
+    Pass Instrumentation to the parser: timed wrappers are installed only into that parser and its document,
+    so parsers and documents without it pay nothing but a None check per query.
+'''
+
+'''
+    Parse phases. Timers are inclusive: build includes index, tokenize is feed time without build.
+'''
+PHASES = ("decode", "tokenize", "build", "index")
+
+COMBINATOR_NAMES = {
+    ' ': "descendant",
+    '>': "child",
+    '+': "adjacent",
+    '~': "sibling",
+}
+
+
+class Instrumentation:
+
+    '''
+        'hook(event, data)' is called after every parse("parse" event) and every evaluated query("query" event)
+    '''
+    def __init__(self, hook=None):
+        assert hook is None or callable(hook), "Instrumentation::__init__() - hook must be callable"
+        self.__hook = hook
+        # documents, whose query caches are reported
+        self.__documents = weakref.WeakSet()
+        self.reset()
+
+    def reset(self):
+        # phase -> seconds
+        self.__phases = dict.fromkeys(PHASES, 0.0)
+        self.__counters = {"parses": 0, "elements": 0, "texts": 0, "chars": 0, "bytes": 0}
+        # selector string -> [count, seconds]
+        self.__selectors = {}
+        # combinator name -> [count, seconds]
+        self.__combinators = {}
+
+    def addTime(self, phase, seconds):
+        self.__phases[phase] += seconds
+
+    def phaseTime(self, phase):
+        return self.__phases[phase]
+
+    def addCount(self, name, count=1):
+        self.__counters[name] += count
+
+    def addDocument(self, document):
+        self.__documents.add(document)
+
+    '''
+        Wraps 'method' so that its time is added to 'phase' and its calls are counted in 'counter'(if passed)
+    '''
+    def timed(self, phase, method, counter=None):
+        instrumentation = self
+        clock = time.perf_counter
+
+        def wrapper(*args):
+            start = clock()
+            try:
+                return method(*args)
+            finally:
+                instrumentation.__phases[phase] += clock() - start
+                if counter is not None:
+                    instrumentation.__counters[counter] += 1
+        return wrapper
+
+    '''
+        Runs query 'run' for 'selectors' and records its time, 'run' returns list of matches
+    '''
+    def timeQuery(self, selectors, run):
+        start = time.perf_counter()
+        res = run()
+        self.__addQuery(selectors, time.perf_counter() - start, len(res))
+        return res
+
+    '''
+        The same for queries of the first match, 'run' returns match or None
+    '''
+    def timeFirstQuery(self, selectors, run):
+        start = time.perf_counter()
+        res = run()
+        self.__addQuery(selectors, time.perf_counter() - start, 0 if res is None else 1)
+        return res
+
+    '''
+        Lazy queries do their work while matches are consumed: time of every step is summed up
+        and recorded when iteration ends(or iterator is dropped)
+    '''
+    def timeLazyQuery(self, selectors, iterator):
+        clock = time.perf_counter
+        seconds = 0.0
+        count = 0
+        try:
+            while True:
+                start = clock()
+                node = next(iterator, None)
+                seconds += clock() - start
+                if node is None:
+                    return
+                count += 1
+                yield node
+        finally:
+            self.__addQuery(selectors, seconds, count)
+
+    '''
+        Time of selector is added to every combinator it has("none" for selectors without combinators)
+    '''
+    def __addQuery(self, selectors, seconds, results):
+        entry = self.__selectors.setdefault(selectors, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        combinators = {combinator for selector in compileSelector(selectors).selectors for combinator in selector.combinators}
+        for name in [COMBINATOR_NAMES[combinator] for combinator in combinators] or ["none"]:
+            entry = self.__combinators.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        self.emit("query", {"selector": selectors, "seconds": seconds, "results": results})
+
+    def emit(self, event, data):
+        if self.__hook is not None:
+            self.__hook(event, data)
+
+    '''
+        All collected data as plain dicts, ready to be sent to metrics
+    '''
+    def stats(self):
+        caches = {"hits": 0, "misses": 0, "evictions": 0}
+        for document in list(self.__documents):
+            cacheStats = document.getQueryCache().stats()
+            for name in caches:
+                caches[name] += cacheStats[name]
+        selectorCache = compileSelector.cache_info()
+        return {
+            "phases": dict(self.__phases),
+            "counters": dict(self.__counters),
+            "selectors": {key: {"count": count, "seconds": seconds} for key, (count, seconds) in self.__selectors.items()},
+            "combinators": {key: {"count": count, "seconds": seconds} for key, (count, seconds) in self.__combinators.items()},
+            "queryCache": caches,
+            "selectorCache": {"hits": selectorCache.hits, "misses": selectorCache.misses, "size": selectorCache.currsize},
+        }
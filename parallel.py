@@ -0,0 +1,40 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from selector import compileSelector
+
+'''
+    Queries of one document from many threads.
+    Freeze the document first(HTMLDocument.freeze()): queries only read the tree, indexes and compiled selectors,
+    and cache of a frozen document needs no locks for reads. Selector cache(compileSelector) is thread-safe itself.
+    With the GIL threads give concurrency, not speed: matching is pure Python. On free-threaded builds of CPython
+    querySelectorAllParallel() uses all cores.
+'''
+
+# candidates are split into this many chunks per worker, so that uneven chunks do not leave workers idle
+CHUNKS_PER_WORKER = 4
+# smaller candidate lists are matched in the calling thread
+MIN_CHUNK = 256
+
+
+'''
+    Same result as root.querySelectorAll(selectors), but candidates are matched in chunks by threads of 'executor'.
+    'workers' is count of threads(count of cores by default), it sets the number of chunks.
+    Without 'executor' a ThreadPoolExecutor with 'workers' threads is made for this call.
+    Result is not put into query cache.
+'''
+def querySelectorAllParallel(root, selectors, executor=None, workers=None):
+    group = compileSelector(selectors)
+    candidates = list(group.candidates(root))
+    workers = workers or os.cpu_count() or 1
+    size = max(MIN_CHUNK, -(-len(candidates) // (workers * CHUNKS_PER_WORKER)))
+    if len(candidates) <= size:
+        return list(filter(group.matches, candidates))
+    chunks = [candidates[i:i + size] for i in range(0, len(candidates), size)]
+    match = lambda chunk: list(filter(group.matches, chunk))
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(match, chunks))
+    else:
+        parts = list(executor.map(match, chunks))
+    return [node for part in parts for node in part]
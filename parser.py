@@ -1,17 +1,53 @@
-from html.parser import HTMLParser
 import http.client
+import mmap
+import os
+import time
 from collections import namedtuple
 from dom import *
 from connection import *
+from charset import *
+from tokenizer import *
 
 
 PARSER_MODE = {
     "RAW": 0,
-    "URL": 1
+    "URL": 1,
+    "PUSH": 2,
+    "STREAM": 3,
+    "FILE": 4
 }
 
 
-class HTMLDomParser(HTMLParser):
+'''
+    Element, which is not created yet: only what is needed to match selector with ' ' and '>' combinators
+'''
+class PendingElement:
+
+    __slots__ = ('__tag', '__attrs', '__parent')
+
+    def __init__(self, tag, attrs, parent=None):
+        self.__tag = tag
+        self.__attrs = dict(attrs) if attrs else None
+        self.__parent = parent
+
+    def getAttribute(self, name):
+        return None if self.__attrs is None else self.__attrs.get(name)
+
+    def hasAttribute(self, name):
+        return self.__attrs is not None and name in self.__attrs
+
+    def parentElement(self):
+        return self.__parent
+
+    def tagName(self):
+        return self.__tag
+
+    def _hasClass(self, classname):
+        classes = self.getAttribute("class")
+        return classes is not None and classname in classes.split(' ')
+
+
+class HTMLDomParser:
 
     '''
     tags, that are always empty
@@ -33,84 +69,286 @@ class HTMLDomParser(HTMLParser):
         "param",
     ]
 
-    def __init__(self, mode, content, connection=None):
+    '''
+        RAW, URL, STREAM and FILE modes parse the whole content right away:
+        - RAW: content is a string;
+        - URL: content is an url;
+        - STREAM: content is a binary file object, it is read and decoded by chunks;
+        - FILE: content is a path to file, it is mapped to memory and decoded by chunks.
+        PUSH mode only creates an empty document: feed it chunks with feed()(or bytes with feedBytes()) as they arrive
+        and call close() to finalize the tree.
+        'document' is an empty HTMLDocument to build tree in(e.g. with custom query cache settings)
+        'charset' forces charset of bytes input, otherwise it is detected(see charset.py)
+        Selective parsing(skipped parts cost only tokenizer time, no nodes and index entries are created for them):
+        - 'skipTags': elements with these tags are dropped with their subtrees(e.g. script, style, svg);
+        - 'rootSelector': only subtrees of elements matching it are kept, they become children of the document.
+          Only descendant and child combinators are supported, as siblings are not known when element is opened.
+        Comments are never kept. With 'stripWhitespace' whitespaces around texts are stripped and whitespace-only texts
+        are dropped, otherwise texts are kept as they are.
+        'instrumentation' collects timings of parse phases and of queries to the document, see instrument.py
+        'tokenizer' is a tokenizer class from TOKENIZER(see tokenizer.py), the parser is its tree builder.
+    '''
+    def __init__(self, mode, content=None, connection=None, document=None, charset=None, skipTags=None, rootSelector=None,
+                 stripWhitespace=True, instrumentation=None, tokenizer=TOKENIZER["FAST"]):
 
         assert mode in PARSER_MODE.values(), \
                "HTMLDomParser mode invalid"
-        HTMLParser.__init__(self)
-        rawHtml = content if mode == PARSER_MODE["RAW"] else self._fromUrl(content, connection)
+        self.__tokenizer = tokenizer(self)
         # stack[0] is always a document element
-        self.stack = []
-        self.stack.append(HTMLDocument())
-        self.feed(rawHtml)
-        self._siblingify(self.getDocument())
-        self._siblingifyElements(self.getDocument())
+        self.stack = [self._makeDocument(document)]
+        # text may come in several pieces(e.g. split between fed chunks), so it is collected until next tag
+        self.__pendingText = []
+        self.__charset = charset
+        self.__stripWhitespace = stripWhitespace
+        # created on first feedBytes()
+        self.__decoder = None
+        self.__skipTags = frozenset(skipTags) if skipTags else frozenset()
+        # count of open elements in the dropped subtree, 0 if not inside one
+        self.__skipDepth = 0
+        self.__rootSelector = None
+        if rootSelector is not None:
+            self.__rootSelector = compileSelector(rootSelector)
+            if self.__rootSelector.needsSiblings():
+                raise ValueError("HTMLDomParser: rootSelector '{0}' may have only ' ' and '>' combinators".format(rootSelector))
+        # open elements outside of kept subtrees(only with rootSelector)
+        self.__outside = []
+        self.__instrumentation = None
+        if instrumentation is not None:
+            self.__instrument(instrumentation)
+        if mode == PARSER_MODE["RAW"]:
+            self.feed(content)
+            self.close()
+        elif mode == PARSER_MODE["URL"]:
+            self._fromUrl(content, connection)
+            self.close()
+        elif mode == PARSER_MODE["STREAM"]:
+            self.feedStream(content)
+            self.close()
+        elif mode == PARSER_MODE["FILE"]:
+            self._fromFile(content)
+            self.close()
+
+    '''
+        Finalizes parsing: flushes data still buffered by the tokenizer and closes all open elements.
+        Returns the document.
+    '''
+    def close(self):
+        if self.__decoder is not None:
+            self.feed(self.__decoder.finish())
+            self.__decoder = None
+        if self.__instrumentation is None:
+            self.__tokenizer.close()
+        else:
+            self.__tokenize(self.__tokenizer.close)
+        self.__flushText()
+        self._closeAll()
+        if self.__instrumentation is not None:
+            self.__instrumentation.addCount("parses")
+            self.__instrumentation.emit("parse", {"seconds": time.perf_counter() - self.__started})
+        return self.getDocument()
+
+    '''
+        Feeds chunk of text
+    '''
+    def feed(self, data):
+        self.__tokenizer.feed(data)
+
+    '''
+        Feeds chunk of bytes. Charset is detected from BOM, 'contentType' header value or <meta charset>,
+        first bytes are held back until it is known. 'contentType' matters only for the first chunk.
+    '''
+    def feedBytes(self, data, contentType=None):
+        if self.__decoder is None:
+            self.__decoder = ByteStreamDecoder(contentType, self.__charset)
+        text = self.__decoder.decode(data)
+        if text:
+            self.feed(text)
+
+    '''
+        Reads binary file object by chunks and feeds them, does not close the parser
+    '''
+    def feedStream(self, stream, contentType=None, chunkSize=Connection.CHUNK_SIZE):
+        while True:
+            chunk = stream.read(chunkSize)
+            if not chunk:
+                break
+            self.feedBytes(chunk, contentType)
 
     def getDocument(self):
         assert len(self.stack) > 0, "HTMLDomParser: invalid DOM, stack is empty"
         return self.stack[0]
 
+    '''
+        Tree builder: tokenizer callbacks
+    '''
     def handle_starttag(self, tag, attrs):
-        newElem = HTMLDomElement(self.getDocument(), self.stack[-1], tag, attrs)
-        self.stack[-1].appendChild(newElem)
-        self.stack.append(newElem)
+        self.__flushText()
+        if self.__skipStart(tag, attrs):
+            return
+        self._openElement(tag, attrs)
         if(tag in HTMLDomParser.EMPTY_TAGS):
             self.handle_endtag(tag)
 
     def handle_startendtag(self, tag, attrs):
-        self.stack.append(HTMLDomElement(self.getDocument(), self.stack[-1], tag, attrs))
-        self.handle_endtag(tag)
+        self.__flushText()
+        if self.__skipStart(tag, attrs, True):
+            return
+        self._openElement(tag, attrs)
+        self._closeElement()
 
     def handle_endtag(self, tag):
-        self.stack.pop()
+        self.__flushText()
+        if self.__skipDepth != 0:
+            self.__skipDepth -= 1
+        # stray end tags must not pop the document itself
+        elif len(self.stack) > 1:
+            self._closeElement()
+        elif len(self.__outside) != 0:
+            self.__outside.pop()
 
     def handle_data(self, data):
-        # stripping whitespaces, tabulation, new line chars
-        strippedData = data.strip("\n\t ")
+        if self.__skipDepth == 0 and (self.__rootSelector is None or len(self.stack) > 1):
+            self.__pendingText.append(data)
+
+    def handle_comment(self, data):
+        self.__flushText()
+
+    def handle_decl(self, decl):
+        self.__flushText()
+
+    def handle_pi(self, data):
+        self.__flushText()
+
+    '''
+        Installs timed wrappers of feeding and tree building methods into this parser only
+    '''
+    def __instrument(self, instrumentation):
+        self.__instrumentation = instrumentation
+        self.__started = time.perf_counter()
+        # time spent in feed(), to separate decoding time in feedBytes()
+        self.__feedTime = 0.0
+        self._openElement = instrumentation.timed("build", self._openElement, "elements")
+        self._closeElement = instrumentation.timed("build", self._closeElement)
+        self._appendText = instrumentation.timed("build", self._appendText, "texts")
+        feedBytes = self.feedBytes
+
+        def timedFeed(data):
+            start = time.perf_counter()
+            self.__tokenize(self.__tokenizer.feed, data)
+            self.__feedTime += time.perf_counter() - start
+            instrumentation.addCount("chars", len(data))
+
+        def timedFeedBytes(data, contentType=None):
+            start = time.perf_counter()
+            feedTime = self.__feedTime
+            feedBytes(data, contentType)
+            instrumentation.addTime("decode", time.perf_counter() - start - (self.__feedTime - feedTime))
+            instrumentation.addCount("bytes", len(data))
+
+        self.feed = timedFeed
+        self.feedBytes = timedFeedBytes
+        document = self.getDocument()
+        if document is not None:
+            document._instrument(instrumentation)
+
+    '''
+        Runs tokenizer method, its time without tree building goes to tokenize phase
+    '''
+    def __tokenize(self, method, *args):
+        instrumentation = self.__instrumentation
+        build = instrumentation.phaseTime("build")
+        start = time.perf_counter()
+        method(*args)
+        instrumentation.addTime("tokenize", time.perf_counter() - start - (instrumentation.phaseTime("build") - build))
+
+    '''
+        Decides if element is dropped, keeps track of dropped subtrees and of elements outside of kept subtrees.
+        Returns True if element must not be created.
+    '''
+    def __skipStart(self, tag, attrs, selfClosing=False):
+        isEmpty = selfClosing or tag in HTMLDomParser.EMPTY_TAGS
+        if self.__skipDepth != 0 or tag in self.__skipTags:
+            if not isEmpty:
+                self.__skipDepth += 1
+            return True
+        if self.__rootSelector is None or len(self.stack) > 1:
+            return False
+        parent = self.__outside[-1] if len(self.__outside) != 0 else None
+        element = PendingElement(tag, attrs, parent)
+        if self.__rootSelector.matches(element):
+            return False
+        if not isEmpty:
+            self.__outside.append(element)
+        return True
+
+    '''
+        Creates one text node from all the data collected since the last tag
+    '''
+    def __flushText(self):
+        if len(self.__pendingText) == 0:
+            return
+        data = ''.join(self.__pendingText)
+        self.__pendingText.clear()
+        if self.__stripWhitespace:
+            # stripping whitespaces, tabulation, new line chars
+            data = data.strip("\n\t ")
         # nothing to do here
-        if(len(strippedData) == 0):
+        if(len(data) == 0):
             return
-        if(len(self.stack) > 0):
-            self.stack[-1].appendChild(HTMLDomNode(self.getDocument(), parent=self.stack[-1], text=strippedData))
+        self._appendText(data)
+
+    '''
+        Tree building.
+        Tokenizer callbacks above decide what happens, these methods create nodes, subclasses may store them differently.
+    '''
+    def _makeDocument(self, document):
+        if document is None:
+            document = HTMLDocument()
+        assert isinstance(document, HTMLDocument) and len(document.childNodes()) == 0, \
+               "HTMLDomParser: document must be an empty HTMLDocument"
+        return document
+
+    def _openElement(self, tag, attrs):
+        newElem = HTMLDomElement(self.getDocument(), self.stack[-1], tag, attrs)
+        self.stack[-1]._appendChild(newElem)
+        self.stack.append(newElem)
+
+    def _closeElement(self):
+        self.stack.pop()._closeSubtree()
+
+    def _appendText(self, text):
+        self.stack[-1]._appendChild(HTMLDomNode(self.getDocument(), parent=self.stack[-1], text=text))
+
+    def _closeAll(self):
+        # inner elements end first
+        for elem in reversed(self.stack):
+            elem._closeSubtree()
+        del self.stack[1:]
+
+    '''
+        File is mapped to memory, so it is never read into one Python string or bytes object
+    '''
+    def _fromFile(self, path):
+        with open(path, 'rb') as f:
+            # empty file can not be mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start in range(0, len(mapped), Connection.CHUNK_SIZE):
+                    self.feedBytes(mapped[start:start + Connection.CHUNK_SIZE])
 
     '''
         Two modes supported: with alive connection and without it.
-        Connection is instance of HTTPConnection
+        Connection is instance of Connection or ConnectionPool, without it shared ConnectionPool.default() is used.
+        Contents are fed to the parser chunk by chunk, as they are read from the socket.
     '''
     def _fromUrl(self, url, connection=None):
         if connection is None:
-            rawHtml = Connection.getUrlContentsAsUtf8(url)
+            connection = ConnectionPool.default()
+        if isinstance(connection, ConnectionPool):
+            chunks = connection.iterUrlContentsAsUtf8(url)
         else:
             assert isinstance(connection, Connection), 'HTMLDomParser::_fromUrl() - invalid connection passed'
-            rawHtml = connection.getFromConnection(url)
-        return rawHtml
-
-    '''
-        Must be called when tree is completed.
-        Recursively makes double linked lists from one-level siblings.
-    '''
-    def _siblingify(self, startElem):
-        assert isinstance(startElem, HTMLDomNode), "HTMLDomParser::_siblingify() - 'startElem' is not HTMLDomNode"
-        children = startElem.childNodes()
-        for i in range(0, len(children)):
-            if i != 0:
-                children[i]._setLeftSibling(children[i-1])
-            self._siblingify(children[i])
-            if i != (len(children) - 1):
-                children[i]._setRightSibling(children[i+1])
-
-    '''
-            Must be called when tree is completed.
-            Recursively makes double linked lists from one-level siblings.
-            Does siblingification for ELEMENTS only
-        '''
-
-    def _siblingifyElements(self, startElem):
-        assert isinstance(startElem, HTMLDomElement), "HTMLDomParser::_siblingifyElements() - 'startElem' is not HTMLDomElement"
-        children = startElem.children()
-        for i in range(0, len(children)):
-            if i != 0:
-                children[i]._setLeftElementSibling(children[i - 1])
-            self._siblingifyElements(children[i])
-            if i != (len(children) - 1):
-                children[i]._setRightElementSibling(children[i + 1])
\ No newline at end of file
+            chunks = connection.iterFromConnection(url)
+        for chunk in chunks:
+            self.feed(chunk)
@@ -0,0 +1,266 @@
+import re
+import sys
+import functools
+
+'''
+    Compiled CSS selectors.
+    Selector string is parsed once into CssSelectorGroup, which is cached by string.
+    Candidates are tested right-to-left: rightmost compound first, then parent/sibling pointers
+    are walked only as far as needed to satisfy the combinators on the left.
+    Nodes are used only through their public DOM methods(and _hasClass), so anything looking like HTMLDomNode can be matched.
+    Names are interned like names in documents(see HTMLDocument._symbol()), so comparisons mostly end at identity check.
+'''
+
+MAX_SELECTOR_CACHE = 256
+
+CssIdentifierRe = r'-?[_a-zA-Z][_a-zA-Z0-9-]*'
+QuotedRe = r'"[^"]*"|\'[^\']*\''
+# combinators are tried before plain whitespace, so spaces around '>' do not become descendant combinator
+CssTokenRe = re.compile(
+    r'(?P<combinator>\s*[>+~,]\s*)'
+    r'|(?P<space>\s+)'
+    r'|(?P<asterisk>\*)'
+    r'|(?P<tag>' + CssIdentifierRe + r')'
+    r'|\.(?P<class>' + CssIdentifierRe + r')'
+    r'|\#(?P<id>' + CssIdentifierRe + r')'
+    r'|\[\s*(?P<attrKey>' + CssIdentifierRe + r')\s*'
+    r'(?:(?P<attrAction>[~|^$*]?=)\s*(?P<attrVal>' + QuotedRe + r'|' + CssIdentifierRe + r')\s*)?\]'
+)
+
+'''
+    Attribute operators. Attribute must be present and not empty for any of them to match.
+'''
+CssAttrActions = {
+    '=' : lambda attr, val: attr == val,
+    # contains WORD
+    '~=': lambda attr, val: val in attr.split(' '),
+    '|=': lambda attr, val: attr.startswith(val),
+    '^=': lambda attr, val: attr.startswith(val),
+    '$=': lambda attr, val: attr.endswith(val),
+    # contains SUBSTRING
+    '*=': lambda attr, val: val in attr,
+}
+
+
+'''
+    Compound selector: tag(or *), ids, classes and attributes without combinators, like div.nav[title]
+'''
+class CssCompound:
+
+    __slots__ = ('tag', 'id', 'classes', 'attrs')
+
+    def __init__(self):
+        # None means any tag
+        self.tag = None
+        self.id = None
+        self.classes = []
+        # list of tuples (key, action, value), action and value are None for [key]
+        self.attrs = []
+
+    def matches(self, node):
+        if self.tag is not None and node.tagName() != self.tag:
+            return False
+        if self.id is not None and node.getAttribute("id") != self.id:
+            return False
+        for classname in self.classes:
+            if not node._hasClass(classname):
+                return False
+        for key, action, val in self.attrs:
+            if action is None:
+                if not node.hasAttribute(key):
+                    return False
+                continue
+            attr = node.getAttribute(key)
+            if not attr or not CssAttrActions[action](attr, val):
+                return False
+        return True
+
+
+'''
+    Complex selector: compounds joined with combinators(' ', '>', '+', '~').
+    combinators[i] stands between compounds[i] and compounds[i + 1].
+'''
+class CssSelector:
+
+    __slots__ = ('compounds', 'combinators')
+
+    def __init__(self, compounds, combinators):
+        assert len(compounds) == len(combinators) + 1, "CssSelector::__init__() - invalid combinators count"
+        self.compounds = compounds
+        self.combinators = combinators
+
+    def rightmost(self):
+        return self.compounds[-1]
+
+    def matches(self, node):
+        return self.compounds[-1].matches(node) and self.__matchLeft(node, len(self.compounds) - 1)
+
+    '''
+        'node' matched compounds[index], checks everything to the left of it.
+        Recursion depth is limited by count of compounds, tree is walked with loops.
+    '''
+    def __matchLeft(self, node, index):
+        if index == 0:
+            return True
+        combinator = self.combinators[index - 1]
+        compound = self.compounds[index - 1]
+        if combinator == '>':
+            parent = node.parentElement()
+            return parent is not None and compound.matches(parent) and self.__matchLeft(parent, index - 1)
+        if combinator == '+':
+            sibling = node.previousElementSibling()
+            return sibling is not None and compound.matches(sibling) and self.__matchLeft(sibling, index - 1)
+        if combinator == ' ':
+            step = lambda x: x.parentElement()
+        else:
+            step = lambda x: x.previousElementSibling()
+        cur = step(node)
+        while cur is not None:
+            if compound.matches(cur) and self.__matchLeft(cur, index - 1):
+                return True
+            cur = step(cur)
+        return False
+
+
+'''
+    Compiled selector string: one or more complex selectors separated by ','
+'''
+class CssSelectorGroup:
+
+    __slots__ = ('selectors',)
+
+    def __init__(self, selectors):
+        self.selectors = selectors
+
+    def matches(self, node):
+        for selector in self.selectors:
+            if selector.matches(node):
+                return True
+        return False
+
+    '''
+        Only ancestors of element are known while document is parsed, selectors with '+' or '~' need its siblings too
+    '''
+    def needsSiblings(self):
+        return any(combinator in ('+', '~') for selector in self.selectors for combinator in selector.combinators)
+
+    '''
+        Returns all matching elements from the subtree of 'root'(including 'root' itself) in document order
+    '''
+    def selectAll(self, root):
+        if len(self.selectors) == 1:
+            selector = self.selectors[0]
+            return [node for node in _candidates(root, selector.rightmost()) if selector.matches(node)]
+        return list(self.iterSelect(root))
+
+    '''
+        Lazy variant of selectAll(): matches are yielded as they are found, candidates are not cached
+    '''
+    def iterSelect(self, root):
+        if len(self.selectors) == 1:
+            selector = self.selectors[0]
+            return filter(selector.matches, _candidates(root, selector.rightmost(), True))
+        # several groups are matched in one walk, so result has no duplicates and is in document order
+        return filter(self.matches, iterElements(root))
+
+    '''
+        Elements of the subtree of 'root', which may match, in document order: for one selector they are narrowed
+        by its rightmost compound, for several selectors all elements are returned. Only matches() is left to check.
+    '''
+    def candidates(self, root):
+        if len(self.selectors) == 1:
+            return _candidates(root, self.selectors[0].rightmost())
+        return iterElements(root)
+
+
+'''
+    Narrows candidates using rightmost compound: by id, then by tag, then by class.
+    With 'lazy' candidates are iterated right from indexes, otherwise cached lists are used.
+'''
+def _candidates(root, compound, lazy=False):
+    if compound.id is not None:
+        return elementsWithId(root, compound.id)
+    if compound.tag is not None:
+        return root.iterElementsByTagName(compound.tag) if lazy else root.getElementsByTagName(compound.tag)
+    if len(compound.classes) != 0:
+        classname = compound.classes[0]
+        return root.iterElementsByClassName(classname) if lazy else root.getElementsByClassName(classname)
+    return iterElements(root)
+
+
+'''
+    Elements with id 'id' in the subtree of 'root'('root' included) in document order.
+    Ids should be unique, but malformed HTML may repeat them: all such elements are returned, not only the first one.
+    Subtrees out of the document are not in its indexes, so they are walked.
+'''
+def elementsWithId(root, id):
+    document = root.document()
+    if not document.contains(root):
+        return [node for node in iterElements(root) if node.getAttribute("id") == id]
+    return [node for node in document.getAllElementsById(id) if root.contains(node)]
+
+
+'''
+    Elements of the subtree in document order, 'root' included
+'''
+def iterElements(root):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children()))
+
+
+'''
+    Parses selector string into CssSelectorGroup.
+    Results are cached, so repeated queries do not parse the same string again.
+    Throws ValueError for invalid selectors.
+'''
+@functools.lru_cache(MAX_SELECTOR_CACHE)
+def compileSelector(selectors):
+    assert isinstance(selectors, str), "compileSelector() - selectors must be a string"
+    text = selectors.strip()
+    group = []
+    compounds = []
+    combinators = []
+    # None until the first part of compound is met
+    compound = None
+    pos = 0
+    while pos < len(text):
+        m = CssTokenRe.match(text, pos)
+        if m is None:
+            raise ValueError("compileSelector() - invalid Css selector '{0}' at {1}".format(selectors, pos))
+        pos = m.end()
+        kind = m.lastgroup
+        if kind in ('combinator', 'space'):
+            if compound is None:
+                raise ValueError("compileSelector() - invalid Css selector '{0}', combinator without selector".format(selectors))
+            compounds.append(compound)
+            compound = None
+            combinator = ' ' if kind == 'space' else m.group('combinator').strip()
+            if combinator == ',':
+                group.append(CssSelector(compounds, combinators))
+                compounds, combinators = [], []
+            else:
+                combinators.append(combinator)
+            continue
+        if compound is None:
+            compound = CssCompound()
+        elif kind in ('asterisk', 'tag'):
+            raise ValueError("compileSelector() - invalid Css selector '{0}', tag must go first".format(selectors))
+        if kind == 'tag':
+            compound.tag = sys.intern(m.group('tag').lower())
+        elif kind == 'class':
+            compound.classes.append(sys.intern(m.group('class')))
+        elif kind == 'id':
+            compound.id = m.group('id')
+        elif kind != 'asterisk':
+            val = m.group('attrVal')
+            if val is not None and val[0] in '"\'':
+                val = val[1:-1]
+            compound.attrs.append((sys.intern(m.group('attrKey')), m.group('attrAction'), val))
+    if compound is None:
+        raise ValueError("compileSelector() - invalid Css selector '{0}'".format(selectors))
+    compounds.append(compound)
+    group.append(CssSelector(compounds, combinators))
+    return CssSelectorGroup(group)
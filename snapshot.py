@@ -0,0 +1,385 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from collections.abc import Sequence
+
+from flat import *
+
+'''
+    Binary snapshots of parsed documents.
+    Snapshot is FlatStorage written as raw arrays: tree links, attribute table, texts and tag, class and id indexes.
+    Loading maps the file to memory and uses the arrays in place, so nothing is parsed or copied:
+    nodes are FlatNode views, attribute values and texts are decoded only when they are read.
+    Snapshots are made for caches on the same machine, they use native byte order and integer sizes.
+'''
+
+MAGIC = b"HTMLDOM\x02"
+# written in native byte order, snapshot from machine with another order is rejected
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct("=8sIBB")
+SECTION = struct.Struct("=qq")
+ALIGNMENT = 8
+
+'''
+    Sections in order of writing, with array type codes('B' for bytes)
+'''
+SECTIONS = [
+    ("parents", 'i'),
+    ("firstChildren", 'i'),
+    ("lastChildren", 'i'),
+    ("nextSiblings", 'i'),
+    ("previousSiblings", 'i'),
+    ("tags", 'i'),
+    ("attrStarts", 'i'),
+    ("lastOrders", 'i'),
+    # index in keyNames, -1 for texts
+    ("attrKeys", 'i'),
+    ("attrValueOffsets", 'q'),
+    ("attrValues", 'B'),
+    ("tagNameOffsets", 'q'),
+    ("tagNames", 'B'),
+    ("keyNameOffsets", 'q'),
+    ("keyNames", 'B'),
+    ("tagIndexOffsets", 'q'),
+    ("tagIndex", 'i'),
+    ("classNameOffsets", 'q'),
+    ("classNames", 'B'),
+    ("classIndexOffsets", 'q'),
+    ("classIndex", 'i'),
+    ("idNameOffsets", 'q'),
+    ("idNames", 'B'),
+    ("idIndex", 'i'),
+    # all positions of ids which are not unique
+    ("duplicateIdNameOffsets", 'q'),
+    ("duplicateIdNames", 'B'),
+    ("duplicateIdIndexOffsets", 'q'),
+    ("duplicateIdIndex", 'i'),
+]
+
+# sections with one item per node
+NODE_SECTIONS = ("parents", "firstChildren", "lastChildren", "nextSiblings", "previousSiblings", "tags", "attrStarts",
+                 "lastOrders")
+# sections with positions of nodes, -1 is no node
+LINK_SECTIONS = ("parents", "firstChildren", "lastChildren", "nextSiblings", "previousSiblings")
+
+
+'''
+    Strings stored one after another, item i is blob[offsets[i]:offsets[i + 1]].
+    Every string has a leading marker byte, so empty item is None and empty string is just a marker.
+    Items are decoded on access.
+'''
+class StringTable(Sequence):
+
+    def __init__(self, offsets, blob):
+        self.__offsets = offsets
+        self.__blob = blob
+
+    def __len__(self):
+        return len(self.__offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        start, end = self.__offsets[index], self.__offsets[index + 1]
+        if start == end:
+            return None
+        return str(self.__blob[start + 1:end], "utf-8", "surrogatepass")
+
+
+'''
+    Attribute keys as indexes in the list of key names
+'''
+class KeyTable(Sequence):
+
+    def __init__(self, ids, names):
+        self.__ids = ids
+        self.__names = names
+
+    def __len__(self):
+        return len(self.__ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        keyId = self.__ids[index]
+        return None if keyId == -1 else self.__names[keyId]
+
+
+def _packStrings(strings):
+    offsets = array('q', [0])
+    blob = bytearray()
+    for item in strings:
+        if item is not None:
+            blob += b"\x01"
+            blob += item.encode("utf-8", "surrogatepass")
+        offsets.append(len(blob))
+    return offsets, blob
+
+
+'''
+    Lists of positions stored one after another, with offsets of every list
+'''
+def _packLists(lists):
+    offsets = array('q', [0])
+    positions = array('i')
+    for item in lists:
+        positions.extend(item)
+        offsets.append(len(positions))
+    return offsets, positions
+
+
+'''
+    Builds FlatStorage from HTMLDocument, classes are taken from class lists of elements
+'''
+def _flatten(document):
+    storage = FlatStorage()
+    # tuples(node, position of its parent) and positions of elements, whose subtrees end there
+    stack = [(document, -1)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, int):
+            storage.close(item)
+            continue
+        node, parent = item
+        if node.tagName() == "":
+            storage.addText(parent, node.text())
+            continue
+        attrs = node._attrs()
+        index = storage.addElement(parent, node.tagName(), attrs.items() if attrs else (), node._classes())
+        stack.append(index)
+        stack.extend((child, index) for child in reversed(node.childNodes()))
+    return storage
+
+
+'''
+    Serializes HTMLDocument or FlatDocument to bytes
+'''
+def dumpSnapshot(document):
+    if isinstance(document, FlatDocument):
+        storage = document._storage()
+    else:
+        assert isinstance(document, HTMLDocument), "dumpSnapshot() - document must be a HTMLDocument or FlatDocument"
+        storage = _flatten(document)
+    keyNames = list(storage.keyNames)
+    keyIds = {name: i for i, name in enumerate(keyNames)}
+    classNames = list(storage.classIndex)
+    idNames = list(storage.idIndex)
+    duplicateIdNames = list(storage.idDuplicates)
+    sections = {
+        "parents": storage.parents,
+        "firstChildren": storage.firstChildren,
+        "lastChildren": storage.lastChildren,
+        "nextSiblings": storage.nextSiblings,
+        "previousSiblings": storage.previousSiblings,
+        "tags": storage.tags,
+        "attrStarts": storage.attrStarts,
+        "lastOrders": array('i', (storage.lastOrder(i) for i in range(len(storage)))),
+        "attrKeys": array('i', (-1 if key is None else keyIds[key] for key in storage.attrKeys)),
+        "idIndex": array('i', storage.idIndex.values()),
+    }
+    sections["attrValueOffsets"], sections["attrValues"] = _packStrings(storage.attrValues)
+    sections["tagNameOffsets"], sections["tagNames"] = _packStrings(storage.tagNames)
+    sections["keyNameOffsets"], sections["keyNames"] = _packStrings(keyNames)
+    sections["classNameOffsets"], sections["classNames"] = _packStrings(classNames)
+    sections["idNameOffsets"], sections["idNames"] = _packStrings(idNames)
+    sections["tagIndexOffsets"], sections["tagIndex"] = _packLists(storage.tagIndex)
+    sections["classIndexOffsets"], sections["classIndex"] = _packLists(storage.classIndex[name] for name in classNames)
+    sections["duplicateIdNameOffsets"], sections["duplicateIdNames"] = _packStrings(duplicateIdNames)
+    sections["duplicateIdIndexOffsets"], sections["duplicateIdIndex"] = _packLists(storage.idDuplicates[name]
+                                                                                   for name in duplicateIdNames)
+
+    out = bytearray(HEADER.pack(MAGIC, BYTE_ORDER_MARK, array('i').itemsize, array('q').itemsize))
+    tableStart = len(out)
+    out += bytes(SECTION.size * len(SECTIONS))
+    table = []
+    for name, typecode in SECTIONS:
+        data = sections[name]
+        if typecode != 'B':
+            data = array(typecode, data).tobytes()
+        out += bytes(-len(out) % ALIGNMENT)
+        table.append((len(out), len(data)))
+        out += data
+    for i, (offset, length) in enumerate(table):
+        SECTION.pack_into(out, tableStart + i * SECTION.size, offset, length)
+    return bytes(out)
+
+
+'''
+    Writes snapshot to 'path' atomically: readers never see a partly written file
+'''
+def saveSnapshot(document, path):
+    data = dumpSnapshot(document)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmpPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+
+
+'''
+    Checks sizes of sections and that every position in them points into its table,
+    so broken snapshot is rejected on load instead of failing on some later access
+'''
+def _checkSections(sections):
+    def check(name, low, high):
+        values = sections[name]
+        if len(values) and (min(values) < low or max(values) >= high):
+            raise ValueError("loadSnapshotBytes() - section {0} is broken".format(name))
+
+    def checkCount(name, count):
+        if len(sections[name]) != count:
+            raise ValueError("loadSnapshotBytes() - section {0} is broken".format(name))
+
+    count = len(sections["parents"])
+    if count == 0:
+        raise ValueError("loadSnapshotBytes() - snapshot has no document")
+    for name in NODE_SECTIONS:
+        checkCount(name, count)
+    for name in ("attrValue", "tagName", "keyName", "className", "idName", "duplicateIdName"):
+        if len(sections[name + "Offsets"]) == 0:
+            raise ValueError("loadSnapshotBytes() - section {0}Offsets is broken".format(name))
+        check(name + "Offsets", 0, len(sections[name + "s"]) + 1)
+    attrCount = len(sections["attrKeys"])
+    checkCount("attrValueOffsets", attrCount + 1)
+    checkCount("tagIndexOffsets", len(sections["tagNameOffsets"]))
+    checkCount("classIndexOffsets", len(sections["classNameOffsets"]))
+    checkCount("idIndex", len(sections["idNameOffsets"]) - 1)
+    checkCount("duplicateIdIndexOffsets", len(sections["duplicateIdNameOffsets"]))
+    for name in LINK_SECTIONS:
+        check(name, -1, count)
+    check("tags", 0, len(sections["tagNameOffsets"]) - 1)
+    check("attrStarts", 0, attrCount + 1)
+    check("lastOrders", 0, count)
+    check("attrKeys", -1, len(sections["keyNameOffsets"]) - 1)
+    check("tagIndexOffsets", 0, len(sections["tagIndex"]) + 1)
+    check("classIndexOffsets", 0, len(sections["classIndex"]) + 1)
+    check("duplicateIdIndexOffsets", 0, len(sections["duplicateIdIndex"]) + 1)
+    for name in ("tagIndex", "classIndex", "idIndex", "duplicateIdIndex"):
+        check(name, 0, count)
+
+
+'''
+    Makes FlatDocument from snapshot bytes(or any buffer, e.g. mmap), arrays are used in place.
+    Throws ValueError if data is not a valid snapshot.
+'''
+def loadSnapshotBytes(data, queryCacheSize=MAX_QUERY_CACHE, queryCacheEviction=QUERY_CACHE_EVICTION["LRU"]):
+    view = memoryview(data)
+    if len(view) < HEADER.size + SECTION.size * len(SECTIONS):
+        raise ValueError("loadSnapshotBytes() - data is too short")
+    magic, mark, intSize, longSize = HEADER.unpack_from(view)
+    if magic != MAGIC or mark != BYTE_ORDER_MARK or intSize != array('i').itemsize or longSize != array('q').itemsize:
+        raise ValueError("loadSnapshotBytes() - not a snapshot or it is made on incompatible machine")
+    sections = {}
+    for i, (name, typecode) in enumerate(SECTIONS):
+        offset, length = SECTION.unpack_from(view, HEADER.size + i * SECTION.size)
+        if offset < 0 or length < 0 or offset + length > len(view):
+            raise ValueError("loadSnapshotBytes() - truncated snapshot")
+        if length % array(typecode).itemsize != 0:
+            raise ValueError("loadSnapshotBytes() - section {0} is broken".format(name))
+        section = view[offset:offset + length]
+        sections[name] = section if typecode == 'B' else section.cast(typecode)
+    _checkSections(sections)
+
+    def strings(name):
+        return StringTable(sections[name + "Offsets"], sections[name + "s"])
+
+    storage = FlatStorage()
+    for name in NODE_SECTIONS:
+        setattr(storage, name, sections[name])
+    keyNames = list(strings("keyName"))
+    storage.keyNames = {name: name for name in keyNames}
+    storage.attrKeys = KeyTable(sections["attrKeys"], keyNames)
+    storage.attrValues = strings("attrValue")
+    storage.tagNames = list(strings("tagName"))
+    storage.tagIds = {name: i for i, name in enumerate(storage.tagNames)}
+    offsets, positions = sections["tagIndexOffsets"], sections["tagIndex"]
+    storage.tagIndex = [positions[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+    offsets, positions = sections["classIndexOffsets"], sections["classIndex"]
+    storage.classIndex = {name: positions[offsets[i]:offsets[i + 1]] for i, name in enumerate(strings("className"))}
+    storage.idIndex = dict(zip(strings("idName"), sections["idIndex"]))
+    offsets, positions = sections["duplicateIdIndexOffsets"], sections["duplicateIdIndex"]
+    storage.idDuplicates = {name: positions[offsets[i]:offsets[i + 1]]
+                            for i, name in enumerate(strings("duplicateIdName"))}
+    return FlatDocument(queryCacheSize, queryCacheEviction, storage)
+
+
+'''
+    Maps snapshot file to memory and makes FlatDocument from it, see loadSnapshotBytes()
+'''
+def loadSnapshot(path, queryCacheSize=MAX_QUERY_CACHE, queryCacheEviction=QUERY_CACHE_EVICTION["LRU"]):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("loadSnapshot() - empty file")
+        # mapping stays valid after file is closed, it is released with the document
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return loadSnapshotBytes(mapped, queryCacheSize, queryCacheEviction)
+
+
+'''
+    On-disk cache of parsed documents, keyed by sha256 of raw HTML(str or bytes), its kind and content type of bytes.
+    Repeated inputs are loaded from snapshots instead of being parsed.
+    Any number of processes may share one directory: snapshots are written atomically.
+'''
+class SnapshotCache:
+
+    SUFFIX = ".snapshot"
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.__directory = directory
+        self.__hits = 0
+        self.__misses = 0
+
+    def path(self, content, contentType=None):
+        return os.path.join(self.__directory, self.key(content, contentType) + SnapshotCache.SUFFIX)
+
+    '''
+        str and bytes never share a key: bytes are decoded by their charset(<meta charset> or 'contentType'),
+        so str and its UTF-8 bytes may give different documents.
+        Content type of bytes is a part of the key: the same bytes may be decoded differently with another charset.
+    '''
+    @staticmethod
+    def key(content, contentType=None):
+        if isinstance(content, str):
+            digest = hashlib.sha256(b"s\0")
+            digest.update(content.encode("utf-8", "surrogatepass"))
+            return digest.hexdigest()
+        digest = hashlib.sha256(b"b\0")
+        digest.update(content)
+        if contentType is not None:
+            digest.update(b"\0" + contentType.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    '''
+        Returns FlatDocument of 'content'. Bytes are decoded as in HTMLDomParser.feedBytes()('contentType' is used for that).
+        Broken snapshot is replaced with a new one.
+    '''
+    def parse(self, content, contentType=None):
+        path = self.path(content, contentType)
+        try:
+            document = loadSnapshot(path)
+            self.__hits += 1
+            return document
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            Logger.warning("SnapshotCache::parse() - broken snapshot {0}: {1}".format(path, e))
+        self.__misses += 1
+        if isinstance(content, str):
+            document = FlatDomParser(PARSER_MODE["RAW"], content).getDocument()
+        else:
+            parser = FlatDomParser(PARSER_MODE["PUSH"])
+            parser.feedBytes(content, contentType)
+            document = parser.close()
+        saveSnapshot(document, path)
+        return document
+
+    def stats(self):
+        return {"hits": self.__hits, "misses": self.__misses}
@@ -0,0 +1,78 @@
+from parser import *
+
+'''
+    Streaming parsing with selector callbacks, the document is never built.
+    Every open element is kept only as PendingElement(tag, attributes and parent), which is enough to match selectors
+    with descendant and child combinators. Subtree of matched element is built as usual DOM in a small document of its own,
+    it is passed to callbacks when its end tag is seen and is dropped afterwards.
+    So memory depends on nesting depth and on size of matched subtrees, not on size of the input.
+'''
+
+
+class HTMLStreamParser(HTMLDomParser):
+
+    '''
+        'handlers' are pairs(selector, callback), more may be added with on() before feeding.
+        Callback gets HTMLDomElement with its whole subtree. Elements are delivered in order of their end tags,
+        so matches nested in other matches come before them; elements left open are delivered by close().
+        Modes and other arguments are the same as for HTMLDomParser, close() returns None.
+    '''
+    def __init__(self, mode, content=None, handlers=(), connection=None, charset=None, skipTags=None, stripWhitespace=True,
+                 instrumentation=None, tokenizer=TOKENIZER["FAST"]):
+        # tuples(compiled selector, callback)
+        self.__handlers = []
+        # for every open element: built node(None outside of matched subtrees) and callbacks matched by it
+        self.__nodes = [None]
+        self.__matched = [()]
+        for selector, callback in handlers:
+            self.on(selector, callback)
+        HTMLDomParser.__init__(self, mode, content, connection, None, charset, skipTags, stripWhitespace=stripWhitespace,
+                               instrumentation=instrumentation, tokenizer=tokenizer)
+
+    '''
+        Registers callback for elements matching 'selector'.
+        Throws ValueError for selectors with sibling combinators('+' and '~').
+    '''
+    def on(self, selector, callback):
+        assert callable(callback), "HTMLStreamParser::on() - callback must be callable"
+        group = compileSelector(selector)
+        if group.needsSiblings():
+            raise ValueError("HTMLStreamParser::on() - selector '{0}' may have only ' ' and '>' combinators".format(selector))
+        self.__handlers.append((group, callback))
+        return self
+
+    def _makeDocument(self, document):
+        return None
+
+    def _openElement(self, tag, attrs):
+        parent = self.stack[-1] if len(self.stack) > 1 else None
+        element = PendingElement(tag, attrs, parent)
+        matched = tuple(callback for group, callback in self.__handlers if group.matches(element))
+        parentNode = self.__nodes[-1]
+        if parentNode is None and len(matched) != 0:
+            parentNode = HTMLDocument()
+        node = None
+        if parentNode is not None:
+            node = HTMLDomElement(parentNode.document(), parentNode, tag, attrs)
+            parentNode._appendChild(node)
+        self.stack.append(element)
+        self.__nodes.append(node)
+        self.__matched.append(matched)
+
+    def _closeElement(self):
+        self.stack.pop()
+        node = self.__nodes.pop()
+        matched = self.__matched.pop()
+        if node is not None:
+            node._closeSubtree()
+        for callback in matched:
+            callback(node)
+
+    def _appendText(self, text):
+        parentNode = self.__nodes[-1]
+        if parentNode is not None:
+            parentNode._appendChild(HTMLDomNode(parentNode.document(), parent=parentNode, text=text))
+
+    def _closeAll(self):
+        while len(self.stack) > 1:
+            self._closeElement()
@@ -0,0 +1,97 @@
+from selector import compileSelector, elementsWithId, iterElements
+
+'''
+    Extraction templates: values of many fields are extracted at once, with selectors compiled only once.
+    Every complex selector is put into a bucket by its rightmost compound(id, else tag, else first class, else any),
+    like candidates of a single query(see selector.py). Candidates of every bucket are taken once from indexes
+    and are shared by all selectors in it, equal selectors of different fields are matched once.
+    Selectors without id, tag or class share one walk of the subtree. Results are not put into query cache of the document.
+    Template may be used for any number of documents.
+'''
+
+
+class ExtractionTemplate:
+
+    '''
+        'fields' is a dict {field: selector} or {field: (selector, projection)}, projection is:
+        - None: textContent() of matched elements(the same as plain selector);
+        - string: value of this attribute(None for elements without it);
+        - callable: called with matched element.
+        Throws ValueError for invalid selectors.
+    '''
+    def __init__(self, fields):
+        assert isinstance(fields, dict), "ExtractionTemplate::__init__() - fields must be a dict"
+        self.__fields = dict(fields)
+        # field -> projection
+        self.__projections = {}
+        # buckets: key -> {CssSelector: list of fields}, equal selector strings are compiled to the same objects
+        self.__byId = {}
+        self.__byTag = {}
+        self.__byClass = {}
+        self.__any = {}
+        # fields with several selectors, their matches are sorted and deduplicated
+        self.__merged = []
+        for field, spec in self.__fields.items():
+            selectors, projection = (spec, None) if isinstance(spec, str) else spec
+            assert projection is None or isinstance(projection, str) or callable(projection), \
+                   "ExtractionTemplate::__init__() - invalid projection of field '{0}'".format(field)
+            self.__projections[field] = projection
+            group = compileSelector(selectors)
+            if len(group.selectors) > 1:
+                self.__merged.append(field)
+            for selector in group.selectors:
+                compound = selector.rightmost()
+                if compound.id is not None:
+                    bucket = self.__byId.setdefault(compound.id, {})
+                elif compound.tag is not None:
+                    bucket = self.__byTag.setdefault(compound.tag, {})
+                elif len(compound.classes) != 0:
+                    bucket = self.__byClass.setdefault(compound.classes[0], {})
+                else:
+                    bucket = self.__any
+                bucket.setdefault(selector, []).append(field)
+
+    def fields(self):
+        return list(self.__fields)
+
+    '''
+        Returns dict {field: list of projected values} for elements of the subtree of 'root'('root' included),
+        every list is in document order, the same as root.querySelectorAll(selector) would give.
+    '''
+    def extract(self, root):
+        matches = {field: [] for field in self.__fields}
+        for id, bucket in self.__byId.items():
+            self.__scan(elementsWithId(root, id), bucket, matches)
+        for tag, bucket in self.__byTag.items():
+            self.__scan(root.getElementsByTagName(tag), bucket, matches)
+        for classname, bucket in self.__byClass.items():
+            self.__scan(root.getElementsByClassName(classname), bucket, matches)
+        if len(self.__any) != 0:
+            self.__scan(list(iterElements(root)), self.__any, matches)
+        for field in self.__merged:
+            # matches of a group come from several scans
+            matches[field] = root.document().sortInDocumentOrder(dict.fromkeys(matches[field]))
+        return {field: self.__project(field, nodes) for field, nodes in matches.items()}
+
+    def __scan(self, nodes, bucket, matches):
+        for selector, fields in bucket.items():
+            found = list(filter(selector.matches, nodes))
+            for field in fields:
+                matches[field].extend(found)
+
+    def __project(self, field, nodes):
+        projection = self.__projections[field]
+        if projection is None:
+            return [node.textContent() for node in nodes]
+        if isinstance(projection, str):
+            return [node.getAttribute(projection) for node in nodes]
+        return [projection(node) for node in nodes]
+
+    '''
+        Only fields are pickled, template is compiled again when unpickled(e.g. in worker processes)
+    '''
+    def __getstate__(self):
+        return self.__fields
+
+    def __setstate__(self, fields):
+        self.__init__(fields)
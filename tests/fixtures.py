@@ -0,0 +1,57 @@
+'''
+    Shared test data
+'''
+
+HTML = '''<!DOCTYPE HTML>
+<html>
+
+<head>
+  <meta charset="utf-8">
+  <link href="tree.css" rel="stylesheet">
+  <script src="tree.js"></script>
+</head>
+
+<body>
+
+  <ul class="tree" id="tree">
+    <li class="list animals_list">Animals
+      <ul>
+        <li>Mammals
+          <ul>
+            <li>Cows</li>
+            <li id="donkeys" name="Saru">Donkeys</li>
+            <li name="Wantuz" legs="4">Dogs</li>
+            <li>Tigers</li>
+          </ul>
+        </li>
+        <li>Other
+          <ul class="list   other_list">
+            <li>Snakes</li>
+            <p>I am a neko</p>
+            <li>Birds</li>
+            <li>Lizards</li>
+          </ul>
+        </li>
+      </ul>
+    </li>
+    <li class="list fishes_list">Fishes
+      <ul>
+        <li>Aquarium
+          <ul>
+            <li>Guppy</li>
+            <li>Angelfish</li>
+            <p>I am a wanko</p>
+          </ul>
+        </li>
+        <li>Sea
+          <ul>
+            <li>Sea trout</li>
+          </ul>
+        </li>
+      </ul>
+    </li>
+  </ul>
+
+</body>
+
+</html>'''
@@ -1,60 +1,10 @@
 import unittest
 import time
+import gc
+import weakref
+import random
 from parser import *
-
-HTML = '''<!DOCTYPE HTML>
-<html>
-
-<head>
-  <meta charset="utf-8">
-  <link href="tree.css" rel="stylesheet">
-  <script src="tree.js"></script>
-</head>
-
-<body>
-
-  <ul class="tree" id="tree">
-    <li class="list animals_list">Animals
-      <ul>
-        <li>Mammals
-          <ul>
-            <li>Cows</li>
-            <li id="donkeys" name="Saru">Donkeys</li>
-            <li name="Wantuz" legs="4">Dogs</li>
-            <li>Tigers</li>
-          </ul>
-        </li>
-        <li>Other
-          <ul class="list   other_list">
-            <li>Snakes</li>
-            <p>I am a neko</p>
-            <li>Birds</li>
-            <li>Lizards</li>
-          </ul>
-        </li>
-      </ul>
-    </li>
-    <li class="list fishes_list">Fishes
-      <ul>
-        <li>Aquarium
-          <ul>
-            <li>Guppy</li>
-            <li>Angelfish</li>
-            <p>I am a wanko</p>
-          </ul>
-        </li>
-        <li>Sea
-          <ul>
-            <li>Sea trout</li>
-          </ul>
-        </li>
-      </ul>
-    </li>
-  </ul>
-
-</body>
-
-</html>'''
+from fixtures import HTML
 
 
 class TestHTMLDomParser(unittest.TestCase):
@@ -208,6 +158,34 @@ class TestHTMLDomParser(unittest.TestCase):
         self.assertEqual(len(html.querySelectorAll("li[name='Saru'] ~ li")), 2)
         self.assertEqual(len(html.querySelectorAll("li ~ li[name='Saru']")), 1)
 
+    def testQuerySelectorAllCompiled(self):
+        doc = TestHTMLDomParser.document
+        html = doc.getElementsByTagName("html")[0]
+
+        # compound selectors and combinators without spaces
+        self.assertEqual(len(html.querySelectorAll("li.list")), 2)
+        self.assertEqual(len(html.querySelectorAll("ul.list.other_list")), 1)
+        self.assertEqual(len(html.querySelectorAll("li#donkeys[name='Saru']")), 1)
+        self.assertEqual(len(html.querySelectorAll("li>ul")), 6)
+        self.assertEqual(len(html.querySelectorAll("li[name=Saru]+li")), 1)
+        self.assertEqual(len(html.querySelectorAll("ul#tree > li.list > ul > li")), 4)
+        # descendant combinator must try farther ancestors when the nearest one fails
+        self.assertEqual(len(html.querySelectorAll("li.fishes_list li li")), 3)
+        self.assertEqual(len(html.querySelectorAll("ul.tree ul.other_list p")), 1)
+        self.assertEqual(len(html.querySelectorAll("* > html")), 0)
+
+        # groups come back in document order without duplicates
+        res = html.querySelectorAll("p, #donkeys, li[name]")
+        self.assertEqual([node.tagName() for node in res], ["li", "li", "p", "p"])
+        self.assertEqual(res[0].getAttribute("id"), "donkeys")
+
+        # id selector is limited to the subtree
+        fishes = doc.getElementsByClassName("fishes_list")[0]
+        self.assertEqual(len(fishes.querySelectorAll("#donkeys")), 0)
+
+        for invalid in ("", "li >", "> li", "li,,ul", "li[name", "div*"):
+            self.assertRaises(ValueError, html.querySelectorAll, invalid)
+
     def testQuerySelector(self):
         doc = TestHTMLDomParser.document
         tree = doc.getElementById("tree")
@@ -218,5 +196,577 @@ class TestHTMLDomParser(unittest.TestCase):
         self.assertTrue(html.querySelector("li ~ li"))
         self.assertFalse(html.querySelector("body ~ ul"))
 
+    def testDuplicateIdsInSelectors(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], '<div><p id="x">1</p></div><p id="x">2</p>').getDocument()
+        first, second = doc.getElementsByTagName("p")
+        self.assertEqual(doc.getAllElementsById("x"), [first, second])
+        # one selector and several selectors give the same elements
+        for selector in ["#x", "#x, q", "#x, #x", "p#x"]:
+            self.assertEqual(doc.querySelectorAll(selector), [first, second], selector)
+            self.assertEqual(list(doc.iterQuerySelectorAll(selector)), [first, second], selector)
+        self.assertEqual(second.querySelectorAll("#x"), [second])
+        self.assertIs(second.querySelector("#x"), second)
+        self.assertEqual(doc.firstChild().querySelectorAll("#x"), [first])
+        # subtree out of the document
+        doc.removeChild(second)
+        self.assertEqual(doc.querySelectorAll("#x"), [first])
+        self.assertEqual(second.querySelectorAll("#x"), [second])
+
+class TestHTMLDomParserPush(unittest.TestCase):
+
+    def parseByChunks(self, chunkSize):
+        parser = HTMLDomParser(PARSER_MODE["PUSH"])
+        for i in range(0, len(HTML), chunkSize):
+            parser.feed(HTML[i:i + chunkSize])
+        return parser.close()
+
+    def testSameTreeAsRaw(self):
+        for chunkSize in (1, 7, 64, 4096):
+            doc = self.parseByChunks(chunkSize)
+            self.assertEqual(len(doc.getElementsByTagName("li")), 16)
+            self.assertEqual(len(doc.getElementsByTagName("ul")), 7)
+            self.assertEqual(len(doc.getElementsByClassName("list")), 3)
+            donkeys = doc.getElementById("donkeys")
+            self.assertEqual(donkeys.firstChild().text(), "Donkeys")
+            self.assertEqual(donkeys.nextElementSibling().firstChild().text(), "Dogs")
+            self.assertEqual(donkeys.previousSibling().firstChild().text(), "Cows")
+
+    def testSiblingsLinkedWhileParsing(self):
+        parser = HTMLDomParser(PARSER_MODE["PUSH"])
+        parser.feed("<ul><li>One</li><li>Two</li>")
+        doc = parser.getDocument()
+        first = doc.getElementsByTagName("li")[0]
+        self.assertEqual(first.nextElementSibling().firstChild().text(), "Two")
+        parser.feed("<li>Three</li></ul>")
+        parser.close()
+        self.assertEqual(first.nextElementSibling().nextElementSibling().firstChild().text(), "Three")
+        self.assertIsNone(first.previousSibling())
+
+    def testCloseFlushesTrailingText(self):
+        parser = HTMLDomParser(PARSER_MODE["PUSH"])
+        parser.feed("<p>unclosed text")
+        doc = parser.close()
+        self.assertEqual(doc.getElementsByTagName("p")[0].firstChild().text(), "unclosed text")
+
+    def testSelfClosingTagsAreAppended(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<div><img src='a.png'/><br/><span>x</span></div>").getDocument()
+        div = doc.getElementsByTagName("div")[0]
+        self.assertEqual([child.tagName() for child in div.children()], ["img", "br", "span"])
+        self.assertEqual(div.lastElementChild().previousElementSibling().tagName(), "br")
+
+
+class TestHTMLDomParserDeepTree(unittest.TestCase):
+
+    DEPTH = 10000
+
+    def testDeepTreeParses(self):
+        html = '<div>' * TestHTMLDomParserDeepTree.DEPTH + 'bottom' + '</div>' * TestHTMLDomParserDeepTree.DEPTH
+        doc = HTMLDomParser(PARSER_MODE["RAW"], html).getDocument()
+        divs = doc.getElementsByTagName("div")
+        self.assertEqual(len(divs), TestHTMLDomParserDeepTree.DEPTH)
+        self.assertEqual(divs[-1].firstChild().text(), "bottom")
+        self.assertIs(divs[-1].parentNode(), divs[-2])
+
+    def testDeepSiblingsLinked(self):
+        html = '<div><p>a</p><p>b</p>' * 3000 + '</div>' * 3000
+        doc = HTMLDomParser(PARSER_MODE["RAW"], html).getDocument()
+        deepest = doc.getElementsByTagName("div")[-1]
+        self.assertEqual(deepest.firstElementChild().nextElementSibling().firstChild().text(), "b")
+        self.assertIsNone(deepest.lastElementChild().nextElementSibling())
+
+
+class TestHTMLDomNodeLayout(unittest.TestCase):
+
+    def testNoInstanceDict(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<p class='a'>text</p>").getDocument()
+        p = doc.firstElementChild()
+        for node in (doc, p, p.firstChild()):
+            self.assertFalse(hasattr(node, '__dict__'))
+
+    def testEmptyContainers(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<div><br>text</div>").getDocument()
+        br = doc.getElementsByTagName("br")[0]
+        text = br.nextSibling()
+        for node in (br, text):
+            self.assertEqual(node.childNodes(), [])
+            self.assertEqual(node.children(), [])
+            self.assertIsNone(node.firstChild())
+            self.assertIsNone(node.lastElementChild())
+            self.assertIsNone(node.getAttribute("id"))
+            self.assertFalse(node.hasAttribute("id"))
+        self.assertFalse(br.classList().contains("a"))
+        br.classList().add("a")
+        self.assertEqual(doc.getElementsByClassName("a"), [br])
+        br.setAttribute("title", "line")
+        self.assertEqual(br.getAttribute("title"), "line")
+
+    def testClassList(self):
+        classList = ClassList(["a", "b"])
+        classList.add("a").add("c").remove("b")
+        self.assertTrue(classList.contains("a"))
+        self.assertTrue(classList.contains("c"))
+        self.assertFalse(classList.contains("b"))
+        classList.toggle("a")
+        self.assertFalse(classList.contains("a"))
+        self.assertRaises(KeyError, classList.remove, "b")
+
+    def testNamesInterned(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<p data-x='1'>1</p><p data-x='2'>2</p>").getDocument()
+        first, second = doc.getElementsByTagName("p")
+        self.assertIs(first.tagName(), second.tagName())
+        self.assertIs(list(first._attrs())[0], list(second._attrs())[0])
+
+    def testClassSetsShared(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<ul><li class='a  b'>1</li><li class='a  b'>2</li></ul>").getDocument()
+        first, second = doc.getElementsByTagName("li")
+        self.assertIs(first._classes(), second._classes())
+        self.assertEqual(first._classes(), ("a", "b"))
+        # copy on write: the other element keeps shared classes
+        first.classList().toggle("c")
+        self.assertEqual(first._classes(), ("a", "b", "c"))
+        self.assertEqual(second._classes(), ("a", "b"))
+        second.classList().remove("a")
+        self.assertEqual(second._classes(), ("b",))
+        self.assertEqual(doc.getElementsByClassName("a"), [first])
+        self.assertEqual(doc.getElementsByClassName("b"), [first, second])
+
+
+class TestHTMLDocumentIndexes(unittest.TestCase):
+
+    def testSubtreeRanges(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        fishes = doc.getElementsByClassName("fishes_list")[0]
+        self.assertEqual([li.firstChild().text() for li in fishes.getElementsByTagName("li")],
+                         ["Fishes", "Aquarium", "Guppy", "Angelfish", "Sea", "Sea trout"])
+        self.assertEqual(len(fishes.getElementsByClassName("list")), 1)
+        self.assertEqual(fishes.firstChild().getElementsByTagName("li"), [])
+        self.assertEqual(len(doc.getTagStorage()["li"]), 16)
+        self.assertEqual(len(doc.getClassStorage()["list"]), 3)
+
+    def testQueriesWhileParsing(self):
+        parser = HTMLDomParser(PARSER_MODE["PUSH"])
+        parser.feed("<div class='a'><p>1</p><div class='a'><p>2</p>")
+        doc = parser.getDocument()
+        outer = doc.getElementsByTagName("div")[0]
+        self.assertEqual(len(outer.getElementsByTagName("p")), 2)
+        parser.feed("</div></div><p class='a'>3</p>")
+        parser.close()
+        self.assertEqual(len(outer.getElementsByTagName("p")), 2)
+        self.assertEqual(len(doc.getElementsByTagName("p")), 3)
+        self.assertEqual(len(doc.getElementsByClassName("a")), 3)
+
+    def testClassListChangesIndex(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<ul><li class='x'>1</li><li>2</li><li class='x'>3</li></ul>").getDocument()
+        lis = doc.getElementsByTagName("li")
+        lis[1].classList().add("x")
+        lis[0].classList().remove("x")
+        self.assertEqual(doc.getClassStorage()["x"], [lis[1], lis[2]])
+
+    def testAppendChildUpdatesIndexes(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<ul><li>1</li></ul><p>2</p>").getDocument()
+        ul = doc.getElementsByTagName("ul")[0]
+        ul.appendChild(HTMLDomElement(doc, ul, "li", [("class", "new")]))
+        self.assertEqual(len(ul.getElementsByTagName("li")), 2)
+        self.assertEqual(len(doc.getElementsByClassName("new")), 1)
+        self.assertEqual(len(doc.getElementsByTagName("p")), 1)
+
+
+class TestDocumentPosition(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        self.tree = self.doc.getElementById("tree")
+        self.donkeys = self.doc.getElementById("donkeys")
+        self.fishes = self.doc.getElementsByClassName("fishes_list")[0]
+
+    def checkPositions(self):
+        self.assertTrue(self.tree.contains(self.donkeys))
+        self.assertTrue(self.donkeys.contains(self.donkeys))
+        self.assertTrue(self.donkeys.contains(self.donkeys.firstChild()))
+        self.assertFalse(self.donkeys.contains(self.tree))
+        self.assertFalse(self.fishes.contains(self.donkeys))
+        self.assertEqual(self.donkeys.compareDocumentPosition(self.donkeys), 0)
+        self.assertEqual(self.tree.compareDocumentPosition(self.donkeys),
+                         DOCUMENT_POSITION["CONTAINED_BY"] | DOCUMENT_POSITION["FOLLOWING"])
+        self.assertEqual(self.donkeys.compareDocumentPosition(self.tree),
+                         DOCUMENT_POSITION["CONTAINS"] | DOCUMENT_POSITION["PRECEDING"])
+        self.assertEqual(self.donkeys.compareDocumentPosition(self.fishes), DOCUMENT_POSITION["FOLLOWING"])
+        self.assertEqual(self.fishes.compareDocumentPosition(self.donkeys), DOCUMENT_POSITION["PRECEDING"])
+        other = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        self.assertEqual(self.tree.compareDocumentPosition(other.getElementById("tree")), DOCUMENT_POSITION["DISCONNECTED"])
+        self.assertFalse(self.tree.contains(other.getElementById("donkeys")))
+        lis = self.doc.getElementsByTagName("li")
+        self.assertEqual(self.doc.sortInDocumentOrder(list(reversed(lis))), lis)
+
+    def testOrderedDocument(self):
+        self.checkPositions()
+
+    def testChangedDocument(self):
+        ul = self.fishes.firstElementChild()
+        newLi = HTMLDomElement(self.doc, ul, "li")
+        ul.appendChild(newLi)
+        self.checkPositions()
+        self.assertTrue(self.fishes.contains(newLi))
+        self.assertEqual(self.donkeys.compareDocumentPosition(newLi), DOCUMENT_POSITION["FOLLOWING"])
+        self.assertEqual(newLi.compareDocumentPosition(ul.children()[1]), DOCUMENT_POSITION["PRECEDING"])
+        self.assertEqual(ul.children()[1].compareDocumentPosition(newLi), DOCUMENT_POSITION["FOLLOWING"])
+
+
+class TestMutations(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        self.tree = self.doc.getElementById("tree")
+        self.donkeys = self.doc.getElementById("donkeys")
+
+    '''
+        Indexes, positions and links must be the same as for a document parsed with this tree
+    '''
+    def checkConsistent(self, doc):
+        nodes = []
+        stack = [doc]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(reversed(node.childNodes()))
+        elements = [node for node in nodes if isinstance(node, HTMLDomElement)]
+        self.assertEqual([node._order() for node in nodes], sorted(node._order() for node in nodes))
+        for node in nodes:
+            childNodes, children = node.childNodes(), node.children()
+            self.assertEqual(children, [child for child in childNodes if isinstance(child, HTMLDomElement)])
+            for i, child in enumerate(childNodes):
+                self.assertIs(child.parentNode(), node)
+                self.assertIs(child.previousSibling(), childNodes[i - 1] if i > 0 else None)
+                self.assertIs(child.nextSibling(), childNodes[i + 1] if i + 1 < len(childNodes) else None)
+                self.assertTrue(node.contains(child))
+                self.assertLess(child._lastOrder(), node._lastOrder())
+            for i, child in enumerate(children):
+                self.assertIs(child.previousElementSibling(), children[i - 1] if i > 0 else None)
+                self.assertIs(child.nextElementSibling(), children[i + 1] if i + 1 < len(children) else None)
+        for tag in {node.tagName() for node in elements}:
+            self.assertEqual(doc.getElementsByTagName(tag), [node for node in elements if node.tagName() == tag])
+        classes = {item for node in elements for item in node._classes()}
+        self.assertEqual({key for key in doc.getClassStorage() if doc.getClassStorage()[key]}, classes)
+        for item in classes:
+            self.assertEqual(doc.getElementsByClassName(item), [node for node in elements if node._hasClass(item)])
+        holders = {}
+        for node in reversed(elements):
+            if node.getAttribute("id"):
+                # the first element takes id which is not unique
+                holders[node.getAttribute("id")] = node
+        for id, node in holders.items():
+            self.assertIs(doc.getElementById(id), node)
+        self.assertEqual(set(doc.getIdStorage()), {node.getAttribute("id") for node in elements if node.getAttribute("id")})
+
+    def testInsertBefore(self):
+        li = HTMLDomElement(self.doc, None, "li", [("class", "new"), ("id", "new")])
+        li.appendChild(HTMLDomNode(self.doc, text="Cats"))
+        self.assertIs(self.donkeys.parentNode().insertBefore(li, self.donkeys), li)
+        self.assertIs(li.nextElementSibling(), self.donkeys)
+        self.assertIs(self.donkeys.previousElementSibling(), li)
+        self.assertIs(self.doc.getElementById("new"), li)
+        self.assertEqual(self.doc.getElementsByClassName("new"), [li])
+        self.assertEqual(self.donkeys.compareDocumentPosition(li), DOCUMENT_POSITION["PRECEDING"])
+        self.assertTrue(self.tree.contains(li))
+        self.assertEqual(self.doc.querySelectorAll("#tree li.new + li"), [self.donkeys])
+        self.checkConsistent(self.doc)
+
+    def testRemoveChild(self):
+        parent = self.donkeys.parentNode()
+        self.assertIs(parent.removeChild(self.donkeys), self.donkeys)
+        self.assertIsNone(self.donkeys.parentNode())
+        self.assertIsNone(self.doc.getElementById("donkeys"))
+        self.assertFalse(self.doc.contains(self.donkeys))
+        self.assertNotIn(self.donkeys, self.doc.getElementsByTagName("li"))
+        self.assertEqual(self.doc.compareDocumentPosition(self.donkeys), DOCUMENT_POSITION["DISCONNECTED"])
+        # removed subtree is still usable
+        self.assertTrue(self.donkeys.contains(self.donkeys.firstChild()))
+        self.assertEqual(self.donkeys.getElementsByTagName("li"), [self.donkeys])
+        self.assertRaises(ValueError, parent.removeChild, self.donkeys)
+        self.checkConsistent(self.doc)
+
+    def testReplaceAndMove(self):
+        fishes = self.doc.getElementsByClassName("fishes_list")[0]
+        p = HTMLDomElement(self.doc, None, "p", [("class", "replacement")])
+        self.assertIs(fishes.parentNode().replaceChild(p, fishes), fishes)
+        self.assertEqual(self.doc.getElementsByClassName("fishes_list"), [])
+        self.assertEqual(self.doc.getElementsByClassName("replacement"), [p])
+        # moving node removes it from the old place
+        self.doc.getElementsByTagName("body")[0].appendChild(self.donkeys)
+        self.assertIs(self.doc.getElementsByTagName("body")[0].lastElementChild(), self.donkeys)
+        self.assertEqual(self.doc.querySelectorAll("body > li"), [self.donkeys])
+        self.checkConsistent(self.doc)
+
+    def testInvalidChanges(self):
+        self.assertRaises(ValueError, self.donkeys.appendChild, self.tree)
+        self.assertRaises(ValueError, self.tree.insertBefore, HTMLDomElement(self.doc, None, "li"), self.donkeys)
+        other = HTMLDomParser(PARSER_MODE["RAW"], "<p>1</p>").getDocument()
+        self.assertRaises(ValueError, self.tree.appendChild, other.firstChild())
+        self.checkConsistent(self.doc)
+
+    def testAttributes(self):
+        self.donkeys.setAttribute("class", "list pets")
+        self.assertTrue(self.donkeys.classList().contains("pets"))
+        self.assertIn(self.donkeys, self.doc.getElementsByClassName("pets"))
+        self.donkeys.setAttribute("id", "pets")
+        self.assertIsNone(self.doc.getElementById("donkeys"))
+        self.assertIs(self.doc.getElementById("pets"), self.donkeys)
+        self.donkeys.classList().remove("pets")
+        self.assertEqual(self.donkeys.getAttribute("class"), "list")
+        self.donkeys.removeAttribute("id")
+        self.donkeys.removeAttribute("class")
+        self.assertFalse(self.donkeys.hasAttribute("class"))
+        self.assertIsNone(self.doc.getElementById("pets"))
+        self.assertNotIn(self.donkeys, self.doc.getElementsByClassName("list"))
+        self.checkConsistent(self.doc)
+
+    def testDuplicateIds(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<div id='a'>1</div><p id='a'>2</p>").getDocument()
+        div, p = doc.getElementsByTagName("div")[0], doc.getElementsByTagName("p")[0]
+        self.assertIs(doc.getElementById("a"), div)
+        doc.removeChild(div)
+        self.assertIs(doc.getElementById("a"), p)
+        doc.insertBefore(div, p)
+        self.assertIs(doc.getElementById("a"), div)
+        self.checkConsistent(doc)
+        doc.removeChild(p)
+        self.assertIs(doc.getElementById("a"), div)
+        self.checkConsistent(doc)
+
+    def testDuplicateIdChanged(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<div id='a'>1</div><p id='b'>2</p>").getDocument()
+        div, p = doc.getElementsByTagName("div")[0], doc.getElementsByTagName("p")[0]
+        p.setAttribute("id", "a")
+        self.assertIs(doc.getElementById("a"), div)
+        p.setAttribute("id", "b")
+        self.assertIs(doc.getElementById("a"), div)
+        self.assertIs(doc.getElementById("b"), p)
+        div.setAttribute("id", "b")
+        self.assertIs(doc.getElementById("b"), div)
+        div.removeAttribute("id")
+        self.assertIsNone(doc.getElementById("a"))
+        self.assertIs(doc.getElementById("b"), p)
+        self.checkConsistent(doc)
+
+    def testGapsUsedUp(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<div>" + "<p>x</p>" * 500 + "</div><ul><li>a</li><li>b</li></ul>").getDocument()
+        ul = doc.getElementsByTagName("ul")[0]
+        last = ul.lastChild()
+        # every insert before the same node halves free positions there, then the whole document is renumbered
+        for i in range(40):
+            ul.insertBefore(HTMLDomElement(doc, None, "li", [("class", "n{0}".format(i % 3))]), last)
+        self.checkConsistent(doc)
+        self.assertEqual(len(ul.getElementsByClassName("n0")), 14)
+        # free room was left in this list, so it is renumbered without the rest of the document
+        first = ul.firstChild()
+        for i in range(40):
+            ul.insertBefore(HTMLDomElement(doc, None, "li", [("class", "m")]), first)
+        self.checkConsistent(doc)
+        self.assertEqual(ul.children()[40], first)
+
+    def testRandomChanges(self):
+        rnd = random.Random(24)
+        for _ in range(300):
+            elements = list(HTMLDomIterator(self.doc))
+            parent = rnd.choice(elements)
+            action = rnd.random()
+            if action < 0.4 or len(elements) < 20:
+                node = HTMLDomElement(self.doc, None, rnd.choice(["p", "li", "div"]), [("class", rnd.choice(["a", "b"]))])
+                node.appendChild(HTMLDomNode(self.doc, text="t"))
+                parent.insertBefore(node, rnd.choice(parent.childNodes() + [None]))
+            elif action < 0.7:
+                child = rnd.choice(elements[1:])
+                child.parentNode().removeChild(child)
+            else:
+                child = rnd.choice(elements[1:])
+                if not child.contains(parent):
+                    parent.insertBefore(child, rnd.choice(parent.childNodes() + [None]))
+        self.checkConsistent(self.doc)
+
+
+class TestLazyQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+
+    def testSameResultsAsLists(self):
+        for selector in ["li", "ul > li", "li ~ li", ".list", "#donkeys", "p, ul.list", "*", "[legs]"]:
+            self.assertEqual(list(self.doc.iterQuerySelectorAll(selector)), self.doc.querySelectorAll(selector), selector)
+        fishes = self.doc.getElementsByClassName("fishes_list")[0]
+        self.assertEqual(list(fishes.iterElementsByTagName("li")), fishes.getElementsByTagName("li"))
+        self.assertEqual(list(self.doc.iterElementsByClassName("list")), self.doc.getElementsByClassName("list"))
+        self.assertEqual(list(self.doc.iterElementsByTagName("nosuchtag")), [])
+
+    def testEarlyTermination(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<ul>" + "<li><a href='/x'>x</a></li>" * 1000 + "</ul>").getDocument()
+        matches = doc.iterQuerySelectorAll("li > a[href]")
+        first = next(matches)
+        self.assertIs(first, doc.getElementsByTagName("a")[0])
+        self.assertIs(doc.querySelector("li > a[href]"), first)
+        self.assertIsNone(doc.querySelector("form[action]"))
+        # nothing was collected for these queries
+        self.assertEqual(len(doc.getQueryCache()), 1)
+
+    def testChangedDocument(self):
+        ul = self.doc.getElementById("tree")
+        ul.appendChild(HTMLDomElement(self.doc, ul, "li", [("class", "new")]))
+        self.assertEqual(len(list(ul.iterElementsByTagName("li"))), 17)
+        self.assertEqual(len(list(self.doc.iterElementsByClassName("new"))), 1)
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def testHitsAndMisses(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        first = doc.querySelectorAll("li ~ li")
+        self.assertIs(doc.querySelectorAll("li ~ li"), first)
+        stats = doc.getQueryCache().stats()
+        self.assertGreaterEqual(stats["hits"], 1)
+        self.assertGreaterEqual(stats["misses"], 1)
+
+    def testMutationsInvalidate(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        self.assertEqual(len(doc.querySelectorAll("li[legs]")), 1)
+        doc.getElementById("donkeys").setAttribute("legs", "4")
+        self.assertEqual(len(doc.querySelectorAll("li[legs]")), 2)
+        ul = doc.getElementById("tree")
+        self.assertEqual(len(ul.getElementsByTagName("p")), 2)
+        ul.appendChild(HTMLDomElement(doc, ul, "p"))
+        self.assertEqual(len(ul.getElementsByTagName("p")), 3)
+
+    def testQueriesWhileParsing(self):
+        parser = HTMLDomParser(PARSER_MODE["PUSH"])
+        parser.feed("<ul><li>1</li>")
+        doc = parser.getDocument()
+        self.assertEqual(len(doc.getElementsByTagName("li")), 1)
+        # appended nodes do not invalidate the cache, results of unfinished document are not reused instead
+        parser.feed("<li>2</li>")
+        self.assertEqual(len(doc.getElementsByTagName("li")), 2)
+        parser.feed("<li>3</li></ul>")
+        parser.close()
+        self.assertEqual(len(doc.getElementsByTagName("li")), 3)
+        self.assertIs(doc.getElementsByTagName("li"), doc.getElementsByTagName("li"))
+
+    def testEviction(self):
+        cache = QueryCache(2, QUERY_CACHE_EVICTION["LRU"])
+        cache.put("a", [1])
+        cache.put("b", [2])
+        cache.get("a")
+        cache.put("c", [3])
+        self.assertEqual(cache.get("a"), [1])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        cache = QueryCache(2, QUERY_CACHE_EVICTION["FIFO"])
+        cache.put("a", [1])
+        cache.put("b", [2])
+        cache.get("a")
+        cache.put("c", [3])
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), [2])
+
+        cache = QueryCache(0)
+        cache.put("a", [1])
+        self.assertIsNone(cache.get("a"))
+
+    def testDocumentsHaveOwnCaches(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML, document=HTMLDocument(queryCacheSize=4)).getDocument()
+        other = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        doc.querySelectorAll("li")
+        self.assertEqual(len(doc.getQueryCache()), 2)
+        self.assertEqual(len(other.getQueryCache()), 0)
+        self.assertEqual(doc.getQueryCache().stats()["maxSize"], 4)
+
+    def testDocumentIsReleased(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        doc.querySelectorAll("li ul")
+        doc.getElementsByClassName("list")
+        ref = weakref.ref(doc)
+        del doc
+        gc.collect()
+        self.assertIsNone(ref())
+
+
+class TestSelectiveParsing(unittest.TestCase):
+
+    PAGE = """<html><head><script>var a = "<div class='x'>";</script><style>p { color: red }</style></head>
+<body><div class="ad"><p>buy</p><img src="ad.png"><br/></div>
+<div id="main"><p class="x">one</p><svg><g><path d="M0"/></g></svg><p class="x">two</p></div>
+<div class="card"><p class="x">three</p><div class="card"><p>four</p></div></div></body></html>"""
+
+    def testSkipTags(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], self.PAGE, skipTags=["script", "style", "svg"]).getDocument()
+        for tag in ("script", "style", "svg", "path", "g"):
+            self.assertEqual(doc.getElementsByTagName(tag), [])
+            self.assertNotIn(tag, doc.getTagStorage())
+        self.assertEqual([p.firstChild().text() for p in doc.getElementsByClassName("x")], ["one", "two", "three"])
+        main = doc.getElementById("main")
+        self.assertEqual(main.children()[0].nextElementSibling().firstChild().text(), "two")
+        self.assertEqual(len(doc.getElementsByTagName("head")[0].childNodes()), 0)
+
+    def testSkipTagsWithVoidElements(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], self.PAGE, skipTags=["img", "br", "div"]).getDocument()
+        self.assertEqual(doc.getElementsByTagName("p"), [])
+        self.assertEqual(len(doc.getElementsByTagName("script")), 1)
+        self.assertEqual(doc.getElementsByTagName("body")[0].childNodes(), [])
+
+    def testRootSelector(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], self.PAGE, rootSelector="body > div.card, #main").getDocument()
+        self.assertEqual([elem.getAttribute("id") or elem.getAttribute("class") for elem in doc.children()], ["main", "card"])
+        self.assertEqual([p.firstChild().text() for p in doc.getElementsByTagName("p")], ["one", "two", "three", "four"])
+        self.assertIsNone(doc.getElementById("main").parentElement())
+        self.assertEqual(doc.getElementsByClassName("ad"), [])
+        self.assertEqual(len(doc.getElementsByClassName("card")), 2)
+
+    def testRootSelectorWithSkipTags(self):
+        parser = HTMLDomParser(PARSER_MODE["PUSH"], rootSelector="div p.x", skipTags=["svg"])
+        for i in range(0, len(self.PAGE), 5):
+            parser.feed(self.PAGE[i:i + 5])
+        doc = parser.close()
+        self.assertEqual([p.firstChild().text() for p in doc.children()], ["one", "two", "three"])
+        self.assertEqual(doc.getElementsByTagName("path"), [])
+
+    def testRootSelectorWithSiblingCombinator(self):
+        self.assertRaises(ValueError, HTMLDomParser, PARSER_MODE["PUSH"], rootSelector="p + p")
+
+
+class TestTextContent(unittest.TestCase):
+
+    def testTextContent(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        self.assertEqual(doc.getElementById("donkeys").textContent(), "Donkeys")
+        self.assertEqual(doc.getElementsByClassName("fishes_list")[0].textContent(),
+                         "FishesAquariumGuppyAngelfishI am a wankoSeaSea trout")
+        self.assertEqual(doc.getElementById("donkeys").firstChild().textContent(), "Donkeys")
+        self.assertEqual(doc.getElementsByTagName("meta")[0].textContent(), "")
+
+    def testTextIsCoalesced(self):
+        parser = HTMLDomParser(PARSER_MODE["PUSH"])
+        html = "<p>fish &amp; chips &lt;3 &#x41;nd more</p>"
+        for char in html:
+            parser.feed(char)
+        p = parser.close().firstChild()
+        self.assertEqual(len(p.childNodes()), 1)
+        self.assertEqual(p.firstChild().text(), "fish & chips <3 And more")
+
+    def testWhitespaceKept(self):
+        html = "<ul>\n  <li> one </li>\n  <li>two <b>three</b></li>\n</ul>"
+        doc = HTMLDomParser(PARSER_MODE["RAW"], html, stripWhitespace=False).getDocument()
+        ul = doc.firstChild()
+        self.assertEqual(len(ul.childNodes()), 5)
+        self.assertEqual(ul.textContent(), "\n   one \n  two three\n")
+        stripped = HTMLDomParser(PARSER_MODE["RAW"], html).getDocument().firstChild()
+        self.assertEqual(len(stripped.childNodes()), 2)
+        self.assertEqual(stripped.textContent(), "onetwothree")
+
+    def testSeparator(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], "<ul><li>one</li><li>two <b>three</b></li></ul>").getDocument()
+        ul = doc.firstChild()
+        # texts are stripped by default, so they run together without separator
+        self.assertEqual(ul.textContent(), "onetwothree")
+        self.assertEqual(ul.textContent(" "), "one two three")
+        self.assertEqual(ul.firstChild().textContent(separator=" "), "one")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import asyncio
+from parser import *
+from asyncfetch import *
+from test_connection import LocalServer, CODINGS
+
+
+def collect(urls, **kwargs):
+    async def run():
+        return [result async for result in fetchAndParseMany(urls, **kwargs)]
+    return asyncio.run(run())
+
+
+class TestAsyncFetch(unittest.TestCase):
+
+    def testFetchMany(self):
+        with LocalServer() as server:
+            urls = [server.url("/page?n={0}".format(i)) for i in range(20)]
+            results = collect(urls, concurrency=4)
+            self.assertEqual(sorted(result.url for result in results), sorted(urls))
+            for result in results:
+                self.assertIsNone(result.error)
+                self.assertEqual(len(result.document.getElementsByTagName("li")), 3)
+                self.assertEqual(result.document.getElementById("list").lastElementChild().firstChild().text(), "Три")
+            # keep-alive connections are reused, so there are no more of them than concurrent requests
+            self.assertLessEqual(len(server.server.connections), 4)
+
+    def testConcurrencyLimit(self):
+        with LocalServer() as server:
+            results = collect([server.url("/slow") for _ in range(12)], concurrency=3)
+            self.assertEqual(len(results), 12)
+            self.assertLessEqual(server.server.maxActive, 3)
+            self.assertGreaterEqual(server.server.maxActive, 2)
+
+    def testErrorsAndRedirects(self):
+        with LocalServer() as server:
+            results = {result.url: result for result in collect([server.url("/missing"), server.url("/redirect")])}
+            self.assertIsInstance(results[server.url("/missing")].error, AsyncFetchError)
+            self.assertIsNone(results[server.url("/missing")].document)
+            self.assertEqual(len(results[server.url("/redirect")].document.getElementsByTagName("li")), 3)
+
+    def testNotFollowedRedirects(self):
+        with LocalServer() as server:
+            urls = [server.url("/notmodified"), server.url("/nolocation")]
+            for result in collect(urls, timeout=5):
+                self.assertIsInstance(result.error, AsyncFetchError)
+                self.assertIsNone(result.document)
+
+    def testTimeout(self):
+        with LocalServer() as server:
+            results = collect([server.url("/slow")], timeout=0.001)
+            self.assertIsInstance(results[0].error, asyncio.TimeoutError)
+
+    def testResponsesWithoutBody(self):
+        with LocalServer() as server:
+            urls = [server.url("/nocontent"), server.url("/early"), server.url("/page")]
+            results = {result.url: result for result in collect(urls, concurrency=1, timeout=5)}
+            self.assertIsNone(results[urls[0]].error)
+            self.assertEqual(results[urls[0]].document.getElementsByTagName("li"), [])
+            # interim 103 response is skipped
+            self.assertIsNone(results[urls[1]].error)
+            self.assertEqual(len(results[urls[1]].document.getElementsByTagName("li")), 3)
+            # connection is reused after response without body
+            self.assertEqual(len(server.server.connections), 1)
+
+    def testStoppedEarly(self):
+        async def run(urls):
+            results = fetchAndParseMany(urls, concurrency=4)
+            async for result in results:
+                break
+            await results.aclose()
+            return result, asyncio.all_tasks()
+
+        with LocalServer() as server:
+            result, tasks = asyncio.run(run([server.url("/page")] + [server.url("/slow") for _ in range(8)]))
+            self.assertIsNone(result.error)
+            # no worker is left pending
+            self.assertEqual(len(tasks), 1)
+
+    def testCompressed(self):
+        with LocalServer() as server:
+            results = collect([server.url("/compressed/" + coding) for coding in CODINGS])
+            for result in results:
+                self.assertIsNone(result.error)
+                self.assertEqual(len(result.document.getElementsByTagName("li")), 3000)
+            self.assertEqual(len(server.server.acceptEncodings), len(CODINGS))
+
+
+if __name__ == '__main__':
+    unittest.main()
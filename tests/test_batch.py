@@ -0,0 +1,55 @@
+import unittest
+import pickle
+import tempfile
+import pathlib
+from parser import *
+from batch import *
+from fixtures import HTML
+
+
+def countLinks(document):
+    return len(document.getElementsByTagName("li"))
+
+
+class TestParseMany(unittest.TestCase):
+
+    def testCompactDocumentRoundTrip(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        compact = pickle.loads(pickle.dumps(CompactDocument.fromDocument(doc)))
+        rebuilt = compact.toDocument()
+        self.assertEqual(len(rebuilt.getElementsByTagName("li")), 16)
+        self.assertEqual(len(rebuilt.querySelectorAll("li ~ li")), 9)
+        self.assertEqual(rebuilt.getElementById("donkeys").getAttribute("name"), "Saru")
+        self.assertEqual(rebuilt.getElementById("donkeys").nextElementSibling().firstChild().text(), "Dogs")
+        self.assertEqual(len(rebuilt.getElementsByClassName("fishes_list")[0].getElementsByTagName("li")), 6)
+
+    def testParseManyOrdered(self):
+        sources = [HTML, "<ul><li>1</li></ul>", "<p>no items</p>"] * 3
+        results = list(parseMany(sources, processes=2, chunksize=2))
+        self.assertEqual([index for index, _ in results], list(range(len(sources))))
+        self.assertEqual([len(compact.toDocument().getElementsByTagName("li")) for _, compact in results], [16, 1, 0] * 3)
+
+    def testParseManyExtraction(self):
+        sources = [HTML, "<ul><li name='a'>1</li><li>2</li></ul>"]
+        results = dict(parseMany(sources, extract={"names": ("li[name]", "name"), "texts": "li[name]"}, ordered=False))
+        self.assertEqual(results[0], {"names": ["Saru", "Wantuz"], "texts": ["Donkeys", "Dogs"]})
+        self.assertEqual(results[1], {"names": ["a"], "texts": ["1"]})
+        self.assertEqual(dict(parseMany(sources, extract=countLinks)), {0: 16, 1: 2})
+
+    def testParseManyFiles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory) / "page.html"
+            path.write_text(HTML, encoding='utf-8')
+            results = list(parseMany([path, path], extract=countLinks, processes=1))
+            self.assertEqual(results, [(0, 16), (1, 16)])
+
+    def testParseManyFilesInOtherCharset(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory) / "page.html"
+            path.write_bytes('<meta charset="windows-1251"><p>\u041f\u0440\u0438\u0432\u0435\u0442</p>'.encode("cp1251"))
+            results = list(parseMany([path], extract={"text": "p"}, processes=1))
+            self.assertEqual(results, [(0, {"text": ["\u041f\u0440\u0438\u0432\u0435\u0442"]})])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+from benchmarks.suite import runSuite, findRegressions, metric
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+
+    def testSuiteRuns(self):
+        results = runSuite(scale=0.01, repeats=1)
+        self.assertIn("parse.listing.MBps", results)
+        self.assertIn("query.querySelectorAll[sibling].us", results)
+        self.assertIn("memory.deep.peakBytesPerNode", results)
+        self.assertTrue(all(result["value"] > 0 for name, result in results.items() if not name.startswith("query")))
+
+    def testFindRegressions(self):
+        baseline = {"parse": metric(10.0, "MB/s", "higher"), "query": metric(2.0, "us", "lower")}
+        self.assertEqual(findRegressions(baseline, {"parse": metric(9.0, "MB/s", "higher"), "query": metric(2.2, "us", "lower")}), [])
+        regressions = findRegressions(baseline, {"parse": metric(5.0, "MB/s", "higher"), "query": metric(3.0, "us", "lower")})
+        self.assertEqual([name for name, _, _, _ in regressions], ["parse", "query"])
+        self.assertEqual(findRegressions(baseline, {"query": metric(2.4, "us", "lower")}, threshold=0.1)[0][0], "query")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import io
+import os
+import tempfile
+import codecs
+from parser import *
+from charset import *
+
+PAGE = '<html><head>{0}</head><body><p id="text">Привет, мир — ça va?</p></body></html>'
+
+
+class TestCharsetDetection(unittest.TestCase):
+
+    def testDetect(self):
+        self.assertEqual(detectCharset(codecs.BOM_UTF8 + b'<p>', "text/html; charset=windows-1251"), "utf-8-sig")
+        self.assertEqual(detectCharset(codecs.BOM_UTF16_LE + '<p>'.encode('utf-16-le')), "utf-16")
+        self.assertEqual(detectCharset(b'<meta charset="utf-8">', 'text/html; charset="Windows-1251"'), "cp1251")
+        self.assertEqual(detectCharset(b'<html><head><META CHARSET=koi8-r>'), "koi8-r")
+        self.assertEqual(detectCharset(b'<meta http-equiv="Content-Type" content="text/html; charset=iso-8859-2">'), "iso8859-2")
+        self.assertEqual(detectCharset(b'<meta charset="no-such-charset">', "text/html; charset=bogus"), DEFAULT_CHARSET)
+        self.assertEqual(detectCharset(b'<meta charset="utf-16">'), DEFAULT_CHARSET)
+        self.assertEqual(detectCharset(b' ' * PRESCAN_SIZE + b'<meta charset="koi8-r">'), DEFAULT_CHARSET)
+
+    def testDecoderHoldsPrefix(self):
+        page = '<meta charset="windows-1251"><p>Привет, мир</p>'
+        data = page.encode('cp1251')
+        decoder = ByteStreamDecoder()
+        text = ''.join(decoder.decode(data[i:i + 1]) for i in range(len(data))) + decoder.finish()
+        self.assertEqual(text, page)
+        self.assertEqual(decoder.charset(), "cp1251")
+
+    def testInvalidBytesAreReplaced(self):
+        decoder = ByteStreamDecoder("text/html; charset=utf-8")
+        self.assertEqual(decoder.decode(b'<p>\xff</p>') + decoder.finish(), '<p>�</p>')
+
+
+class TestBytesInput(unittest.TestCase):
+
+    def checkDocument(self, doc):
+        self.assertEqual(doc.getElementById("text").firstChild().text(), "Привет, мир — ça va?")
+
+    def testFeedBytes(self):
+        data = PAGE.format('<meta charset="utf-8">').encode('utf-8')
+        parser = HTMLDomParser(PARSER_MODE["PUSH"])
+        for i in range(0, len(data), 3):
+            parser.feedBytes(data[i:i + 3])
+        self.checkDocument(parser.close())
+
+    def testStreamWithContentType(self):
+        page = PAGE.format('').replace('—', '-').replace('ç', 'c')
+        parser = HTMLDomParser(PARSER_MODE["PUSH"])
+        parser.feedStream(io.BytesIO(page.encode('koi8-r')), contentType="text/html; charset=KOI8-R")
+        doc = parser.close()
+        self.assertEqual(doc.getElementById("text").firstChild().text(), "Привет, мир - ca va?")
+
+    def testStreamMode(self):
+        doc = HTMLDomParser(PARSER_MODE["STREAM"], io.BytesIO(codecs.BOM_UTF8 + PAGE.format('').encode('utf-8'))).getDocument()
+        self.checkDocument(doc)
+
+    def testForcedCharset(self):
+        page = PAGE.format('<meta charset="utf-8">').replace('—', '-')
+        doc = HTMLDomParser(PARSER_MODE["STREAM"], io.BytesIO(page.encode('cp1252', 'replace')), charset="cp1252").getDocument()
+        self.assertIn("ça va", doc.getElementById("text").firstChild().text())
+
+    def testFileMode(self):
+        # large enough to be fed in several chunks, with multibyte chars crossing chunk borders
+        items = ''.join('<li>элемент {0}</li>'.format(i) for i in range(20000))
+        page = PAGE.format('<meta charset="utf-8">').replace('</body>', '<ul>' + items + '</ul></body>')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "page.html")
+            with open(path, 'wb') as f:
+                f.write(page.encode('utf-8'))
+            doc = HTMLDomParser(PARSER_MODE["FILE"], path).getDocument()
+            empty = os.path.join(directory, "empty.html")
+            open(empty, 'wb').close()
+            self.assertEqual(len(HTMLDomParser(PARSER_MODE["FILE"], empty).getDocument().childNodes()), 0)
+        self.checkDocument(doc)
+        lis = doc.getElementsByTagName("li")
+        self.assertEqual(len(lis), 20000)
+        self.assertTrue(all(li.firstChild().text().startswith("элемент ") for li in lis))
+
+
+if __name__ == '__main__':
+    unittest.main()
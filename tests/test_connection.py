@@ -0,0 +1,259 @@
+import unittest
+import threading
+import time
+import urllib.error
+import gzip
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from parser import *
+from compression import *
+
+PAGE = '<html><body><ul id="list"><li>One</li><li>Two</li><li>Три</li></ul></body></html>'.encode('utf-8')
+LONG_PAGE = ('<html><body><ul id="list">' + '<li>Три {0}</li>' * 3000 + '</ul></body></html>').encode('utf-8')
+CODINGS = ["gzip", "deflate", "rawdeflate"] + (["br"] if brotli is not None else [])
+
+
+def compress(data, coding):
+    if coding == "gzip":
+        return gzip.compress(data)
+    if coding == "deflate":
+        return zlib.compress(data)
+    if coding == "br":
+        return brotli.compress(data)
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class LocalHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    wbufsize = 1 << 20
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.path.startswith("/slow"):
+            with self.server.lock:
+                self.server.active += 1
+                self.server.maxActive = max(self.server.maxActive, self.server.active)
+            time.sleep(0.05)
+            with self.server.lock:
+                self.server.active -= 1
+        if self.path.startswith("/redirect"):
+            self.send_response(302)
+            self.send_header("Location", "/page")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/cp1251"):
+            body = '<p>Привет</p>'.encode('cp1251')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=windows-1251")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path.startswith("/compressed/"):
+            # body is sent in small chunks, so it is decompressed in many steps
+            coding = self.path.split("/")[2]
+            self.server.acceptEncodings.append(self.headers.get("Accept-Encoding"))
+            body = compress(LONG_PAGE, coding)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Encoding", "deflate" if coding == "rawdeflate" else coding)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(body), 100):
+                chunk = body[start:start + 100]
+                self.wfile.write("{0:x}\r\n".format(len(chunk)).encode("ascii") + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        if self.path.startswith("/notmodified"):
+            self.send_response(304)
+            self.end_headers()
+            return
+        if self.path.startswith("/nolocation"):
+            self.send_response(302)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/nocontent"):
+            # neither Content-Length nor chunked encoding, but connection is kept alive
+            self.send_response(204)
+            self.end_headers()
+            return
+        if self.path.startswith("/early"):
+            self.send_response_only(103)
+            self.send_header("Link", "</style.css>; rel=preload")
+            self.end_headers()
+            self.wfile.flush()
+            self.path = "/page"
+            self.do_GET()
+            return
+        if self.path.startswith("/missing"):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+'''
+    Local http.server stand-in, counts distinct client connections
+'''
+class LocalServer:
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), LocalHandler)
+        self.server.daemon_threads = True
+        self.server.connections = set()
+        self.server.lock = threading.Lock()
+        self.server.active = 0
+        self.server.maxActive = 0
+        self.server.acceptEncodings = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return "http://127.0.0.1:{0}{1}".format(self.server.server_address[1], path)
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def testKeepAliveReuse(self):
+        with LocalServer() as server:
+            pool = ConnectionPool()
+            for i in range(5):
+                doc = HTMLDomParser(PARSER_MODE["URL"], server.url("/page?n={0}".format(i)), pool).getDocument()
+                self.assertEqual(len(doc.getElementsByTagName("li")), 3)
+            self.assertEqual(doc.getElementsByTagName("li")[2].firstChild().text(), "Три")
+            self.assertEqual(len(server.server.connections), 1)
+            self.assertEqual(pool.stats()["created"], 1)
+            self.assertEqual(pool.stats()["reused"], 4)
+            pool.close()
+
+    def testPerHostLimit(self):
+        with LocalServer() as server:
+            pool = ConnectionPool(maxPerHost=2)
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(pool.getUrlContentsAsUtf8(server.url("/slow"))))
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(results), 8)
+            self.assertTrue(all(result == PAGE.decode('utf-8') for result in results))
+            self.assertLessEqual(server.server.maxActive, 2)
+            self.assertLessEqual(len(server.server.connections), 2)
+            pool.close()
+
+    def testIdleEviction(self):
+        with LocalServer() as server:
+            pool = ConnectionPool(idleTimeout=0.0)
+            pool.getUrlContentsAsUtf8(server.url("/page"))
+            time.sleep(0.01)
+            pool.getUrlContentsAsUtf8(server.url("/page"))
+            self.assertEqual(pool.stats()["created"], 2)
+            self.assertEqual(len(server.server.connections), 2)
+            pool.close()
+
+    def testCharsetFromHeader(self):
+        with LocalServer() as server:
+            pool = ConnectionPool()
+            doc = HTMLDomParser(PARSER_MODE["URL"], server.url("/cp1251"), pool).getDocument()
+            self.assertEqual(doc.getElementsByTagName("p")[0].firstChild().text(), "Привет")
+            pool.close()
+
+    def testRedirectAndErrors(self):
+        with LocalServer() as server:
+            pool = ConnectionPool()
+            self.assertEqual(pool.getUrlContentsAsUtf8(server.url("/redirect")), PAGE.decode('utf-8'))
+            self.assertRaises(urllib.error.HTTPError, pool.getUrlContentsAsUtf8, server.url("/missing"))
+            # connection is still usable after error response
+            self.assertEqual(pool.getUrlContentsAsUtf8(server.url("/page")), PAGE.decode('utf-8'))
+            self.assertEqual(pool.stats()["opened"], 1)
+            pool.close()
+
+    def testCompressed(self):
+        with LocalServer() as server:
+            pool = ConnectionPool()
+            for coding in CODINGS:
+                doc = HTMLDomParser(PARSER_MODE["URL"], server.url("/compressed/" + coding), pool).getDocument()
+                self.assertEqual(len(doc.getElementsByTagName("li")), 3000, coding)
+                self.assertEqual(doc.getElementsByTagName("li")[-1].firstChild().text(), "Три {0}")
+            self.assertEqual(server.server.acceptEncodings, [ACCEPT_ENCODING] * len(CODINGS))
+            self.assertEqual(pool.stats()["created"], 1)
+            pool.close()
+
+
+class TestContentDecoder(unittest.TestCase):
+
+    def testByteByByte(self):
+        for coding in CODINGS:
+            decoder = ContentDecoder("deflate" if coding == "rawdeflate" else coding)
+            body = compress(LONG_PAGE, coding)
+            parts = [decoder.decompress(body[i:i + 1]) for i in range(len(body))]
+            parts.append(decoder.finish())
+            self.assertEqual(b''.join(parts), LONG_PAGE, coding)
+
+    def testSeveralCodings(self):
+        # listed in the order they were applied
+        decoder = ContentDecoder("deflate, gzip")
+        self.assertEqual(decoder.decompress(gzip.compress(zlib.compress(PAGE))) + decoder.finish(), PAGE)
+        self.assertEqual(ContentDecoder("identity").decompress(PAGE), PAGE)
+        self.assertEqual(ContentDecoder(None).decompress(PAGE), PAGE)
+
+    def testSizeLimit(self):
+        bomb = gzip.compress(bytes(10 << 20))
+        decoder = ContentDecoder("gzip", maxSize=1 << 20)
+        self.assertRaises(ValueError, decoder.decompress, bomb)
+        # every step is limited, not only the last one
+        decoder = ContentDecoder("gzip, deflate", maxSize=1 << 20)
+        self.assertRaises(ValueError, decoder.decompress, zlib.compress(bomb))
+        decoder = ContentDecoder("deflate", maxSize=len(LONG_PAGE))
+        body = compress(LONG_PAGE, "deflate")
+        parts = [decoder.decompress(body[i:i + 100]) for i in range(0, len(body), 100)]
+        self.assertEqual(b''.join(parts) + decoder.finish(), LONG_PAGE)
+
+    def testTruncatedBody(self):
+        for coding in CODINGS:
+            decoder = ContentDecoder("deflate" if coding == "rawdeflate" else coding)
+            body = compress(LONG_PAGE, coding)
+            decoder.decompress(body[:len(body) // 2])
+            self.assertRaises(ValueError, decoder.finish)
+        # empty body is complete
+        self.assertEqual(ContentDecoder("gzip").finish(), b'')
+        self.assertEqual(ContentDecoder("deflate").finish(), b'')
+        decoder = ContentDecoder("gzip")
+        self.assertRaises(ValueError, decoder.decompress, gzip.compress(PAGE) + b'garbage')
+        decoder = ContentDecoder("deflate")
+        self.assertRaises(ValueError, decoder.decompress, zlib.compress(PAGE) + b'garbage')
+
+    def testGzipMembers(self):
+        body = gzip.compress(PAGE) + gzip.compress(LONG_PAGE) + gzip.compress(PAGE)
+        decoder = ContentDecoder("gzip")
+        self.assertEqual(decoder.decompress(body) + decoder.finish(), PAGE + LONG_PAGE + PAGE)
+        decoder = ContentDecoder("gzip")
+        parts = [decoder.decompress(body[i:i + 7]) for i in range(0, len(body), 7)]
+        self.assertEqual(b''.join(parts) + decoder.finish(), PAGE + LONG_PAGE + PAGE)
+        # the limit is for all members together
+        decoder = ContentDecoder("gzip", maxSize=len(LONG_PAGE))
+        self.assertRaises(ValueError, decoder.decompress, body)
+
+    def testUnsupported(self):
+        self.assertRaises(ValueError, ContentDecoder, "compress")
+        self.assertIn("gzip", ACCEPT_ENCODING)
+
+
+if __name__ == '__main__':
+    unittest.main()
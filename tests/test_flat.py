@@ -0,0 +1,106 @@
+import unittest
+import tracemalloc
+import gc
+from parser import *
+from flat import *
+from fixtures import HTML
+
+
+def dump(node):
+    return (node.tagName(), node.text(), node._attrs(), [dump(child) for child in node.childNodes()])
+
+
+class TestFlatDocument(unittest.TestCase):
+
+    def setUp(self):
+        self.flat = FlatDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        self.doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+
+    def testSameTreeAsHTMLDocument(self):
+        self.assertEqual(dump(self.flat), dump(self.doc))
+
+    def testPushMode(self):
+        parser = FlatDomParser(PARSER_MODE["PUSH"])
+        for i in range(0, len(HTML), 7):
+            parser.feed(HTML[i:i + 7])
+        self.assertEqual(dump(parser.close()), dump(self.doc))
+
+    def testQueries(self):
+        for selector in ["li", "ul > li", "li + p", "li ~ li", ".list", "ul.list li", "li[name]", "#tree > li", "p, ul", "*"]:
+            flatRes = [dump(node) for node in self.flat.querySelectorAll(selector)]
+            res = [dump(node) for node in self.doc.querySelectorAll(selector)]
+            self.assertEqual(flatRes, res, selector)
+        fishes = self.flat.getElementsByClassName("fishes_list")[0]
+        self.assertEqual(len(fishes.getElementsByTagName("li")), 6)
+        self.assertEqual(self.flat.getElementsByTagName("nosuchtag"), [])
+
+    def testDuplicateIds(self):
+        html = '<div><p id="x">1</p></div><p id="x">2</p>'
+        flat = FlatDomParser(PARSER_MODE["RAW"], html).getDocument()
+        doc = HTMLDomParser(PARSER_MODE["RAW"], html).getDocument()
+        self.assertEqual(flat.getElementById("x"), flat.getElementsByTagName("p")[0])
+        self.assertEqual(flat.getAllElementsById("x"), flat.getElementsByTagName("p"))
+        for selector in ["#x", "#x, q", "div #x"]:
+            self.assertEqual([dump(node) for node in flat.querySelectorAll(selector)],
+                             [dump(node) for node in doc.querySelectorAll(selector)], selector)
+
+    def testLazyQueries(self):
+        for selector in ["li", "ul > li", ".list", "li[name]", "p, ul"]:
+            self.assertEqual(list(self.flat.iterQuerySelectorAll(selector)), self.flat.querySelectorAll(selector))
+        self.assertEqual(self.flat.querySelector("li[legs]"), self.flat.querySelectorAll("li[legs]")[0])
+        self.assertIsNone(self.flat.querySelector("form"))
+        self.assertEqual(list(self.flat.iterElementsByClassName("list")), self.flat.getElementsByClassName("list"))
+
+    def testNavigation(self):
+        donkeys = self.flat.getElementById("donkeys")
+        self.assertEqual(donkeys.getAttribute("name"), "Saru")
+        self.assertTrue(donkeys.hasAttribute("id"))
+        self.assertIsNone(donkeys.getAttribute("legs"))
+        self.assertEqual(donkeys.firstChild().text(), "Donkeys")
+        self.assertEqual(donkeys.nextElementSibling().firstChild().text(), "Dogs")
+        self.assertEqual(donkeys.previousElementSibling().firstChild().text(), "Cows")
+        self.assertEqual(donkeys.parentElement().lastElementChild().firstChild().text(), "Tigers")
+        self.assertIsNone(self.flat.firstElementChild().parentElement())
+        self.assertEqual(self.flat.getElementById("tree").firstElementChild().classList().contains("animals_list"), True)
+
+    def testTextContent(self):
+        for selector in ["li", "ul", "p"]:
+            self.assertEqual([node.textContent() for node in self.flat.querySelectorAll(selector)],
+                             [node.textContent() for node in self.doc.querySelectorAll(selector)])
+        self.assertEqual(self.flat.getElementById("donkeys").firstChild().textContent(), "Donkeys")
+        self.assertEqual(self.flat.getElementsByClassName("fishes_list")[0].textContent(" "),
+                         self.doc.getElementsByClassName("fishes_list")[0].textContent(" "))
+
+    def testDocumentPosition(self):
+        tree, donkeys = self.flat.getElementById("tree"), self.flat.getElementById("donkeys")
+        fishes = self.flat.getElementsByClassName("fishes_list")[0]
+        self.assertTrue(tree.contains(donkeys))
+        self.assertFalse(fishes.contains(donkeys))
+        self.assertEqual(donkeys.compareDocumentPosition(tree), DOCUMENT_POSITION["CONTAINS"] | DOCUMENT_POSITION["PRECEDING"])
+        self.assertEqual(donkeys.compareDocumentPosition(fishes), DOCUMENT_POSITION["FOLLOWING"])
+        self.assertEqual(self.flat.sortInDocumentOrder([fishes, donkeys, tree]), [tree, donkeys, fishes])
+
+    def testViewsAreEqualByNode(self):
+        self.assertEqual(self.flat.getElementById("donkeys"), self.flat.querySelector("#donkeys"))
+        self.assertIsNot(self.flat.getElementById("donkeys"), self.flat.getElementById("donkeys"))
+        self.assertEqual(len({self.flat.getElementById("donkeys"), self.flat.getElementById("donkeys")}), 1)
+        self.assertNotEqual(self.flat.getElementById("donkeys"), self.flat.getElementById("tree"))
+
+    def testLessMemoryThanHTMLDocument(self):
+        html = "<ul>" + "<li class='item'><a href='/x'>item</a></li>" * 2000 + "</ul>"
+
+        def retained(parserClass):
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            document = parserClass(PARSER_MODE["RAW"], html).getDocument()
+            gc.collect()
+            size = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            return size
+
+        self.assertLess(retained(FlatDomParser) * 3, retained(HTMLDomParser))
+
+
+if __name__ == '__main__':
+    unittest.main()
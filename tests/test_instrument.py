@@ -0,0 +1,101 @@
+import unittest
+from parser import *
+from flat import *
+from instrument import *
+from fixtures import HTML
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def testParsePhasesAndCounters(self):
+        events = []
+        instrumentation = Instrumentation(lambda event, data: events.append((event, data)))
+        parser = HTMLDomParser(PARSER_MODE["PUSH"], instrumentation=instrumentation)
+        data = HTML.encode("utf-8")
+        for i in range(0, len(data), 100):
+            parser.feedBytes(data[i:i + 100])
+        doc = parser.close()
+        stats = instrumentation.stats()
+        self.assertEqual(stats["counters"]["parses"], 1)
+        self.assertEqual(stats["counters"]["bytes"], len(data))
+        self.assertEqual(stats["counters"]["chars"], len(HTML))
+        self.assertEqual(stats["counters"]["elements"], 31)
+        self.assertEqual(stats["counters"]["texts"], 18)
+        for phase in PHASES:
+            self.assertGreater(stats["phases"][phase], 0, phase)
+        self.assertGreater(stats["phases"]["build"], stats["phases"]["index"])
+        self.assertEqual([event for event, _ in events], ["parse"])
+        self.assertEqual(len(doc.getElementsByTagName("li")), 16)
+
+    def testQueries(self):
+        events = []
+        instrumentation = Instrumentation(lambda event, data: events.append((event, data)))
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML, instrumentation=instrumentation).getDocument()
+        doc.querySelectorAll("ul > li")
+        doc.querySelectorAll("ul > li")
+        doc.querySelectorAll("li ~ li, ul li")
+        doc.querySelectorAll("li")
+        stats = instrumentation.stats()
+        self.assertEqual(set(stats["selectors"]), {"ul > li", "li ~ li, ul li", "li"})
+        self.assertEqual(stats["selectors"]["ul > li"]["count"], 1)
+        self.assertEqual({name: value["count"] for name, value in stats["combinators"].items()},
+                         {"child": 1, "sibling": 1, "descendant": 1, "none": 1})
+        self.assertGreaterEqual(stats["queryCache"]["hits"], 1)
+        self.assertEqual(events[-1][0], "query")
+        self.assertEqual(events[-1][1]["results"], 16)
+
+    def testFirstMatchAndLazyQueries(self):
+        events = []
+        instrumentation = Instrumentation(lambda event, data: events.append((event, data)))
+        for doc in (HTMLDomParser(PARSER_MODE["RAW"], HTML, instrumentation=instrumentation).getDocument(),
+                    FlatDomParser(PARSER_MODE["RAW"], HTML, instrumentation=instrumentation).getDocument()):
+            instrumentation.reset()
+            del events[:]
+            self.assertIsNotNone(doc.querySelector("ul > li"))
+            self.assertEqual(events[-1][1]["results"], 1)
+            lazy = doc.iterQuerySelectorAll("li ~ li")
+            next(lazy)
+            next(lazy)
+            # recorded when iteration ends or iterator is dropped
+            del lazy
+            self.assertEqual(events[-1][1], {"selector": "li ~ li", "seconds": events[-1][1]["seconds"], "results": 2})
+            self.assertEqual(len(list(doc.iterQuerySelectorAll("li"))), 16)
+            self.assertEqual(events[-1][1]["results"], 16)
+            stats = instrumentation.stats()
+            self.assertEqual(set(stats["selectors"]), {"ul > li", "li ~ li", "li"})
+            self.assertEqual({name: value["count"] for name, value in stats["combinators"].items()},
+                             {"child": 1, "sibling": 1, "none": 1})
+
+    def testIndexUpdatesOfMutations(self):
+        instrumentation = Instrumentation()
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML, instrumentation=instrumentation).getDocument()
+        instrumentation.reset()
+        tree = doc.getElementById("tree")
+        tree.insertBefore(HTMLDomElement(doc, None, "li", [("class", "new")]), tree.firstChild())
+        self.assertGreater(instrumentation.stats()["phases"]["index"], 0)
+        instrumentation.reset()
+        doc.getElementById("donkeys").setAttribute("class", "other")
+        self.assertGreater(instrumentation.stats()["phases"]["index"], 0)
+        instrumentation.reset()
+        tree.removeChild(tree.firstChild())
+        self.assertGreater(instrumentation.stats()["phases"]["index"], 0)
+        self.assertEqual(len(doc.getElementsByClassName("new")), 0)
+
+    def testFlatDocument(self):
+        instrumentation = Instrumentation()
+        doc = FlatDomParser(PARSER_MODE["RAW"], HTML, instrumentation=instrumentation).getDocument()
+        doc.querySelectorAll("li[name]")
+        stats = instrumentation.stats()
+        self.assertEqual(stats["counters"]["elements"], 31)
+        self.assertEqual(stats["selectors"]["li[name]"]["count"], 1)
+        instrumentation.reset()
+        self.assertEqual(instrumentation.stats()["counters"]["elements"], 0)
+
+    def testDisabledByDefault(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        self.assertIsNone(doc.getInstrumentation())
+        self.assertNotIn("feed", vars(HTMLDomParser(PARSER_MODE["PUSH"])))
+
+
+if __name__ == '__main__':
+    unittest.main()
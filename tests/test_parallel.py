@@ -0,0 +1,84 @@
+import unittest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from parser import *
+from flat import *
+from parallel import *
+from fixtures import HTML
+
+
+SELECTORS = ["li", "ul > li", "li + p", "li ~ li", ".list", "ul.list li", "li[name]", "#tree > li", "p, ul", "*"]
+
+
+class TestFrozenDocument(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+
+    def testChangesThrow(self):
+        donkeys = self.doc.getElementById("donkeys")
+        self.doc.freeze()
+        self.assertTrue(self.doc.isFrozen())
+        self.assertRaises(RuntimeError, donkeys.setAttribute, "name", "x")
+        self.assertRaises(RuntimeError, donkeys.classList().add, "new")
+        self.assertRaises(RuntimeError, self.doc.firstElementChild().appendChild, HTMLDomElement(self.doc, None, "p"))
+        self.assertRaises(RuntimeError, donkeys.parentNode().removeChild, donkeys)
+        self.assertEqual(donkeys.getAttribute("name"), "Saru")
+        self.assertFalse(donkeys.classList().contains("new"))
+        self.assertIn(donkeys, donkeys.parentNode().children())
+
+    def testStaleEntriesDropped(self):
+        self.assertEqual(len(self.doc.querySelectorAll("li[name]")), 2)
+        self.doc.getElementById("donkeys").setAttribute("legs", "4")
+        self.doc.freeze()
+        self.assertEqual(len(self.doc.querySelectorAll("li[legs]")), 2)
+        self.assertEqual(len(self.doc.querySelectorAll("li[legs]")), 2)
+        self.assertGreaterEqual(self.doc.getQueryCache().stats()["hits"], 1)
+
+    def testQueriesFromThreads(self):
+        expected = {selector: self.doc.querySelectorAll(selector) for selector in SELECTORS}
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML, document=HTMLDocument(queryCacheSize=4)).getDocument()
+        doc.freeze()
+        errors = []
+
+        def run():
+            try:
+                for _ in range(50):
+                    for selector in SELECTORS:
+                        res = [node.textContent() for node in doc.querySelectorAll(selector)]
+                        if res != [node.textContent() for node in expected[selector]]:
+                            errors.append(selector)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(doc.getQueryCache()), 4)
+
+
+class TestQuerySelectorAllParallel(unittest.TestCase):
+
+    def testSameAsQuerySelectorAll(self):
+        html = "<ul>" + "<li class='item'><a href='/x'>item</a><p>t</p></li>" * 2000 + "</ul>"
+        doc = HTMLDomParser(PARSER_MODE["RAW"], html).getDocument()
+        doc.freeze()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for selector in ["li > a", "ul .item p", "a + p", "li, a", "[href]"]:
+                self.assertEqual(querySelectorAllParallel(doc, selector, executor), doc.querySelectorAll(selector), selector)
+        self.assertEqual(querySelectorAllParallel(doc, "li a", workers=3), doc.querySelectorAll("li a"))
+
+    def testSmallAndFlat(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        flat = FlatDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        flat.freeze()
+        for selector in SELECTORS:
+            self.assertEqual(querySelectorAllParallel(doc, selector), doc.querySelectorAll(selector))
+            self.assertEqual(querySelectorAllParallel(flat, selector, workers=2), flat.querySelectorAll(selector))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+import tempfile
+import os
+import struct
+from array import array
+from parser import *
+from flat import *
+from snapshot import *
+from fixtures import HTML
+from test_flat import dump
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+
+    def testRoundTrip(self):
+        loaded = loadSnapshotBytes(dumpSnapshot(self.doc))
+        self.assertEqual(dump(loaded), dump(self.doc))
+        self.assertEqual(loaded.getElementById("donkeys").nextElementSibling().getAttribute("legs"), "4")
+        self.assertEqual(len(loaded.getElementsByClassName("fishes_list")[0].getElementsByTagName("li")), 6)
+        self.assertEqual(len(loaded.querySelectorAll("ul.list li ~ p")), 1)
+
+    def testFlatDocumentRoundTrip(self):
+        flat = FlatDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        self.assertEqual(dumpSnapshot(flat), dumpSnapshot(self.doc))
+
+    def testSpecialValues(self):
+        html = "<input disabled value=''><p title='привет \U0001F600'>ça</p>"
+        doc = HTMLDomParser(PARSER_MODE["RAW"], html).getDocument()
+        loaded = loadSnapshotBytes(dumpSnapshot(doc))
+        self.assertEqual(dump(loaded), dump(doc))
+        self.assertTrue(loaded.getElementsByTagName("input")[0].hasAttribute("disabled"))
+        self.assertIsNone(loaded.getElementsByTagName("input")[0].getAttribute("disabled"))
+        self.assertEqual(loaded.getElementsByTagName("input")[0].getAttribute("value"), "")
+
+    def testClassListChangesAreKept(self):
+        self.doc.getElementById("donkeys").classList().add("stubborn")
+        loaded = loadSnapshotBytes(dumpSnapshot(self.doc))
+        self.assertEqual(loaded.getElementsByClassName("stubborn"), [loaded.getElementById("donkeys")])
+
+    def testFileIsMapped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "doc.snapshot")
+            saveSnapshot(self.doc, path)
+            loaded = loadSnapshot(path)
+            self.assertEqual(dump(loaded), dump(self.doc))
+            self.assertEqual(os.listdir(directory), ["doc.snapshot"])
+
+    def testDuplicateIds(self):
+        doc = HTMLDomParser(PARSER_MODE["RAW"], '<div><p id="x">1</p></div><p id="x">2</p>').getDocument()
+        loaded = loadSnapshotBytes(dumpSnapshot(doc))
+        self.assertEqual([dump(node) for node in loaded.getAllElementsById("x")],
+                         [dump(node) for node in doc.getAllElementsById("x")])
+        self.assertEqual(len(loaded.querySelectorAll("#x")), 2)
+
+    def testInvalidData(self):
+        self.assertRaises(ValueError, loadSnapshotBytes, b"<html></html>")
+        data = dumpSnapshot(self.doc)
+        self.assertRaises(ValueError, loadSnapshotBytes, b"X" + data[1:])
+        self.assertRaises(ValueError, loadSnapshotBytes, data[:len(data) // 2])
+
+    def testBrokenSection(self):
+        data = dumpSnapshot(self.doc)
+        index = [name for name, typecode in SECTIONS].index("parents")
+        position = HEADER.size + index * SECTION.size
+        offset, length = SECTION.unpack_from(data, position)
+        # length which is not a multiple of item size
+        broken = bytearray(data)
+        SECTION.pack_into(broken, position, offset, length - 1)
+        self.assertRaises(ValueError, loadSnapshotBytes, bytes(broken))
+        # fewer items than nodes
+        SECTION.pack_into(broken, position, offset, length - array('i').itemsize)
+        self.assertRaises(ValueError, loadSnapshotBytes, bytes(broken))
+        # link out of the document
+        broken = bytearray(data)
+        struct.pack_into("=i", broken, offset + array('i').itemsize, 1000000)
+        self.assertRaises(ValueError, loadSnapshotBytes, bytes(broken))
+        index = [name for name, typecode in SECTIONS].index("tagIndex")
+        offset, length = SECTION.unpack_from(data, HEADER.size + index * SECTION.size)
+        broken = bytearray(data)
+        struct.pack_into("=i", broken, offset, -5)
+        self.assertRaises(ValueError, loadSnapshotBytes, bytes(broken))
+
+
+class TestSnapshotCache(unittest.TestCase):
+
+    def testRepeatedInputIsNotParsed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SnapshotCache(directory)
+            first = cache.parse(HTML)
+            second = cache.parse(HTML)
+            third = cache.parse(HTML.encode("utf-8"))
+            fourth = cache.parse(HTML.encode("utf-8"))
+            # str and its UTF-8 bytes have different keys
+            self.assertEqual(cache.stats(), {"hits": 2, "misses": 2})
+            self.assertEqual(dump(first), dump(second))
+            self.assertEqual(dump(first), dump(third))
+            self.assertEqual(dump(third), dump(fourth))
+            self.assertNotEqual(cache.path(HTML), cache.path(HTML.encode("utf-8")))
+            self.assertTrue(os.path.exists(cache.path(HTML)))
+
+    def testContentTypeIsKey(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SnapshotCache(directory)
+            content = "<p>\u0436</p>".encode("cp1251")
+            contentType = "text/html; charset=cp1251"
+            self.assertNotEqual(cache.path(content), cache.path(content, contentType))
+            self.assertEqual(cache.parse(content, contentType).getElementsByTagName("p")[0].textContent(), "\u0436")
+            self.assertEqual(cache.parse(content, contentType).getElementsByTagName("p")[0].textContent(), "\u0436")
+            cache.parse(content, "text/html; charset=latin-1")
+            self.assertEqual(cache.stats(), {"hits": 1, "misses": 2})
+
+    def testMetaCharsetIsNotSharedWithStr(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SnapshotCache(directory)
+            html = '<meta charset="windows-1251"><p>\u041f\u0440\u0438\u0432\u0435\u0442</p>'
+            # UTF-8 bytes are decoded by their meta charset
+            garbled = cache.parse(html.encode("utf-8")).getElementsByTagName("p")[0].textContent()
+            self.assertNotEqual(garbled, "\u041f\u0440\u0438\u0432\u0435\u0442")
+            self.assertEqual(cache.parse(html).getElementsByTagName("p")[0].textContent(), "\u041f\u0440\u0438\u0432\u0435\u0442")
+            self.assertEqual(cache.stats(), {"hits": 0, "misses": 2})
+
+    def testBrokenSnapshotIsReplaced(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = SnapshotCache(directory)
+            with open(cache.path(HTML), "wb") as f:
+                f.write(b"garbage")
+            self.assertEqual(len(cache.parse(HTML).getElementsByTagName("li")), 16)
+            self.assertEqual(len(cache.parse(HTML).getElementsByTagName("li")), 16)
+            self.assertEqual(cache.stats(), {"hits": 1, "misses": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import gc
+import weakref
+from parser import *
+from stream import *
+from fixtures import HTML
+
+
+class TestHTMLStreamParser(unittest.TestCase):
+
+    def testCallbacks(self):
+        found = []
+        handlers = [
+            ("ul.list > li", lambda li: found.append(("other", li.firstChild().text()))),
+            ("#donkeys", lambda li: found.append(("id", li.getAttribute("name")))),
+            ("li[legs]", lambda li: found.append(("attr", li.firstChild().text()))),
+        ]
+        self.assertIsNone(HTMLStreamParser(PARSER_MODE["RAW"], HTML, handlers).close())
+        self.assertEqual(found, [("id", "Saru"), ("attr", "Dogs"), ("other", "Snakes"), ("other", "Birds"),
+                                 ("other", "Lizards")])
+
+    def testSubtreesAndNestedMatches(self):
+        found = []
+        parser = HTMLStreamParser(PARSER_MODE["PUSH"])
+        parser.on("li.fishes_list", lambda li: found.append(len(li.getElementsByTagName("li"))))
+        # ancestors outside of matched subtrees are matched too
+        parser.on("body li.list li ul p", lambda p: found.append(p.firstChild().text()))
+        for i in range(0, len(HTML), 11):
+            parser.feed(HTML[i:i + 11])
+        parser.close()
+        self.assertEqual(found, ["I am a neko", "I am a wanko", 6])
+
+    def testUnclosedElementsDeliveredOnClose(self):
+        found = []
+        parser = HTMLStreamParser(PARSER_MODE["PUSH"], handlers=[("div", lambda div: found.append(div.childNodes()[0].text()))])
+        parser.feed("<div>outer<div>inner")
+        self.assertEqual(found, [])
+        parser.close()
+        self.assertEqual(found, ["inner", "outer"])
+
+    def testSubtreesAreReleased(self):
+        refs = []
+        html = "<feed>" + "<entry><title>t</title><link href='/x'></entry>" * 1000 + "</feed>"
+        parser = HTMLStreamParser(PARSER_MODE["PUSH"], handlers=[("feed > entry", lambda entry: refs.append(weakref.ref(entry.document())))])
+        parser.feed(html)
+        gc.collect()
+        self.assertEqual(len(refs), 1000)
+        self.assertEqual(sum(1 for ref in refs if ref() is not None), 0)
+        self.assertEqual(len(parser.stack), 1)
+        parser.close()
+
+    def testSiblingCombinators(self):
+        parser = HTMLStreamParser(PARSER_MODE["PUSH"])
+        self.assertRaises(ValueError, parser.on, "li ~ li", print)
+
+
+if __name__ == '__main__':
+    unittest.main()
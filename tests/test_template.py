@@ -0,0 +1,82 @@
+import unittest
+import pickle
+from parser import *
+from flat import *
+from template import *
+from fixtures import HTML
+
+
+FIELDS = {
+    "names": ("li[name]", "name"),
+    "texts": "li[name]",
+    "tree": "#tree > li",
+    "lists": ".list",
+    "paragraphs": "ul p",
+    "group": "p, li.list, #donkeys",
+    "attributes": ("[legs]", "legs"),
+    "named": ("[name]", "name"),
+    "siblings": ("li ~ li", lambda li: li.tagName()),
+    "missing": "form",
+}
+
+
+class TestExtractionTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = HTMLDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        self.template = ExtractionTemplate(FIELDS)
+
+    def expected(self, root):
+        res = {}
+        for field, spec in FIELDS.items():
+            selector, projection = (spec, None) if isinstance(spec, str) else spec
+            nodes = root.querySelectorAll(selector)
+            if projection is None:
+                res[field] = [node.textContent() for node in nodes]
+            elif isinstance(projection, str):
+                res[field] = [node.getAttribute(projection) for node in nodes]
+            else:
+                res[field] = [projection(node) for node in nodes]
+        return res
+
+    def testSameAsQueries(self):
+        self.assertEqual(self.template.extract(self.doc), self.expected(self.doc))
+        self.assertEqual(self.template.extract(self.doc)["names"], ["Saru", "Wantuz"])
+        self.assertEqual(self.template.fields(), list(FIELDS))
+
+    def testSubtree(self):
+        fishes = self.doc.getElementsByClassName("fishes_list")[0]
+        self.assertEqual(self.template.extract(fishes), self.expected(fishes))
+        # root itself is matched too
+        self.assertEqual(self.template.extract(fishes)["tree"], [fishes.textContent()])
+
+    def testReusedForDocuments(self):
+        other = HTMLDomParser(PARSER_MODE["RAW"], "<ul id='tree'><li name='a' legs='2'>1</li><li>2</li></ul><p>p</p>").getDocument()
+        self.assertEqual(self.template.extract(other), self.expected(other))
+        self.assertEqual(self.template.extract(self.doc), self.expected(self.doc))
+        flat = FlatDomParser(PARSER_MODE["RAW"], HTML).getDocument()
+        self.assertEqual(self.template.extract(flat), self.expected(self.doc))
+
+    def testDuplicateIds(self):
+        html = "<ul id='tree'><li id='i1'>1</li><li><b id='i1'>2</b></li></ul><b>3</b><p id='i1'>4</p>"
+        fields = {"group": "b, #i1", "ids": "#i1", "nested": "#tree #i1", "ordered": "p, #i1, b"}
+        template = ExtractionTemplate(fields)
+        for document in (HTMLDomParser(PARSER_MODE["RAW"], html).getDocument(),
+                         FlatDomParser(PARSER_MODE["RAW"], html).getDocument()):
+            expected = {field: [node.textContent() for node in document.querySelectorAll(selector)]
+                        for field, selector in fields.items()}
+            self.assertEqual(template.extract(document), expected)
+            self.assertEqual(expected["ids"], ["1", "2", "4"])
+            tree = document.getElementById("tree")
+            self.assertEqual(template.extract(tree)["ids"], ["1", "2"])
+
+    def testPickle(self):
+        template = pickle.loads(pickle.dumps(ExtractionTemplate({"texts": "li[name]", "links": ("li", "name")})))
+        self.assertEqual(template.extract(self.doc)["texts"], ["Donkeys", "Dogs"])
+
+    def testInvalidSelector(self):
+        self.assertRaises(ValueError, ExtractionTemplate, {"bad": "li >"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import random
+from parser import *
+from tokenizer import *
+from fixtures import HTML
+
+
+'''
+    Tree builder, which records tokens, consecutive data pieces are joined
+'''
+class Recorder:
+
+    def __init__(self):
+        self.tokens = []
+
+    def handle_starttag(self, tag, attrs):
+        self.tokens.append(("start", tag, attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.tokens.append(("startend", tag, attrs))
+
+    def handle_endtag(self, tag):
+        self.tokens.append(("end", tag))
+
+    def handle_data(self, data):
+        if self.tokens and self.tokens[-1][0] == "data":
+            self.tokens[-1] = ("data", self.tokens[-1][1] + data)
+        else:
+            self.tokens.append(("data", data))
+
+    def handle_comment(self, data):
+        self.tokens.append(("comment", data))
+
+    def handle_decl(self, decl):
+        self.tokens.append(("decl", decl))
+
+    def handle_pi(self, data):
+        self.tokens.append(("pi", data))
+
+
+def tokenize(tokenizerClass, html, chunkSize=None):
+    recorder = Recorder()
+    tokenizer = tokenizerClass(recorder)
+    chunkSize = chunkSize or max(len(html), 1)
+    for i in range(0, len(html), chunkSize):
+        tokenizer.feed(html[i:i + chunkSize])
+    tokenizer.close()
+    return recorder.tokens
+
+
+'''
+    Conformance corpus, every tokenizer must give the same tokens as html.parser for it
+'''
+CORPUS = [
+    HTML,
+    "",
+    "plain text only",
+    "<!DOCTYPE html><html><head><title>T</title></head><body></body></html>",
+    "<p>Fish &amp; chips &lt;3 &#65;&#x42; &copy &nosuch; &</p>",
+    "<a href='/x?a=1&amp;b=2' title=\"say &quot;hi&quot;\" data-x=plain checked>link</a>",
+    "<A HREF=/Upper CLASS='Mixed Case'>Upper</A>",
+    "<br/><br /><img src=a.png/><input disabled/><hr>",
+    "<div class=''><span id=\"\" empty=>x</span></div>",
+    "<div\n  class = \"a b\"\n\tid=main\n>multi\nline</div>",
+    "<script>if (a < b && c > d) { document.write('<p>'); }</script><p>after</p>",
+    "<style>p > a { color: red }</STYLE ><script type=text/javascript></script>",
+    "<!-- comment <p> inside --><p>a<!---->b<!-- x -- >c</p>",
+    "<?xml version=\"1.0\"?><root/>",
+    "<![CDATA[raw]]><!bogus comment><p>x</p>",
+    "a < b and c <= d, 1<2 <",
+    "<p>unclosed <b>bold <i>italic",
+    "</stray></ p ><p></p    ><p></>",
+    "<a x=\"1\"y='2' / z><a =odd><a b=c\"d>weird</a>",
+    "<div attr=\"unterminated>text</div>",
+    "<p>tail &am",
+    "<script>never closed <b>",
+    "<p>éè 日本 &eacute; \U0001F600</p>",
+    "<ul>" + "<li class=item><a href='/i'>item &amp; more</a></li>" * 50 + "</ul>",
+]
+
+
+class TestTokenizers(unittest.TestCase):
+
+    def testCorpus(self):
+        for html in CORPUS:
+            expected = tokenize(StdlibTokenizer, html)
+            self.assertEqual(tokenize(FastTokenizer, html), expected, html)
+
+    def testChunked(self):
+        for html in CORPUS:
+            expected = tokenize(StdlibTokenizer, html)
+            for chunkSize in [1, 2, 3, 7, 64]:
+                self.assertEqual(tokenize(FastTokenizer, html, chunkSize), expected, (html, chunkSize))
+
+    def testRandomMarkup(self):
+        rnd = random.Random(21)
+        pieces = ["<p>", "</p>", "<div class='a b'>", "</div>", "<a href=\"/x?y=1&amp;z\">", "</a>", "<br/>", "<img src=x>",
+                  "text", " ", "\n", "&amp;", "&lt", "&#33;", "&", "<", ">", "=", "'", "\"", "/", "<!-- c -->", "<!",
+                  "<script>", "</script>", "<style>", "</style>", "<?pi>", "<b id=k", " x=1", "<P CLASS=Q>", "</ p>"]
+        for _ in range(300):
+            html = ''.join(rnd.choice(pieces) for _ in range(rnd.randint(1, 40)))
+            expected = tokenize(StdlibTokenizer, html)
+            self.assertEqual(tokenize(FastTokenizer, html), expected, html)
+            self.assertEqual(tokenize(FastTokenizer, html, rnd.randint(1, 10)), expected, html)
+
+    def testTokens(self):
+        self.assertEqual(tokenize(FastTokenizer, "<a HREF='x&amp;y' b>t&lt;</a><br/>"), [
+            ("start", "a", [("href", "x&y"), ("b", None)]),
+            ("data", "t<"),
+            ("end", "a"),
+            ("startend", "br", []),
+        ])
+        self.assertEqual(tokenize(FastTokenizer, "<script><p>x</p></script>"),
+                         [("start", "script", []), ("data", "<p>x</p>"), ("end", "script")])
+
+    def testParserWithTokenizers(self):
+        def dump(node):
+            return (node.tagName(), node.text(), node._attrs(), [dump(child) for child in node.childNodes()])
+
+        for html in CORPUS:
+            expected = dump(HTMLDomParser(PARSER_MODE["RAW"], html, tokenizer=TOKENIZER["STDLIB"]).getDocument())
+            self.assertEqual(dump(HTMLDomParser(PARSER_MODE["RAW"], html).getDocument()), expected, html)
+
+
+if __name__ == '__main__':
+    unittest.main()
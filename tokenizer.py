@@ -0,0 +1,173 @@
+from html.parser import HTMLParser
+from html import unescape
+import re
+
+'''
+    Tokenizers split HTML text into tokens and pass them to a tree builder, which has methods
+    handle_starttag(tag, attrs), handle_startendtag(tag, attrs), handle_endtag(tag), handle_data(data),
+    handle_comment(data), handle_decl(decl) and handle_pi(data) with the same meaning as in html.parser.HTMLParser.
+    Data may be split into pieces arbitrarily, builder must join consecutive pieces itself.
+    Tokenizer is made as Tokenizer(builder), text is passed to it with feed(data), close() flushes everything left.
+'''
+
+
+'''
+    Compatibility tokenizer: html.parser.HTMLParser with builder's handlers
+'''
+class StdlibTokenizer(HTMLParser):
+
+    def __init__(self, builder):
+        HTMLParser.__init__(self)
+        self.handle_starttag = builder.handle_starttag
+        self.handle_startendtag = builder.handle_startendtag
+        self.handle_endtag = builder.handle_endtag
+        self.handle_data = builder.handle_data
+        self.handle_comment = builder.handle_comment
+        self.handle_decl = builder.handle_decl
+        self.handle_pi = builder.handle_pi
+
+
+'''
+    Text, start tag in its common form(unquoted values only of safe chars, attributes separated by whitespaces) or end tag.
+    Groups: 1 - text, 2 - tag name, 3 - attributes, 4 - '/' of self-closing tag, 5 - end tag name.
+'''
+AttributeRe = re.compile(r'''\s+([^\s/>"'=][^\s/=>]*)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'=<>`]+))?''')
+TokenRe = re.compile(r'''([^<]+)|<([a-zA-Z][^\t\n\r\f />\x00]*)((?:\s+[^\s/>"'=][^\s/=>]*(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>`]+))?)*)\s*(/?)>'''
+                     r'|</\s*([a-zA-Z][-.a-zA-Z0-9:_]*)\s*>')
+LETTERS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+
+'''
+    Fast tokenizer: whole buffer is scanned with one compiled pattern, a token per match.
+    Tokens are the same as of StdlibTokenizer. Only text, common start tags and end tags are scanned here,
+    everything else(comments, declarations, malformed tags) is rare and is parsed by methods of StdlibTokenizer,
+    so odd markup is handled exactly as html.parser does it. Data left at close() is finished by StdlibTokenizer too.
+'''
+class FastTokenizer:
+
+    def __init__(self, builder):
+        self.__builder = builder
+        self.__fallback = StdlibTokenizer(builder)
+        # unprocessed tail of fed text
+        self.__rawdata = ''
+        # closing tag regex of script or style element, which content is not parsed
+        self.__cdataEnd = None
+        self.__cdataElem = None
+
+    def feed(self, data):
+        rawdata = self.__rawdata + data if self.__rawdata else data
+        builder = self.__builder
+        handleData = builder.handle_data
+        handleStartTag = builder.handle_starttag
+        handleEndTag = builder.handle_endtag
+        findAttributes = AttributeRe.findall
+        match = TokenRe.match
+        cdataElements = StdlibTokenizer.CDATA_CONTENT_ELEMENTS
+        n = len(rawdata)
+        i = 0
+        while i < n:
+            if self.__cdataEnd is not None:
+                m = self.__cdataEnd.search(rawdata, i)
+                if m is None:
+                    break
+                if m.start() > i:
+                    handleData(rawdata[i:m.start()])
+                builder.handle_endtag(self.__cdataElem)
+                self.__cdataEnd = self.__cdataElem = None
+                i = m.end()
+                continue
+            m = match(rawdata, i)
+            if m is None:
+                k = self.__parseOther(rawdata, i)
+                if k < 0:
+                    break
+                i = k
+                continue
+            kind = m.lastindex
+            if kind == 1:
+                j = m.end()
+                if j == n:
+                    # character reference may be split between chunks, so the part from the last '&' waits for more data
+                    amp = rawdata.rfind('&', i)
+                    if amp >= 0:
+                        j = amp
+                        if i == j:
+                            break
+                text = rawdata[i:j]
+                handleData(unescape(text) if '&' in text else text)
+                i = j
+                continue
+            i = m.end()
+            if kind == 5:
+                handleEndTag(m.group(5).lower())
+                continue
+            tag = m.group(2).lower()
+            attrs = []
+            if m.group(3):
+                # value group is empty only for attributes without value, quoted values have quotes in it
+                for name, value in findAttributes(m.group(3)):
+                    if not value:
+                        value = None
+                    else:
+                        if value[0] == '"' or value[0] == "'":
+                            value = value[1:-1]
+                        if '&' in value:
+                            value = unescape(value)
+                    attrs.append((name.lower(), value))
+            if m.group(4):
+                builder.handle_startendtag(tag, attrs)
+            else:
+                handleStartTag(tag, attrs)
+                if tag in cdataElements:
+                    self.__setCdataMode(tag)
+        self.__rawdata = rawdata[i:]
+
+    def close(self):
+        fallback = self.__fallback
+        fallback.rawdata = self.__rawdata
+        self.__rawdata = ''
+        if self.__cdataElem is not None:
+            fallback.set_cdata_mode(self.__cdataElem)
+            self.__cdataEnd = self.__cdataElem = None
+        fallback.close()
+
+    def __setCdataMode(self, tag):
+        self.__cdataElem = tag
+        self.__cdataEnd = re.compile(r'</\s*%s\s*>' % tag, re.I)
+
+    '''
+        Parses construct at 'i', which starts with '<' and is not matched by TokenRe, with html.parser.
+        Returns position after it or -1 if it is not complete yet.
+    '''
+    def __parseOther(self, rawdata, i):
+        fallback = self.__fallback
+        fallback.rawdata = rawdata
+        if rawdata[i + 1:i + 2] in LETTERS:
+            k = fallback.parse_starttag(i)
+            if fallback.cdata_elem is not None:
+                self.__setCdataMode(fallback.cdata_elem)
+                fallback.clear_cdata_mode()
+        elif rawdata.startswith("</", i):
+            k = fallback.parse_endtag(i)
+        elif rawdata.startswith("<!--", i):
+            k = fallback.parse_comment(i)
+        elif rawdata.startswith("<?", i):
+            k = fallback.parse_pi(i)
+        elif rawdata.startswith("<!", i):
+            k = fallback.parse_html_declaration(i)
+        elif i + 1 < len(rawdata):
+            self.__builder.handle_data("<")
+            k = i + 1
+        else:
+            k = -1
+        fallback.rawdata = ''
+        return k
+
+
+'''
+    Tokenizer classes for HTMLDomParser's 'tokenizer' argument
+'''
+TOKENIZER = {
+    "STDLIB": StdlibTokenizer,
+    "FAST": FastTokenizer,
+}